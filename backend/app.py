@@ -1,52 +1,316 @@
-from flask import Flask, request, jsonify
+import hashlib
+import hmac
+import json
+import os
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, as_completed, wait
+from urllib.parse import urlencode
+from flask import Flask, g, request, jsonify
 from flask_cors import CORS
-import pandas as pd
-import numpy as np
-from sklearn.metrics import mean_absolute_error, r2_score
-from sklearn.linear_model import LinearRegression
-from sklearn.ensemble import RandomForestRegressor
-from data.loader import load_data
-from model.train_randomForest import  (train_random_forest_model, hyper_tune_random_forest) 
-from model.train_linearRegression import (train_linear_regression_model, hyper_tune_linear_regression)
+from data.aggregates import AggregateError, get_aggregates
+from data.cache import DEFAULT_CACHE_DIR
+from data.loader import get_dataset_store
+from data.payload import DataPayload, get_data_payload
+from data.query import QUERY_PARAMETERS, QueryError, encode_cursor, get_dataset_index, parse_query
+from data.snapshots import DatasetManager
+from instrumentation import init_app as init_instrumentation, metrics
+from model.backtest import DEFAULT_HORIZONS, DEFAULT_MAX_FOLDS, DEFAULT_MIN_TRAIN_YEARS, Backtester
+from model.comparison import DEFAULT_FOLDS, ModelComparison
+from model.forecast import (FORECAST_MODELS, RANDOM_FOREST_PARAMS, ForecastError, forecast_linear, forecast_random_forest)
+from model.forest import default_builder
+from model.jobs import JobManager
+from model.pipeline import default_pipeline
+from model.registry import ModelRegistry
+from model.result_cache import TrainingResultCache, train_cached, training_response
+from model.trend import extend_linear_trends, get_linear_trends
+from serialization import JSON_MIMETYPE, dumps, json_provider, negotiate, respond
 
 
 app = Flask(__name__)
-CORS(app, resources={r"/*": {"origins": "*"}})  # Enable CORS for all routes
-
-# Load data globally
-voter_data = load_data()
+# NumPy arrays in responses are encoded directly (orjson when installed), not via lists
+app.json = json_provider(app)
+CORS(app, resources={r"/*": {"origins": "*"}}, expose_headers=["ETag", "X-Total-Count", "X-Next-Cursor", "Link", "X-Dataset-Version"])  # Enable CORS for all routes
+
+# Load data globally, as immutable snapshots that can be swapped without a restart
+dataset_manager = DatasetManager(get_dataset_store())
+
+def warm_linear_trends(snapshot):
+    # Appended rows update the parent version's trend lines instead of refitting them
+    if snapshot.appended is not None:
+        extend_linear_trends(snapshot.parent, snapshot.version, snapshot.appended)
+    get_linear_trends(snapshot.frame, snapshot.version)
+
+def warm_cleaning_statistics(snapshot):
+    # Medians, clipping bounds and ranges of appended versions are updated, not recomputed
+    if snapshot.appended is not None:
+        parent_rows = snapshot.frame.iloc[:len(snapshot.frame) - len(snapshot.appended)]
+        default_pipeline.extend_statistics(snapshot.parent, parent_rows, snapshot.version, snapshot.appended)
+
+dataset_manager.add_warmer(warm_linear_trends)
+dataset_manager.add_warmer(warm_cleaning_statistics)
+dataset_manager.add_warmer(lambda snapshot: get_data_payload(snapshot.frame, snapshot.version))
+dataset_manager.add_warmer(lambda snapshot: get_dataset_index(snapshot.frame, snapshot.version))
+dataset_manager.add_warmer(lambda snapshot: get_aggregates(snapshot.frame, snapshot.version))
+DATASET_WATCH_INTERVAL = float(os.environ.get('VOTER_DATA_WATCH_INTERVAL', 5))
+
+# /dataset/reload and /dataset/append change the data every client is served: like the profiler,
+# they are off unless DATASET_ADMIN_TOKEN is set, and then need the header `X-Admin-Token: <token>`
+DATASET_ADMIN_TOKEN = os.environ.get('DATASET_ADMIN_TOKEN')
+ADMIN_TOKEN_HEADER = 'X-Admin-Token'
+
+def dataset_admin_denied():
+    """A 403 response unless the request carries the dataset admin token, else None."""
+    token = request.headers.get(ADMIN_TOKEN_HEADER, '')
+    if DATASET_ADMIN_TOKEN and hmac.compare_digest(token.encode(), DATASET_ADMIN_TOKEN.encode()):
+        return None
+    return jsonify({"error": f"Dataset changes need DATASET_ADMIN_TOKEN to be set and sent as {ADMIN_TOKEN_HEADER}"}), 403
+
+
+def current_dataset():
+    """The dataset snapshot used for the whole current request."""
+    if 'dataset' not in g:
+        g.dataset = dataset_manager.current()
+    return g.dataset
+
+
+# Fitted per-column models for /predict-randomforest
+MODEL_REGISTRY_PATH = os.environ.get('MODEL_REGISTRY_PATH', os.path.join(os.path.dirname(DEFAULT_CACHE_DIR), 'models', 'registry.joblib'))
+
+MODEL_REGISTRY_WARM = bool(os.environ.get('MODEL_REGISTRY_WARM'))
+
+model_registry = ModelRegistry(max_bytes=int(os.environ.get('MODEL_REGISTRY_MAX_MB', 256)) * 1024 * 1024)
+# Random forests grown for training, tuning and the registry's fits (see model.forest)
+default_builder.max_bytes = int(os.environ.get('FOREST_CACHE_MAX_MB', 256)) * 1024 * 1024
+
+def carry_over_models(snapshot):
+    # Before a reloaded dataset goes live, refit the models in use for the current version;
+    # after an append, keep the models of untouched columns and mark the others stale
+    if snapshot.appended is not None:
+        changed = [column for column in snapshot.appended.columns
+                   if column != 'Year' and snapshot.appended[column].notna().any()]
+        model_registry.append_version(snapshot.parent, snapshot.version, changed)
+    else:
+        model_registry.carry_over(snapshot.frame, dataset_manager.current().version, snapshot.version)
+
+dataset_manager.add_warmer(carry_over_models)
+
+def warm_model_registry(snapshot):
+    # Pre-fit every column once and share the result with the other workers
+    model_registry.warm(snapshot.frame, snapshot.version, [('random_forest', RANDOM_FOREST_PARAMS)])
+    model_registry.save(MODEL_REGISTRY_PATH)
+
+if MODEL_REGISTRY_WARM:
+    dataset_manager.add_warmer(warm_model_registry)
+
+# Dataset, saved models and trend lines are loaded after boot, in a background thread;
+# /healthz answers as soon as the process is up and /readyz once it is warm
+warm_up_state = {'pid': None, 'thread': None, 'ready': False, 'error': None}
+
+def warm_up():
+    try:
+        model_registry.load(MODEL_REGISTRY_PATH)
+        snapshot = dataset_manager.current()
+        get_linear_trends(snapshot.frame, snapshot.version)
+        if MODEL_REGISTRY_WARM:
+            warm_model_registry(snapshot)
+        warm_up_state['ready'] = True
+    except Exception as e:
+        app.logger.exception("Warm-up failed")
+        warm_up_state['error'] = str(e)
+
+def start_warm_up():
+    # Once per process, so a worker forked before the warm-up finished runs its own
+    if warm_up_state['ready'] or warm_up_state['pid'] == os.getpid():
+        return
+    thread = threading.Thread(target=warm_up, name='warm-up', daemon=True)
+    warm_up_state.update(pid=os.getpid(), thread=thread, error=None)
+    thread.start()
+
+start_warm_up()
+
+# Worker pool for /predict/batch scenarios
+BATCH_WORKERS = int(os.environ.get('BATCH_WORKERS', 4))
+MAX_BATCH_SCENARIOS = int(os.environ.get('MAX_BATCH_SCENARIOS', 10000))
+batch_executor = ThreadPoolExecutor(max_workers=BATCH_WORKERS, thread_name_prefix='predict-batch')
+
+# Fitted estimators, metrics and best parameters of /train-* and tuning requests, shared by the
+# workers through the disk and kept across restarts (see model.result_cache)
+training_cache = TrainingResultCache(
+    os.environ.get('TRAINING_CACHE_DIR', os.path.join(os.path.dirname(DEFAULT_CACHE_DIR), 'training')),
+    max_bytes=int(os.environ.get('TRAINING_CACHE_MAX_MB', 512)) * 1024 * 1024,
+)
+
+# Background training/tuning jobs (see model.jobs)
+job_manager = JobManager(
+    os.environ.get('JOB_STATE_DIR', os.path.join(os.path.dirname(DEFAULT_CACHE_DIR), 'jobs')),
+    max_workers=int(os.environ.get('JOB_WORKERS', 2)),
+    cpu_budget=int(os.environ.get('JOB_CPU_BUDGET', 1)),
+    training_cache=training_cache,
+)
+
+# Process pool for /compare-models (0 trains the candidates in the web worker)
+model_comparison = ModelComparison(max_workers=int(os.environ.get('COMPARE_WORKERS', 2)))
+backtester = Backtester(max_workers=int(os.environ.get('BACKTEST_WORKERS', 2)),
+                        max_folds=int(os.environ.get('BACKTEST_MAX_FOLDS', DEFAULT_MAX_FOLDS)))
+
+# Latency histograms, stage timers and cache counters on /metrics, summed over gunicorn workers
+metrics.set_directory(os.environ.get('METRICS_DIR', os.path.join(os.path.dirname(DEFAULT_CACHE_DIR), 'metrics')))
+metrics.register_cache('dataset_snapshots', lambda: {key: value for key, value in dataset_manager.stats().items() if key != 'version'})
+metrics.register_cache('dataset', lambda: {key: value for key, value in get_dataset_store().stats().items() if key != 'fetched_at'})
+metrics.register_cache('model_registry', model_registry.stats, gauges=('stale',))
+metrics.register_cache('cleaning_pipeline', default_pipeline.stats)
+metrics.register_cache('forest_builder', default_builder.stats)
+metrics.register_cache('model_comparison', model_comparison.stats, gauges=('fold_sets', 'workers'))
+metrics.register_cache('backtest', backtester.stats, gauges=('versions', 'folds', 'workers'))
+metrics.register_cache('training_results', training_cache.stats)
+init_instrumentation(app, profile_dir=os.path.join(os.path.dirname(DEFAULT_CACHE_DIR), 'profiles'))
+
+# Layouts of /data bodies: a list of row objects, or one array per column
+DATA_SHAPES = ('records', 'columns')
+
+def format_tag(mimetype):
+    # Bodies in other formats get their own ETag, so caches never mix them up
+    return '' if mimetype == JSON_MIMETYPE else '-' + mimetype.rsplit('/', 1)[-1].rsplit('.', 1)[-1]
 
 @app.route('/data', methods=['GET'])
 def get_data():
     try:
-        # Load the data
-        voter_data = load_data()
-        
-        # Strip any leading/trailing spaces in column names
-        voter_data.columns = voter_data.columns.str.strip()
-
-        # Replace NaN values with None to make JSON-compliant
-        voter_data = voter_data.where(pd.notnull(voter_data), None)
-
-        # Convert the DataFrame to a dictionary to send as JSON
-        data = voter_data.to_dict(orient="records")
-        return jsonify(data)
+        dataset = current_dataset()
+        if any(parameter in request.args for parameter in QUERY_PARAMETERS):
+            return query_data(dataset)
+        shape = request.args.get('shape', 'records')
+        if shape not in DATA_SHAPES:
+            return jsonify({"error": f"'shape' must be one of {list(DATA_SHAPES)}"}), 400
+        mimetype = negotiate(request.accept_mimetypes, tabular=True)
+
+        # Parse the optional column projection and row window
+        columns = request.args.get('columns')
+        columns = [column.strip() for column in columns.split(',') if column.strip()] if columns else None
+        try:
+            offset = int(request.args.get('offset', 0))
+            limit = request.args.get('limit')
+            limit = int(limit) if limit is not None else None
+        except ValueError:
+            return jsonify({"error": "'offset' and 'limit' must be integers"}), 400
+        if offset < 0 or (limit is not None and limit < 0):
+            return jsonify({"error": "'offset' and 'limit' must be non-negative"}), 400
+        full = columns is None and offset == 0 and limit is None and shape == 'records' and mimetype == JSON_MIMETYPE
+
+        # Answer conditional requests before doing any pandas work
+        query_tag = '' if full else f"-{hashlib.sha1(request.query_string).hexdigest()[:8]}{format_tag(mimetype)}"
+        if request.if_none_match.contains(dataset.version + query_tag):
+            response = app.response_class(status=304)
+            response.set_etag(dataset.version + query_tag)
+            return response
+
+        # Serialized payload for the current dataset version
+        payload = get_data_payload(dataset.frame, dataset.version)
+        etag = payload.version + query_tag
+        unknown = [column for column in columns or [] if column not in payload.arrays]
+        if unknown:
+            return jsonify({"error": f"Invalid columns: {unknown}"}), 400
+
+        encoding = request.accept_encodings.best_match(DataPayload.available_encodings(), default='identity')
+        if full:
+            body = payload.encoded[encoding]
+        else:
+            body = DataPayload.compress(payload.encode(mimetype, shape, columns=columns, offset=offset, limit=limit), encoding)
+
+        response = app.response_class(body, mimetype=mimetype)
+        if encoding != 'identity':
+            response.headers['Content-Encoding'] = encoding
+        response.headers['Vary'] = 'Accept, Accept-Encoding'
+        response.headers['X-Total-Count'] = str(payload.n_rows)
+        response.set_etag(etag)
+        return response
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
 
+def query_data(dataset):
+    # Filtered, sorted and paginated /data through the dataset's Year/partition index
+    shape = request.args.get('shape', 'records')
+    if shape not in DATA_SHAPES:
+        return jsonify({"error": f"'shape' must be one of {list(DATA_SHAPES)}"}), 400
+    mimetype = negotiate(request.accept_mimetypes, tabular=True)
+    etag = f"{dataset.version}-{hashlib.sha1(request.query_string).hexdigest()[:8]}{format_tag(mimetype)}"
+    if request.if_none_match.contains(etag):
+        response = app.response_class(status=304)
+        response.set_etag(etag)
+        return response
+
+    index = get_dataset_index(dataset.frame, dataset.version)
+    try:
+        query = parse_query(request.args, index)
+    except QueryError as e:
+        return jsonify({"error": str(e)}), 400
+
+    rows = index.select(query)
+    stop = len(rows) if query.limit is None else min(query.offset + query.limit, len(rows))
+    payload = get_data_payload(dataset.frame, dataset.version)
+    body = payload.encode(mimetype, shape, positions=rows[query.offset:stop], columns=query.columns)
+
+    encoding = request.accept_encodings.best_match(DataPayload.available_encodings(), default='identity')
+    response = app.response_class(DataPayload.compress(body, encoding), mimetype=mimetype)
+    if encoding != 'identity':
+        response.headers['Content-Encoding'] = encoding
+    response.headers['Vary'] = 'Accept, Accept-Encoding'
+    response.headers['X-Total-Count'] = str(len(rows))
+    if stop < len(rows):
+        cursor = encode_cursor(dataset.version, request.args, stop)
+        response.headers['X-Next-Cursor'] = cursor
+        next_args = [(name, value) for name, value in request.args.items(multi=True) if name not in ('cursor', 'offset')]
+        response.headers['Link'] = f'<{request.path}?{urlencode(next_args + [("cursor", cursor)])}>; rel="next"'
+    response.set_etag(etag)
+    return response
+
+
+
+@app.route('/aggregates/<group>', methods=['GET'])
+def get_group_aggregates(group):
+    try:
+        dataset = current_dataset()
+        aggregates = get_aggregates(dataset.frame, dataset.version)
+        if group not in aggregates.groups():
+            return jsonify({"error": f"Unknown group '{group}'. Available groups: {aggregates.groups()}"}), 404
+
+        # Optional histogram parameters; the defaults are served precomputed
+        try:
+            bins = request.args.get('bins', type=int)
+            bin_min = request.args.get('bin_min', type=float)
+            bin_max = request.args.get('bin_max', type=float)
+            if any(request.args.get(name) and value is None
+                   for name, value in (('bins', bins), ('bin_min', bin_min), ('bin_max', bin_max))):
+                return jsonify({"error": "'bins' must be an integer and 'bin_min'/'bin_max' numbers"}), 400
+            etag, encoded = aggregates.payload(group, bins, bin_min, bin_max)
+        except AggregateError as e:
+            return jsonify({"error": str(e)}), 400
+
+        if request.if_none_match.contains(etag):
+            response = app.response_class(status=304)
+            response.set_etag(etag)
+            return response
+        encoding = request.accept_encodings.best_match(DataPayload.available_encodings(), default='identity')
+        response = app.response_class(encoded[encoding], mimetype='application/json')
+        if encoding != 'identity':
+            response.headers['Content-Encoding'] = encoding
+        response.headers['Vary'] = 'Accept-Encoding'
+        response.set_etag(etag)
+        return response
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
 
 @app.route('/train-randomforest', methods=['POST'])
 def train_random_forest():
     try:
-        # Train the Random Forest model and get metrics
-        _, metrics = train_random_forest_model(voter_data)
+        # Train the Random Forest model and get metrics (stored results are reused)
+        dataset = current_dataset()
+        result = train_cached(training_cache, 'train-randomforest', dataset.frame, dataset.version)
 
         # Return success message and metrics
-        return jsonify({
-            "message": "Random Forest model trained successfully",
-            "metrics": metrics
-        }), 200
+        return jsonify(training_response('train-randomforest', result)), 200
 
     except KeyError as e:
         return jsonify({"error": f"KeyError: Missing or incorrect column name - {str(e)}"}), 400
@@ -60,23 +324,20 @@ def train_random_forest():
 @app.route('/hyperparameter-tuning-randomforest', methods=['POST'])
 def hyper_tune_random_forest_api():
     try:
-        # Define hyperparameter grid
-        param_grid = {
-            'n_estimators': [50, 100, 200],
-            'max_depth': [None, 10, 20],
-            'min_samples_split': [2, 5],
-            'min_samples_leaf': [1, 2]
-        }
-
-        # Perform hyperparameter tuning and evaluation
-        _, metrics, best_params = hyper_tune_random_forest(voter_data, param_grid)
-
-        # Return success message, metrics, and best parameters
-        return jsonify({
-            "message": "Random Forest model trained and tuned successfully",
-            "best_params": best_params,
-            "metrics": metrics
-        }), 200
+        from model.hyperparameter_tuning import parse_search_options
+
+        # Optional caller-supplied grid (the model's default grid otherwise) and search strategy/budget
+        data = request.get_json(silent=True) or {}
+        param_grid = data.get('param_grid')
+        search = parse_search_options(data.get('search'))
+
+        # Perform hyperparameter tuning and evaluation (a repeated grid/search returns the stored result)
+        dataset = current_dataset()
+        result = train_cached(training_cache, 'hyperparameter-tuning-randomforest', dataset.frame, dataset.version,
+                              param_grid=param_grid, search=search)
+
+        # Return success message, metrics, best parameters and the search cost
+        return jsonify(training_response('hyperparameter-tuning-randomforest', result)), 200
 
     except KeyError as e:
         return jsonify({"error": f"KeyError: Missing or incorrect column name - {str(e)}"}), 400
@@ -88,14 +349,12 @@ def hyper_tune_random_forest_api():
 @app.route('/train-linear-regression', methods=['POST'])
 def train_linear_regression():
     try:
-        # Train the Linear Regression model and get metrics
-        _, metrics = train_linear_regression_model(voter_data)
+        # Train the Linear Regression model and get metrics (stored results are reused)
+        dataset = current_dataset()
+        result = train_cached(training_cache, 'train-linear-regression', dataset.frame, dataset.version)
 
         # Return success message and metrics
-        return jsonify({
-            "message": "Linear Regression model trained successfully",
-            "metrics": metrics
-        }), 200
+        return jsonify(training_response('train-linear-regression', result)), 200
 
     except KeyError as e:
         return jsonify({"error": f"KeyError: Missing or incorrect column name - {str(e)}"}), 400
@@ -107,20 +366,54 @@ def train_linear_regression():
 @app.route('/hyperparameter-tuning-linear', methods=['POST'])
 def hyper_tune_linear_regression_api():
     try:
-        # Define hyperparameter grid for Lasso Regression
-        param_grid = {
-            'alpha': [0.01, 0.1, 1, 10],  # Regularization strength
-            'fit_intercept': [True, False]
-        }
+        from model.hyperparameter_tuning import parse_search_options
 
-        # Perform hyperparameter tuning and evaluation
-        _, metrics, best_params = hyper_tune_linear_regression(voter_data, param_grid)
+        # Optional caller-supplied grid (the model's default grid otherwise) and search strategy/budget
+        data = request.get_json(silent=True) or {}
+        param_grid = data.get('param_grid')
+        search = parse_search_options(data.get('search'))
 
-        # Return success message, metrics, and best parameters
+        # Perform hyperparameter tuning and evaluation (a repeated grid/search returns the stored result)
+        dataset = current_dataset()
+        result = train_cached(training_cache, 'hyperparameter-tuning-linear', dataset.frame, dataset.version,
+                              param_grid=param_grid, search=search)
+
+        # Return success message, metrics, best parameters and the search cost
+        return jsonify(training_response('hyperparameter-tuning-linear', result)), 200
+
+    except KeyError as e:
+        return jsonify({"error": f"KeyError: Missing or incorrect column name - {str(e)}"}), 400
+    except ValueError as e:
+        return jsonify({"error": f"ValueError: Invalid data or parameters - {str(e)}"}), 400
+    except Exception as e:
+        return jsonify({"error": f"An unexpected error occurred: {str(e)}"}), 500
+
+
+@app.route('/compare-models', methods=['POST'])
+def compare_models():
+    try:
+        # Optional candidate list, per-candidate hyperparameters, fold count and ranking metric
+        data = request.get_json(silent=True) or {}
+        if not isinstance(data, dict):
+            return jsonify({"error": "The request body must be a JSON object"}), 400
+        models = data.get('models')
+        if models is not None and not (isinstance(models, list) and all(isinstance(name, str) for name in models)):
+            return jsonify({"error": "'models' must be a list of model names"}), 400
+
+        dataset = current_dataset()
+        started = time.perf_counter()
+        comparison = model_comparison.compare(
+            dataset.frame, dataset.version, models=models, params=data.get('params'),
+            n_folds=data.get('folds', DEFAULT_FOLDS), rank_by=data.get('rank_by', 'rmse'))
+        if not comparison['leaderboard']:
+            return jsonify({"error": "Every candidate model failed", "failed": comparison['failed']}), 400
+
+        # Return the leaderboard, best model first
         return jsonify({
-            "message": "Linear Regression (Lasso) model trained and tuned successfully",
-            "best_params": best_params,
-            "metrics": metrics
+            "message": "Models compared successfully",
+            "dataset_version": dataset.version,
+            "seconds": round(time.perf_counter() - started, 3),
+            **comparison
         }), 200
 
     except KeyError as e:
@@ -130,65 +423,51 @@ def hyper_tune_linear_regression_api():
     except Exception as e:
         return jsonify({"error": f"An unexpected error occurred: {str(e)}"}), 500
 
+@app.route('/backtest', methods=['POST'])
+def backtest():
+    try:
+        # Rolling-origin error tables: models, columns, hyperparameters, horizons and cutoffs are optional
+        data = request.get_json(silent=True) or {}
+        if not isinstance(data, dict):
+            return jsonify({"error": "The request body must be a JSON object"}), 400
+        for name in ('models', 'columns', 'cutoffs'):
+            if data.get(name) is not None and not isinstance(data[name], list):
+                return jsonify({"error": f"'{name}' must be a list"}), 400
+
+        dataset = current_dataset()
+        started = time.perf_counter()
+        result = backtester.backtest(
+            dataset.frame, dataset.version, models=data.get('models'), columns=data.get('columns'),
+            params=data.get('params'), horizons=data.get('horizons', DEFAULT_HORIZONS),
+            min_train_years=data.get('min_train_years', DEFAULT_MIN_TRAIN_YEARS), cutoffs=data.get('cutoffs'))
+
+        return jsonify({
+            "message": "Backtest completed successfully",
+            "dataset_version": dataset.version,
+            "seconds": round(time.perf_counter() - started, 3),
+            **result
+        }), 200
+
+    except ValueError as e:
+        return jsonify({"error": f"ValueError: Invalid data or parameters - {str(e)}"}), 400
+    except Exception as e:
+        return jsonify({"error": f"An unexpected error occurred: {str(e)}"}), 500
 
 
 @app.route('/predict', methods=['POST'])
 def predict():
     try:
         data = request.json
-        print("linear data: ", data)
+        app.logger.debug("linear data: %s", data)
         selected_columns = data.get('columns', [])  # List of column headers to predict for
         predict_years = data.get('predict_years')
 
-        if not selected_columns or not isinstance(selected_columns, list):
-            return jsonify({"error": "Invalid or missing 'columns' parameter"}), 400
-        if not predict_years:
-            return jsonify({"error": "Missing 'predict_years' parameter"}), 400
-
-        # Combine years from the dataset and prediction years
-        min_year = voter_data['Year'].min()
-        max_year = max(predict_years)
-        full_years = np.arange(min_year, max_year + 1).tolist()  # Start from the earliest year in data
-
-        predictions = {}
-        actual_data = {}
-        metrics = {}
-
-        for column in selected_columns:
-            if column not in voter_data.columns:
-                return jsonify({"error": f"Invalid column '{column}'"}), 400
-
-            # Extract actual data
-            valid_data = voter_data[['Year', column]].dropna()
-            actual_values = valid_data[column].values
-            actual_years = valid_data['Year'].values.tolist()
-
-            # Train and predict
-            model = LinearRegression()
-            model.fit(valid_data['Year'].values.reshape(-1, 1), actual_values)
-            predicted_values = model.predict(np.array(full_years).reshape(-1, 1)).tolist()
-
-            # Calculate metrics
-            metrics[column] = {
-                "mae": float(mean_absolute_error(actual_values, model.predict(valid_data['Year'].values.reshape(-1, 1)))),
-                "r2": float(r2_score(actual_values, model.predict(valid_data['Year'].values.reshape(-1, 1)))),
-            }
-
-            predictions[column] = predicted_values
-            actual_data[column] = {
-                "years": actual_years,
-                "values": actual_values.tolist()
-            }
-
         # Return predictions, actual data, and metrics
-        return jsonify({
-            "message": "Prediction successful",
-            "predictions": predictions,
-            "actual_data": actual_data,
-            "metrics": metrics,
-            "years": full_years
-        }), 200
+        dataset = current_dataset()
+        return respond(forecast_linear(dataset.frame, dataset.version, selected_columns, predict_years))
 
+    except ForecastError as e:
+        return jsonify({"error": str(e)}), 400
     except Exception as e:
         return jsonify({"error": f"An unexpected error occurred: {str(e)}"}), 500
 
@@ -196,64 +475,76 @@ def predict():
 def predict_random_forest():
     try:
         data = request.json
-        print("random-forest data", data)
-        
-        # Sanitize user inputs
-        selected_columns = [col.strip() for col in data.get('columns', [])]  # Remove extra whitespace
+        app.logger.debug("random-forest data: %s", data)
+        selected_columns = data.get('columns', [])
         predict_years = data.get('predict_years')
+        # Optional share of the trees' predictions to report as an interval, e.g. 0.9
+        interval = data.get('interval')
 
-        # Validate inputs
-        if not selected_columns or not isinstance(selected_columns, list):
-            return jsonify({"error": "Invalid or missing 'columns' parameter"}), 400
-        if not predict_years:
-            return jsonify({"error": "Missing 'predict_years' parameter"}), 400
-
-        # Clean column names in the dataset
-        voter_data.columns = voter_data.columns.str.strip()  # Strip whitespace from column names
-
-        # Combine years from the dataset and prediction years
-        min_year = voter_data['Year'].min()
-        max_year = max(predict_years)
-        full_years = np.arange(min_year, max_year + 1).tolist()
-
-        predictions = {}
-        actual_data = {}
-        metrics = {}
-
-        for column in selected_columns:
-            if column not in voter_data.columns:
-                return jsonify({"error": f"Invalid column '{column}'"}), 400
-
-            # Align Year and column data
-            valid_data = voter_data[['Year', column]].dropna()
-            actual_values = valid_data[column].values
-            actual_years = valid_data['Year'].values.tolist()
-
-            # Train and predict using Random Forest
-            model = RandomForestRegressor(random_state=42, n_estimators=100)
-            model.fit(valid_data['Year'].values.reshape(-1, 1), actual_values)
-            predicted_values = model.predict(np.array(full_years).reshape(-1, 1)).tolist()
-
-            # Calculate metrics
-            metrics[column] = {
-                "mae": float(mean_absolute_error(actual_values, model.predict(valid_data['Year'].values.reshape(-1, 1)))),
-                "r2": float(r2_score(actual_values, model.predict(valid_data['Year'].values.reshape(-1, 1)))),
-            }
-
-            predictions[column] = predicted_values
-            actual_data[column] = {
-                "years": actual_years,
-                "values": actual_values.tolist()
-            }
+        # Return predictions, actual data, and metrics (snapshot column names are already stripped)
+        dataset = current_dataset()
+        return respond(forecast_random_forest(dataset.frame, dataset.version, selected_columns, predict_years, model_registry,
+                                              interval=interval))
 
-        # Return predictions, actual data, and metrics
-        return jsonify({
-            "message": "Prediction successful",
-            "predictions": predictions,
-            "actual_data": actual_data,
-            "metrics": metrics,
-            "years": full_years
-        }), 200
+    except ForecastError as e:
+        return jsonify({"error": str(e)}), 400
+    except Exception as e:
+        return jsonify({"error": f"An unexpected error occurred: {str(e)}"}), 500
+
+@app.route('/predict/batch', methods=['POST'])
+def predict_batch():
+    try:
+        data = request.get_json(silent=True) or {}
+        scenarios = data.get('scenarios')
+        include_actual = bool(data.get('include_actual', True))
+        include_metrics = bool(data.get('include_metrics', True))
+
+        if not scenarios or not isinstance(scenarios, list):
+            return jsonify({"error": "Invalid or missing 'scenarios' parameter"}), 400
+        if len(scenarios) > MAX_BATCH_SCENARIOS:
+            return jsonify({"error": f"At most {MAX_BATCH_SCENARIOS} scenarios per batch"}), 400
+        # Every scenario of the batch sees the same dataset version, even across a reload
+        dataset = current_dataset()
+
+        def run_scenario(index, scenario):
+            # One NDJSON line per scenario; failures are reported in-line, not raised
+            line = {"index": index}
+            try:
+                if not isinstance(scenario, dict):
+                    raise ForecastError("Each scenario must be an object")
+                if 'id' in scenario:
+                    line["id"] = scenario['id']
+                model_type = scenario.get('model', 'linear')
+                columns = scenario.get('columns', [])
+                predict_years = scenario.get('predict_years')
+                if model_type == 'linear':
+                    result = forecast_linear(dataset.frame, dataset.version, columns, predict_years,
+                                             include_actual=include_actual, include_metrics=include_metrics)
+                elif model_type == 'random_forest':
+                    result = forecast_random_forest(dataset.frame, dataset.version, columns, predict_years, model_registry,
+                                                    include_actual=include_actual, include_metrics=include_metrics)
+                else:
+                    raise ForecastError(f"Invalid model '{model_type}', expected one of {list(FORECAST_MODELS)}")
+                line.update(status=200, **result)
+            except ForecastError as e:
+                line.update(status=400, error=str(e))
+            except Exception as e:
+                line.update(status=500, error=f"An unexpected error occurred: {str(e)}")
+            return dumps(line) + b"\n"
+
+        def stream():
+            # Keep at most a few scenarios in flight so memory stays bounded
+            in_flight = set()
+            for index, scenario in enumerate(scenarios):
+                if len(in_flight) >= 2 * BATCH_WORKERS:
+                    done, in_flight = wait(in_flight, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        yield future.result()
+                in_flight.add(batch_executor.submit(run_scenario, index, scenario))
+            for future in as_completed(in_flight):
+                yield future.result()
+
+        return app.response_class(stream(), mimetype='application/x-ndjson')
 
     except Exception as e:
         return jsonify({"error": f"An unexpected error occurred: {str(e)}"}), 500
@@ -261,11 +552,172 @@ def predict_random_forest():
 
 
 
+@app.route('/jobs/<kind>', methods=['POST'])
+def submit_job(kind):
+    try:
+        from model.hyperparameter_tuning import parse_search_options
+
+        data = request.get_json(silent=True) or {}
+        params = {}
+        if data.get('param_grid') is not None:
+            if not isinstance(data['param_grid'], dict):
+                return jsonify({"error": "'param_grid' must be an object"}), 400
+            params['param_grid'] = data['param_grid']
+        if data.get('search') is not None:
+            params['search'] = parse_search_options(data['search'])
+
+        dataset = current_dataset()
+        job, created = job_manager.submit(kind, dataset.frame, dataset.version, params, n_jobs=data.get('n_jobs'))
+        response = jsonify({"job_id": job['id'], "status": job['status'], "deduplicated": not created})
+        response.headers['Location'] = f"/jobs/{job['id']}"
+        return response, 202
+
+    except ValueError as e:
+        return jsonify({"error": f"ValueError: Invalid data or parameters - {str(e)}"}), 400
+    except RuntimeError as e:
+        return jsonify({"error": str(e)}), 503
+    except Exception as e:
+        return jsonify({"error": f"An unexpected error occurred: {str(e)}"}), 500
+
+@app.route('/jobs/<job_id>', methods=['GET'])
+def get_job(job_id):
+    job = job_manager.get(job_id)
+    if job is None:
+        return jsonify({"error": f"Unknown job '{job_id}'"}), 404
+    # The result is served separately by /jobs/<id>/result; the owner is internal
+    return jsonify({key: value for key, value in job.items() if key not in ('result', 'key', 'owner')}), 200
+
+@app.route('/jobs/<job_id>/result', methods=['GET'])
+def get_job_result(job_id):
+    job = job_manager.get(job_id)
+    if job is None:
+        return jsonify({"error": f"Unknown job '{job_id}'"}), 404
+    if job['status'] == 'succeeded':
+        return jsonify(job['result']), 200
+    if job['status'] == 'failed':
+        return jsonify({"error": job['error']}), 500
+    if job['status'] == 'cancelled':
+        return jsonify({"error": "Job was cancelled"}), 409
+    return jsonify({"job_id": job['id'], "status": job['status']}), 202
+
+@app.route('/jobs/<job_id>', methods=['DELETE'])
+def cancel_job(job_id):
+    job = job_manager.cancel(job_id)
+    if job is None:
+        return jsonify({"error": f"Unknown job '{job_id}'"}), 404
+    return jsonify({"job_id": job['id'], "status": job['status']}), 200
+
+@app.route('/jobs/<job_id>/events', methods=['GET'])
+def stream_job_events(job_id):
+    if job_manager.get(job_id) is None:
+        return jsonify({"error": f"Unknown job '{job_id}'"}), 404
+
+    def events():
+        # Server-sent events: one message per status change until the job finishes
+        last_status = None
+        while True:
+            job = job_manager.get(job_id)
+            if job['status'] != last_status:
+                last_status = job['status']
+                yield f"event: status\ndata: {json.dumps({'job_id': job_id, 'status': last_status})}\n\n"
+            if last_status in ('succeeded', 'failed', 'cancelled'):
+                return
+            time.sleep(0.5)
+
+    return app.response_class(events(), mimetype='text/event-stream', headers={'Cache-Control': 'no-cache'})
+
+
+
+@app.before_request
+def watch_dataset():
+    # Started lazily so that each forked gunicorn worker runs its own watcher and warm-up
+    start_warm_up()
+    dataset_manager.watch(DATASET_WATCH_INTERVAL)
+
+@app.after_request
+def add_dataset_version(response):
+    if 'dataset' in g:
+        response.headers['X-Dataset-Version'] = g.dataset.version
+    return response
+
+@app.route('/healthz', methods=['GET'])
+def healthz():
+    # Liveness: the process has booted and serves requests
+    return jsonify({"status": "ok"}), 200
+
+@app.route('/readyz', methods=['GET'])
+def readyz():
+    # Readiness: the dataset, saved models and trend lines are loaded
+    if warm_up_state['ready']:
+        return jsonify({"status": "ready", "dataset_version": dataset_manager.current().version}), 200
+    if warm_up_state['error']:
+        return jsonify({"status": "failed", "error": warm_up_state['error']}), 503
+    return jsonify({"status": "warming"}), 503
+
+@app.route('/dataset', methods=['GET'])
+def get_dataset():
+    dataset = current_dataset()
+    return jsonify({
+        "version": dataset.version,
+        "loaded_at": dataset.loaded_at,
+        "rows": len(dataset.frame),
+        "columns": dataset.frame.columns.tolist(),
+        # Memory report of a chunked ingest (see data.ingest), None for fully parsed files
+        "ingest": dataset_manager.store.ingest_report(dataset.version)
+    }), 200
+
+@app.route('/dataset/reload', methods=['POST'])
+def reload_dataset():
+    denied = dataset_admin_denied()
+    if denied:
+        return denied
+    try:
+        # Revalidate the source and publish a new snapshot if the data changed
+        if request.args.get('wait', '').lower() in ('1', 'true', 'yes'):
+            changed = dataset_manager.reload(block=True)
+            return jsonify({"version": dataset_manager.current().version, "changed": changed}), 200
+        dataset_manager.reload(block=False)
+        return jsonify({"version": dataset_manager.current().version, "status": "reloading"}), 202
+    except Exception as e:
+        return jsonify({"error": f"An unexpected error occurred: {str(e)}"}), 500
+
+
+
+@app.route('/dataset/append', methods=['POST'])
+def append_dataset_rows():
+    denied = dataset_admin_denied()
+    if denied:
+        return denied
+    try:
+        # New rows (e.g. an election year) as {"rows": [{column: value, ...}, ...]}
+        data = request.get_json(silent=True) or {}
+        rows = data.get('rows')
+        if not isinstance(rows, list) or not rows or not all(isinstance(row, dict) for row in rows):
+            return jsonify({"error": "'rows' must be a non-empty list of objects"}), 400
+
+        previous = dataset_manager.current().version
+        snapshot = dataset_manager.append(rows)
+        return jsonify({
+            "message": "Rows appended successfully",
+            "version": snapshot.version,
+            "previous_version": previous,
+            "appended": len(snapshot.appended),
+            "rows": len(snapshot.frame),
+            "stale_models": [{"model_type": model_type, "column": column}
+                             for model_type, column in model_registry.stale_models(snapshot.version)],
+        }), 200
+
+    except ValueError as e:
+        return jsonify({"error": f"ValueError: Invalid data or parameters - {str(e)}"}), 400
+    except Exception as e:
+        return jsonify({"error": f"An unexpected error occurred: {str(e)}"}), 500
+
+
 @app.route('/columns', methods=['GET'])
 def get_columns():
     try:
-        # Assuming voter_data is a Pandas DataFrame
-        columns = voter_data.columns.tolist()  # Extract column names
+        # The snapshot's frame is a Pandas DataFrame
+        columns = current_dataset().frame.columns.tolist()  # Extract column names
         return jsonify({"columns": columns}), 200
     except Exception as e:
         return jsonify({"error": f"An unexpected error occurred: {str(e)}"}), 500
@@ -0,0 +1,258 @@
+# ASGI entry point: cheap routes are served by the event-loop process, sklearn work by a bounded process pool.
+#
+#     uvicorn asgi:app --host 0.0.0.0 --port 3000
+#
+# The handlers are the Flask ones in app.py; the WSGI entry point (gunicorn, see Procfile) is unchanged.
+import asyncio
+import io
+import multiprocessing
+import os
+import sys
+import threading
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+from werkzeug.exceptions import HTTPException
+
+from app import app as flask_app
+from instrumentation import count, metrics
+from offload import handle_request, init_worker, ping
+from serialization import dumps
+
+# Flask endpoints that fit, tune or predict with sklearn. Everything else (/columns, /data,
+# /aggregates, /predict's cached trend lines, jobs, probes) stays in the event-loop process,
+# as does /predict/batch: its scenarios already run on app.batch_executor, and a pool worker
+# would buffer the whole NDJSON stream instead of sending it chunk by chunk.
+OFFLOADED_ENDPOINTS = frozenset({
+    'train_random_forest',
+    'train_linear_regression',
+    'hyper_tune_random_forest_api',
+    'hyper_tune_linear_regression_api',
+    'compare_models',
+    'backtest',
+    'predict_random_forest',
+})
+
+ASYNC_CPU_WORKERS = int(os.environ.get('ASYNC_CPU_WORKERS', os.cpu_count() or 1))
+# CPU-bound requests allowed to wait for a free worker before new ones get a 429
+ASYNC_CPU_QUEUE = int(os.environ.get('ASYNC_CPU_QUEUE', 2 * ASYNC_CPU_WORKERS))
+ASYNC_THREADS = int(os.environ.get('ASYNC_THREADS', 8))
+
+
+# ----------------------------------------------------------------------
+# ASGI adapter
+# ----------------------------------------------------------------------
+class AsgiApp:
+    """
+    ASGI adapter over the Flask app.
+
+    Requests for OFFLOADED_ENDPOINTS are answered by a pool of worker
+    processes that each import the app, so a long fit never holds the GIL
+    of the process serving everything else. At most `max_queue` of them
+    wait for a free worker; beyond that they are turned away with 429 and
+    a Retry-After header, and with 503 when the pool is shut down or a
+    worker crashed. Other requests run on a small thread pool next to the
+    event loop, streaming responses chunk by chunk.
+
+    Args:
+        wsgi_app (Flask): The app.
+        max_workers (int): Worker processes for CPU-bound requests.
+        max_queue (int): CPU-bound requests allowed to wait for a worker.
+        threads (int): Threads serving the other requests.
+        retry_after (int): Seconds suggested to rejected clients.
+    """
+
+    def __init__(self, wsgi_app, max_workers=1, max_queue=2, threads=8, retry_after=1):
+        if max_workers < 1 or max_queue < 0:
+            raise ValueError("max_workers must be positive and max_queue non-negative")
+        self.wsgi_app = wsgi_app
+        self.max_workers = max_workers
+        self.max_queue = max_queue
+        self.retry_after = retry_after
+        self._threads = ThreadPoolExecutor(max_workers=threads, thread_name_prefix='asgi')
+        self._pool = None
+        self._closed = False
+        self._in_flight = 0
+        self._lock = threading.Lock()
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            return await self._lifespan(receive, send)
+        if scope['type'] != 'http':
+            raise RuntimeError(f"Unsupported ASGI scope type '{scope['type']}'")
+
+        body = await _read_body(receive)
+        if body is None:
+            return  # The client went away before sending its body
+        environ = _environ(scope, body)
+        if self._offloaded(environ):
+            await self._offload(environ, body, send)
+        else:
+            await self._serve(environ, body, send)
+
+    def _offloaded(self, environ):
+        try:
+            endpoint, _ = self.wsgi_app.url_map.bind_to_environ(environ).match()
+        except HTTPException:
+            return False  # 404/405 are answered by Flask in this process
+        return endpoint in OFFLOADED_ENDPOINTS
+
+    async def _offload(self, environ, body, send):
+        with self._lock:
+            if self._closed:
+                rejected = 503, "The server is shutting down"
+            elif self._in_flight >= self.max_workers + self.max_queue:
+                rejected = 429, "Too many model requests in progress, retry later"
+            else:
+                rejected = None
+                self._in_flight += 1
+        if rejected is not None:
+            count('asgi', 'rejected' if rejected[0] == 429 else 'unavailable')
+            return await self._error(send, *rejected)
+
+        try:
+            pool = self._executor()
+            count('asgi', 'offloaded')
+            try:
+                status, headers, data = await asyncio.wrap_future(pool.submit(handle_request, environ, body))
+            except BrokenProcessPool:
+                # A worker died (e.g. out of memory); start a fresh pool for the next request
+                with self._lock:
+                    if self._pool is pool:
+                        self._pool = None
+                count('asgi', 'unavailable')
+                return await self._error(send, 503, "A model worker crashed, retry later")
+        finally:
+            with self._lock:
+                self._in_flight -= 1
+        await _send_response(send, status, headers, [data])
+
+    async def _serve(self, environ, body, send):
+        loop = asyncio.get_running_loop()
+        environ.update({'wsgi.input': io.BytesIO(body), 'wsgi.errors': sys.stderr})
+        status, headers, chunks = await loop.run_in_executor(self._threads, _call_wsgi, self.wsgi_app, environ)
+        if isinstance(chunks, (list, tuple)):
+            return await _send_response(send, status, headers, chunks)
+
+        # Streamed responses (e.g. job events) are pulled one chunk at a time off the loop
+        await send({'type': 'http.response.start', 'status': status, 'headers': _encode_headers(headers)})
+        iterator = iter(chunks)
+        try:
+            while True:
+                chunk = await loop.run_in_executor(self._threads, next, iterator, None)
+                if chunk is None:
+                    break
+                if chunk:
+                    await send({'type': 'http.response.body', 'body': chunk, 'more_body': True})
+            await send({'type': 'http.response.body', 'body': b'', 'more_body': False})
+        finally:
+            if hasattr(chunks, 'close'):
+                await loop.run_in_executor(self._threads, chunks.close)
+
+    async def _error(self, send, status, message):
+        headers = [('Content-Type', 'application/json'), ('Retry-After', str(self.retry_after))]
+        await _send_response(send, status, headers, [dumps({"error": message})])
+
+    async def _lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                # Start the workers (and their app imports) before the first heavy request
+                pool = self._executor()
+                for _ in range(self.max_workers):
+                    pool.submit(ping)
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                self.close()
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+    def _executor(self):
+        with self._lock:
+            if self._pool is None:
+                self._pool = ProcessPoolExecutor(self.max_workers, mp_context=multiprocessing.get_context('spawn'),
+                                                 initializer=init_worker)
+            return self._pool
+
+    def close(self):
+        """Stop accepting CPU-bound requests and shut the pools down."""
+        with self._lock:
+            self._closed = True
+            pool, self._pool = self._pool, None
+        if pool is not None:
+            pool.shutdown(wait=False, cancel_futures=True)
+        self._threads.shutdown(wait=False)
+
+    def stats(self):
+        with self._lock:
+            return {'in_flight': self._in_flight, 'max_workers': self.max_workers, 'max_queue': self.max_queue}
+
+
+# ----------------------------------------------------------------------
+# ASGI <-> WSGI translation
+# ----------------------------------------------------------------------
+async def _read_body(receive):
+    chunks = []
+    while True:
+        message = await receive()
+        if message['type'] == 'http.disconnect':
+            return None
+        chunks.append(message.get('body', b''))
+        if not message.get('more_body', False):
+            return b''.join(chunks)
+
+
+def _environ(scope, body):
+    """The WSGI environ of an ASGI HTTP request, without the input/error streams (so it can be pickled)."""
+    server = scope.get('server') or ('localhost', 80)
+    client = scope.get('client') or ('', 0)
+    environ = {
+        'REQUEST_METHOD': scope['method'],
+        'SCRIPT_NAME': scope.get('root_path', '').encode('utf-8').decode('latin-1'),
+        'PATH_INFO': scope['path'].encode('utf-8').decode('latin-1'),
+        'QUERY_STRING': scope.get('query_string', b'').decode('latin-1'),
+        'SERVER_NAME': server[0],
+        'SERVER_PORT': str(server[1]),
+        'SERVER_PROTOCOL': f"HTTP/{scope.get('http_version', '1.1')}",
+        'REMOTE_ADDR': client[0],
+        'REMOTE_PORT': str(client[1]),
+        'CONTENT_LENGTH': str(len(body)),
+        'wsgi.version': (1, 0),
+        'wsgi.url_scheme': scope.get('scheme', 'http'),
+        'wsgi.multithread': True,
+        'wsgi.multiprocess': True,
+        'wsgi.run_once': False,
+    }
+    for name, value in scope.get('headers', []):
+        name = name.decode('latin-1').upper().replace('-', '_')
+        if name == 'CONTENT_LENGTH':
+            continue
+        key = name if name == 'CONTENT_TYPE' else f'HTTP_{name}'
+        value = value.decode('latin-1')
+        # Repeated headers are folded into one value, as a WSGI server would
+        environ[key] = f"{environ[key]}{'; ' if key == 'HTTP_COOKIE' else ','}{value}" if key in environ else value
+    return environ
+
+
+def _call_wsgi(wsgi_app, environ):
+    started = {}
+
+    def start_response(status, headers, exc_info=None):
+        started.update(status=int(status.split(' ', 1)[0]), headers=headers)
+
+    chunks = wsgi_app(environ, start_response)
+    return started['status'], started['headers'], chunks
+
+
+def _encode_headers(headers):
+    return [(name.lower().encode('latin-1'), value.encode('latin-1')) for name, value in headers]
+
+
+async def _send_response(send, status, headers, chunks):
+    await send({'type': 'http.response.start', 'status': status, 'headers': _encode_headers(headers)})
+    await send({'type': 'http.response.body', 'body': b''.join(chunks), 'more_body': False})
+
+
+app = AsgiApp(flask_app, max_workers=ASYNC_CPU_WORKERS, max_queue=ASYNC_CPU_QUEUE, threads=ASYNC_THREADS)
+# Admission-control state: current levels, not event counts
+metrics.register_cache('asgi', app.stats, gauges=('in_flight', 'max_workers', 'max_queue'))
@@ -0,0 +1,181 @@
+"""
+Cleaning benchmark: the per-column cleaning functions against the fused kernel.
+
+Times handle_missing_values -> remove_outliers -> normalize_data against
+`clean_frame` (one CleaningTransform pass), with statistics computed from
+the frame and precomputed by CleaningStatistics, on synthetic turnout
+datasets and on wide random frames with missing values, outliers and
+integer columns. Every kernel result is checked against the functions'
+with `assert_frame_equal(check_exact=True)` before anything is timed, as is
+the float32 kernel's error bound; `--check` runs only those checks (exit
+status 1 on a mismatch).
+
+Run from the backend directory:
+
+    python -m benchmarks.cleaning
+    python -m benchmarks.cleaning --check
+    python -m benchmarks.cleaning --rows 30 100000 --wide 20000x200 --output results/cleaning.json
+"""
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+
+import numpy as np
+import pandas as pd
+from pandas.testing import assert_frame_equal
+
+from benchmarks.synthetic import make_voter_csv
+from data.cache import parse_csv
+from data.cleaning import (CleaningStatistics, CleaningTransform, clean_frame, handle_missing_values,
+                           normalize_data, remove_outliers)
+from model.pipeline import strip_column_names
+
+
+def best_time(function, repeat):
+    """Best wall time of `repeat` calls, in seconds."""
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def per_column(frame, exclude_columns, medians=None, bounds=None, ranges=None):
+    # The three stages as the pipeline ran them, each on its own copy
+    frame = handle_missing_values(frame.copy(), medians)
+    frame = remove_outliers(frame.copy(), bounds)
+    return normalize_data(frame.copy(), exclude_columns, ranges)
+
+
+def wide_frame(n_rows, n_columns, seed=0):
+    """Random float columns (a fifth of the values missing, heavy tails) plus integer and text columns."""
+    rng = np.random.default_rng(seed)
+    values = rng.standard_t(3, size=(n_rows, n_columns)) * rng.choice([1.0, 100.0], n_columns)
+    values[rng.random(values.shape) < 0.2] = np.nan
+    frame = pd.DataFrame(values, columns=[f'x{i}' for i in range(n_columns)])
+    outliers = rng.integers(0, 10, n_rows)
+    outliers[0] = 10_000
+    return frame.assign(**{
+        'Year': rng.integers(1990, 2030, n_rows),
+        'Count': outliers,
+        'Region': pd.Series(rng.choice(['north', 'south', None], n_rows), dtype=object),
+    })
+
+
+def check(frame, exclude_columns):
+    """Raise AssertionError unless the kernel reproduces the per-column functions."""
+    assert_frame_equal(clean_frame(frame.copy(), exclude_columns), per_column(frame, exclude_columns),
+                       check_exact=True)
+    statistics = CleaningStatistics.from_frame(frame)
+    precomputed = {'medians': statistics.medians(), 'bounds': statistics.bounds(), 'ranges': statistics.ranges()}
+    assert_frame_equal(clean_frame(frame.copy(), exclude_columns, **precomputed),
+                       per_column(frame, exclude_columns, **precomputed), check_exact=True)
+
+    # float32 is not exact, but stays within float32 rounding of the scaled [0, 1] values
+    expected = per_column(frame, exclude_columns)
+    actual = CleaningTransform.fit_apply(frame, exclude_columns, dtype=np.float32)[1]
+    columns = [column for column in frame.columns if column not in exclude_columns and column in expected.columns
+               and expected[column].dtype.kind == 'f']
+    error = np.nanmax(np.abs(actual[columns].to_numpy(np.float64) - expected[columns].to_numpy(np.float64)))
+    if error > 1e-5:
+        raise AssertionError(f"float32 kernel is off by {error}")
+    return precomputed
+
+
+def datasets(rows, wide, tmp, seed=0):
+    """(name, frame, exclude_columns) of every synthetic turnout and wide random frame."""
+    frames = []
+    for n_rows in rows:
+        path = make_voter_csv(os.path.join(tmp, f'turnout-{n_rows}.csv'), n_rows=n_rows, seed=seed)
+        with open(path, 'rb') as f:
+            frames.append((f'turnout-{n_rows}', strip_column_names(parse_csv(f.read())), ['Year']))
+    for n_rows, n_columns in wide:
+        frames.append((f'wide-{n_rows}x{n_columns}', wide_frame(n_rows, n_columns, seed), ['Year', 'x0']))
+    return frames
+
+
+def check_all(rows=(30, 10_000, 100_000), wide=((20_000, 200),), seed=0):
+    """
+    Check the kernel against the per-column functions on every dataset, without timing.
+
+    Returns:
+        list: Names of the datasets checked.
+
+    Raises:
+        AssertionError: If the kernel's frame differs from the functions'.
+    """
+    with tempfile.TemporaryDirectory() as tmp:
+        frames = datasets(rows, wide, tmp, seed)
+    for name, frame, exclude_columns in frames:
+        check(frame, exclude_columns)
+    return [name for name, _, _ in frames]
+
+
+def measure(rows=(30, 10_000, 100_000), wide=((20_000, 200),), repeat=10, seed=0):
+    """
+    Time the per-column functions and the fused kernel.
+
+    Returns:
+        list: One dict per (dataset, statistics) with both timings in seconds and the speedup.
+
+    Raises:
+        AssertionError: If the kernel's frame differs from the functions'.
+    """
+    with tempfile.TemporaryDirectory() as tmp:
+        frames = datasets(rows, wide, tmp, seed)
+
+    results = []
+    for name, frame, exclude_columns in frames:
+        precomputed = check(frame, exclude_columns)
+        for statistics, params in (('fitted', {}), ('precomputed', precomputed)):
+            old_seconds = best_time(lambda: per_column(frame, exclude_columns, **params), repeat)
+            new_seconds = best_time(lambda: clean_frame(frame.copy(), exclude_columns, **params), repeat)
+            results.append({
+                'dataset': name,
+                'rows': len(frame),
+                'columns': frame.shape[1],
+                'statistics': statistics,
+                'old_seconds': old_seconds,
+                'new_seconds': new_seconds,
+                'speedup': old_seconds / new_seconds,
+            })
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Compare the per-column cleaning functions with the fused kernel.")
+    parser.add_argument('--rows', type=int, nargs='+', default=[30, 10_000, 100_000])
+    parser.add_argument('--wide', nargs='*', default=['20000x200'], help="Wide random frames, as ROWSxCOLUMNS")
+    parser.add_argument('--repeat', type=int, default=10)
+    parser.add_argument('--output', help="Where to save the results")
+    parser.add_argument('--check', action='store_true', help="Only check the kernel's results, without timing")
+    args = parser.parse_args(argv)
+
+    wide = [tuple(int(size) for size in shape.split('x')) for shape in args.wide]
+    if args.check:
+        try:
+            names = check_all(args.rows, wide)
+        except AssertionError as e:
+            print(f"FAILED: {e}")
+            return 1
+        print(f"Kernel matches the per-column functions on {', '.join(names)}")
+        return 0
+    results = measure(args.rows, wide, args.repeat)
+    print(f"{'dataset':<18} {'statistics':<12} {'old (ms)':>10} {'new (ms)':>10} {'speedup':>8}")
+    for row in results:
+        print(f"{row['dataset']:<18} {row['statistics']:<12} {row['old_seconds'] * 1e3:>10.3f} "
+              f"{row['new_seconds'] * 1e3:>10.3f} {row['speedup']:>7.1f}x")
+
+    if args.output:
+        os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,96 @@
+"""
+Forest inference benchmark: sklearn's `predict` against the flattened FlatForest.
+
+Fits year-trend forests like the ones /predict-randomforest serves (one
+feature, the default hyperparameters) on a small and a large synthetic
+training set, then times both engines on batches of 1 row (a single-year
+call), ~65 rows (a forecast from 1964 to 2028) and larger batches. Every
+batch is checked for bit-identical predictions before it is timed.
+
+Run from the backend directory:
+
+    python -m benchmarks.forest_inference
+    python -m benchmarks.forest_inference --train-rows 30 2000 --batches 1 65 --output results/forest.json
+"""
+import argparse
+import json
+import os
+import sys
+import time
+
+import numpy as np
+
+from model.forest import FlatForest
+
+
+def best_time(function, repeat):
+    """Best wall time of `repeat` calls, in seconds."""
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def measure(train_rows=(30, 2000), batches=(1, 10, 65, 1000), n_estimators=100, repeat=50, seed=0):
+    """
+    Time sklearn and FlatForest predictions.
+
+    Returns:
+        list: One dict per (training rows, batch size) with both timings in
+        seconds, the speedup and the tree depth.
+
+    Raises:
+        AssertionError: If any prediction differs from sklearn's.
+    """
+    from sklearn.ensemble import RandomForestRegressor
+
+    rng = np.random.default_rng(seed)
+    results = []
+    for n_rows in train_rows:
+        years = rng.integers(1964, 2024, n_rows).astype(np.float64).reshape(-1, 1)
+        values = 55 + 10 * np.sin(years[:, 0] / 7) + rng.normal(0, 3, n_rows)
+        forest = RandomForestRegressor(n_estimators=n_estimators, random_state=42).fit(years, values)
+        flat = FlatForest.from_estimator(forest)
+        for batch in batches:
+            X = np.linspace(1964, 2028, batch).reshape(-1, 1)
+            if not np.array_equal(forest.predict(X), flat.predict(X)):
+                raise AssertionError(f"FlatForest differs from predict ({n_rows} training rows, batch {batch})")
+            sklearn_seconds = best_time(lambda: forest.predict(X), repeat)
+            flat_seconds = best_time(lambda: flat.predict(X), repeat)
+            results.append({
+                'train_rows': n_rows,
+                'batch': batch,
+                'max_depth': flat.max_depth,
+                'sklearn_seconds': sklearn_seconds,
+                'flat_seconds': flat_seconds,
+                'speedup': sklearn_seconds / flat_seconds,
+            })
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Compare sklearn and flattened random forest inference.")
+    parser.add_argument('--train-rows', type=int, nargs='+', default=[30, 2000])
+    parser.add_argument('--batches', type=int, nargs='+', default=[1, 10, 65, 1000])
+    parser.add_argument('--n-estimators', type=int, default=100)
+    parser.add_argument('--repeat', type=int, default=50)
+    parser.add_argument('--output', help="Where to save the results")
+    args = parser.parse_args(argv)
+
+    results = measure(args.train_rows, args.batches, args.n_estimators, args.repeat)
+    print(f"{'train rows':>10} {'depth':>6} {'batch':>6} {'sklearn (us)':>13} {'flat (us)':>10} {'speedup':>8}")
+    for row in results:
+        print(f"{row['train_rows']:>10} {row['max_depth']:>6} {row['batch']:>6} {row['sklearn_seconds'] * 1e6:>13.0f} "
+              f"{row['flat_seconds'] * 1e6:>10.0f} {row['speedup']:>7.1f}x")
+
+    if args.output:
+        os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
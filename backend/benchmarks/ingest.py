@@ -0,0 +1,92 @@
+"""
+Ingestion benchmark: peak memory and time of loading a large turnout file.
+
+Generates a synthetic CSV and loads it into the columnar store twice, each
+time in a fresh interpreter: with the full parser (`parse_csv` +
+`write_columnar`) and with chunked streaming (`data.ingest.ingest_csv`).
+Reports wall time, the growth of peak RSS over the interpreter's baseline,
+and the memory report of the streamed copy.
+
+Run from the backend directory:
+
+    python -m benchmarks.ingest --rows 2000000
+    python -m benchmarks.ingest --rows 2000000 --chunk-rows 50000 --output results/ingest.json
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+
+from benchmarks.synthetic import make_voter_csv
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+_PROBE = """
+import json, resource, sys, time
+import numpy as np, pandas as pd
+from data.cache import parse_csv
+from data.columnar import write_columnar
+from data.ingest import ingest_csv
+mode, path, target, chunk_rows = sys.argv[1], sys.argv[2], sys.argv[3], int(sys.argv[4])
+baseline = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+start = time.perf_counter()
+report = None
+if mode == 'full':
+    with open(path, 'rb') as f:
+        write_columnar(parse_csv(f.read()), target)
+else:
+    report = ingest_csv(path, target, chunk_rows=chunk_rows)
+elapsed = time.perf_counter() - start
+peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+print(json.dumps({'seconds': elapsed, 'peak_rss_growth_bytes': (peak - baseline) * 1024, 'report': report}))
+"""
+
+
+def measure(rows, chunk_rows, seed=0):
+    """
+    Ingest one synthetic file both ways.
+
+    Returns:
+        dict: File size plus, per mode ('full', 'chunked'), seconds and peak RSS growth.
+    """
+    with tempfile.TemporaryDirectory(prefix='voter-ingest-') as workdir:
+        path = make_voter_csv(os.path.join(workdir, 'turnout.csv'), n_rows=rows, seed=seed)
+        result = {'rows': rows, 'chunk_rows': chunk_rows, 'file_bytes': os.path.getsize(path)}
+        for mode in ('full', 'chunked'):
+            completed = subprocess.run(
+                [sys.executable, '-c', _PROBE, mode, path, os.path.join(workdir, mode), str(chunk_rows)],
+                cwd=BACKEND_DIR, check=True, capture_output=True, text=True)
+            result[mode] = json.loads(completed.stdout.strip().splitlines()[-1])
+    return result
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Compare full and chunked ingestion of a large turnout CSV.")
+    parser.add_argument('--rows', type=int, default=1_000_000)
+    parser.add_argument('--chunk-rows', type=int, default=100_000)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', help="Where to save the results")
+    args = parser.parse_args(argv)
+
+    result = measure(args.rows, args.chunk_rows, args.seed)
+    print(f"{result['rows']} rows, {result['file_bytes'] / 1e6:.1f} MB on disk")
+    for mode in ('full', 'chunked'):
+        run = result[mode]
+        print(f"{mode:<8} {run['seconds']:>7.2f} s   peak RSS +{run['peak_rss_growth_bytes'] / 1e6:.1f} MB")
+    report = result['chunked']['report']
+    print(f"stored {report['bytes'] / 1e6:.1f} MB instead of {report['naive_bytes'] / 1e6:.1f} MB "
+          f"(saved {report['saved_bytes'] / 1e6:.1f} MB, {report['saved_fraction']:.0%})")
+    for name, column in report['columns'].items():
+        print(f"  {name:<24} {column['dtype']:<10} {column['bytes'] / 1e6:>8.1f} MB")
+
+    if args.output:
+        os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+        with open(args.output, 'w') as f:
+            json.dump(result, f, indent=2)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,499 @@
+"""
+End-to-end benchmark of the API against a synthetic dataset.
+
+Drives the endpoints through Flask's test client (in-process) or a local
+gunicorn instance (over HTTP), and records latency percentiles,
+requests/sec, peak RSS and per-stage timings of the cleaning and training
+pipeline. Results are saved as JSON so runs can be compared across commits.
+
+Run from the backend directory:
+
+    python -m benchmarks.load run --rows 30 --output results/base.json
+    python -m benchmarks.load run --rows 100000 --mode gunicorn --workers 4 --concurrency 8
+    python -m benchmarks.load run --mode asgi --workers 2 --scenarios columns --background train-randomforest
+    python -m benchmarks.load compare results/base.json results/new.json
+"""
+import argparse
+import contextlib
+import datetime
+import json
+import os
+import platform
+import resource
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from benchmarks.synthetic import make_voter_csv
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+RESULTS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'results')
+
+PREDICT_COLUMNS = ['Total Voter Turnout', 'White', 'Black', 'Hispanic']
+
+# name: (method, path, JSON body, default number of timed requests)
+SCENARIOS = {
+    'columns': ('GET', '/columns', None, 50),
+    'data': ('GET', '/data', None, 20),
+    'data-window': ('GET', '/data?columns=Year,Total%20Voter%20Turnout&offset=0&limit=10', None, 50),
+    'predict': ('POST', '/predict', {'columns': PREDICT_COLUMNS, 'predict_years': [2024, 2026, 2028]}, 50),
+    'predict-randomforest': ('POST', '/predict-randomforest',
+                             {'columns': PREDICT_COLUMNS, 'predict_years': [2024, 2026, 2028]}, 20),
+    'predict-batch': ('POST', '/predict/batch', {'scenarios': [
+        {'model': model, 'columns': PREDICT_COLUMNS, 'predict_years': [2024 + 2 * i]}
+        for i in range(5) for model in ('linear', 'random_forest')
+    ]}, 10),
+    'train-linear-regression': ('POST', '/train-linear-regression', None, 5),
+    'train-randomforest': ('POST', '/train-randomforest', None, 3),
+    'hyperparameter-tuning-linear': ('POST', '/hyperparameter-tuning-linear', None, 3),
+    'hyperparameter-tuning-randomforest': ('POST', '/hyperparameter-tuning-randomforest', None, 1),
+}
+
+
+# ----------------------------------------------------------------------
+# Drivers
+# ----------------------------------------------------------------------
+class TestClientDriver:
+    """Sends requests through Flask's test client, in this process."""
+
+    name = 'client'
+
+    def __init__(self, env):
+        os.environ.update(env)
+        sys.path.insert(0, BACKEND_DIR)
+        import app as app_module
+        self.app_module = app_module
+        self.client = app_module.app.test_client()
+
+    def request(self, method, path, body):
+        response = self.client.open(path, method=method, json=body)
+        response.get_data()  # Drain streamed bodies
+        if response.status_code >= 400:
+            raise RuntimeError(f"{method} {path} returned {response.status_code}: {response.get_data(as_text=True)[:200]}")
+
+    def peak_rss_bytes(self):
+        # ru_maxrss is in kilobytes on Linux and bytes on macOS
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak if sys.platform == 'darwin' else peak * 1024
+
+    def close(self):
+        self.app_module.batch_executor.shutdown(wait=False)
+        self.app_module.job_manager.shutdown()
+
+
+class GunicornDriver:
+    """Starts a local gunicorn instance and sends requests over HTTP."""
+
+    name = 'gunicorn'
+
+    def __init__(self, env, workers=2, threads=1, startup_timeout=120):
+        self.port = _free_port()
+        self.base_url = f'http://127.0.0.1:{self.port}'
+        self.process = subprocess.Popen(
+            self.command(workers, threads),
+            cwd=BACKEND_DIR, env=dict(os.environ, **self.environment(env, workers, threads)),
+            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+        )
+        deadline = time.time() + startup_timeout
+        while True:
+            try:
+                self.request('GET', '/columns', None)
+                break
+            except OSError:
+                if self.process.poll() is not None or time.time() > deadline:
+                    self.close()
+                    raise RuntimeError("gunicorn did not start")
+                time.sleep(0.2)
+
+    def command(self, workers, threads):
+        return [sys.executable, '-m', 'gunicorn', '--workers', str(workers), '--threads', str(threads),
+                '--bind', f'127.0.0.1:{self.port}', '--timeout', '600', 'app:app']
+
+    def environment(self, env, workers, threads):
+        return env
+
+    def request(self, method, path, body):
+        data = json.dumps(body).encode() if body is not None else None
+        req = urllib.request.Request(self.base_url + path, data=data, method=method,
+                                     headers={'Content-Type': 'application/json'} if data else {})
+        with urllib.request.urlopen(req, timeout=600) as response:
+            response.read()
+
+    def peak_rss_bytes(self):
+        """Sum of the peak RSS of the gunicorn master and workers (Linux only)."""
+        total = 0
+        for pid in _process_tree(self.process.pid):
+            try:
+                with open(f'/proc/{pid}/status') as f:
+                    for line in f:
+                        if line.startswith('VmHWM:'):
+                            total += int(line.split()[1]) * 1024
+            except OSError:
+                return None
+        return total
+
+    def close(self):
+        self.process.terminate()
+        try:
+            self.process.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            self.process.kill()
+
+
+class AsgiDriver(GunicornDriver):
+    """Starts the ASGI entry point under uvicorn, with `workers` model processes."""
+
+    name = 'asgi'
+
+    def command(self, workers, threads):
+        return [sys.executable, '-m', 'uvicorn', '--host', '127.0.0.1', '--port', str(self.port),
+                '--no-access-log', 'asgi:app']
+
+    def environment(self, env, workers, threads):
+        return dict(env, ASYNC_CPU_WORKERS=str(workers), ASYNC_THREADS=str(max(threads, 4)))
+
+
+def _free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def _process_tree(pid):
+    pids = [pid]
+    try:
+        with open(f'/proc/{pid}/task/{pid}/children') as f:
+            children = [int(child) for child in f.read().split()]
+    except OSError:
+        return pids
+    for child in children:
+        pids.extend(_process_tree(child))
+    return pids
+
+
+# ----------------------------------------------------------------------
+# Measurements
+# ----------------------------------------------------------------------
+def summarize(latencies, wall_seconds):
+    """Percentiles (ms) and throughput for a list of request latencies (seconds)."""
+    latencies = np.asarray(latencies) * 1e3
+    return {
+        'requests': int(len(latencies)),
+        'p50_ms': float(np.percentile(latencies, 50)),
+        'p95_ms': float(np.percentile(latencies, 95)),
+        'p99_ms': float(np.percentile(latencies, 99)),
+        'mean_ms': float(latencies.mean()),
+        'max_ms': float(latencies.max()),
+        'rps': float(len(latencies) / wall_seconds) if wall_seconds > 0 else None,
+    }
+
+
+def measure(driver, method, path, body, repeat, concurrency=1):
+    """
+    Time one cold request, then `repeat` warm ones.
+
+    Args:
+        driver: TestClientDriver or GunicornDriver.
+        method, path, body: The request.
+        repeat (int): Number of timed warm requests.
+        concurrency (int): Requests in flight at once (gunicorn mode).
+
+    Returns:
+        dict: summarize() of the warm requests plus the cold latency.
+    """
+    def timed(_):
+        start = time.perf_counter()
+        driver.request(method, path, body)
+        return time.perf_counter() - start
+
+    cold = timed(None)
+    start = time.perf_counter()
+    if concurrency > 1:
+        with ThreadPoolExecutor(max_workers=concurrency) as pool:
+            latencies = list(pool.map(timed, range(repeat)))
+    else:
+        latencies = [timed(i) for i in range(repeat)]
+    result = summarize(latencies, time.perf_counter() - start)
+    result['cold_ms'] = cold * 1e3
+    return result
+
+
+class BackgroundLoad:
+    """
+    Keeps `concurrency` requests of one scenario in flight until stopped,
+    e.g. model training while /columns is measured. Rejected requests
+    (429/503 from the ASGI entry point) are counted, not raised.
+    """
+
+    def __init__(self, driver, scenario, concurrency=1):
+        self.driver = driver
+        self.method, self.path, self.body, _ = SCENARIOS[scenario]
+        self.stopped = threading.Event()
+        self.statuses = {}
+        self._lock = threading.Lock()
+        self._threads = [threading.Thread(target=self._loop, daemon=True) for _ in range(concurrency)]
+
+    def _loop(self):
+        while not self.stopped.is_set():
+            try:
+                self.driver.request(self.method, self.path, self.body)
+                status = 200
+            except urllib.error.HTTPError as e:
+                status = e.code
+                time.sleep(float(e.headers.get('Retry-After') or 0))
+            with self._lock:
+                self.statuses[status] = self.statuses.get(status, 0) + 1
+
+    def __enter__(self):
+        for thread in self._threads:
+            thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.stopped.set()
+        for thread in self._threads:
+            thread.join()
+
+
+def stage_timings(csv_path, repeat=3):
+    """
+    Best-of-`repeat` seconds for each step from raw CSV to fitted models.
+
+    Runs in this process without any caching, so it isolates the cost of
+    parsing, each cleaning stage, the split and the model fits.
+    """
+    sys.path.insert(0, BACKEND_DIR)
+    from sklearn.ensemble import RandomForestRegressor
+    from sklearn.linear_model import LinearRegression
+
+    from data.cache import parse_csv
+    from model.pipeline import CleaningPipeline
+    from model.trend import fit_linear_trends
+
+    with open(csv_path, 'rb') as f:
+        raw = f.read()
+
+    timings = {}
+
+    def record(name, fn):
+        best, result = None, None
+        for _ in range(repeat):
+            start = time.perf_counter()
+            result = fn()
+            elapsed = time.perf_counter() - start
+            best = elapsed if best is None else min(best, elapsed)
+        timings[name] = best
+        return result
+
+    output = record('parse_csv', lambda: parse_csv(raw))
+    numeric = [column for column in output.columns if column != 'Year' and output[column].dtype.kind in 'if']
+    record('fit_linear_trends', lambda: fit_linear_trends(output, numeric))
+    for name, function, params in CleaningPipeline.stages():
+        frame = output
+        output = record(name, lambda: function(frame.copy(), **params))
+    X_train, y_train = output['X_train'], output['y_train']
+    record('fit_linear_regression', lambda: LinearRegression().fit(X_train, y_train))
+    record('fit_random_forest', lambda: RandomForestRegressor(random_state=42, n_estimators=100).fit(X_train, y_train))
+    return timings
+
+
+def run(rows=30, mode='client', scenarios=None, repeat=None, concurrency=1, workers=2, threads=1, seed=0,
+        stage_repeat=3, background=None, background_concurrency=2):
+    """
+    Generate a dataset, start the app and benchmark each scenario.
+
+    Args:
+        rows (int): Synthetic dataset size.
+        mode (str): 'client' (Flask test client), 'gunicorn' or 'asgi' (uvicorn).
+        scenarios (list): Names from SCENARIOS; defaults to all of them.
+        repeat (int): Requests per scenario; defaults to each scenario's own count.
+        concurrency (int): Concurrent requests (server modes).
+        workers, threads (int): gunicorn worker and thread counts, or the
+            ASGI model processes and request threads.
+        seed (int): Dataset seed.
+        stage_repeat (int): Runs per pipeline stage timing (0 skips them).
+        background (str): Scenario kept running while the others are
+            measured (server modes), e.g. 'train-randomforest'.
+        background_concurrency (int): Background requests in flight.
+
+    Returns:
+        dict: The result document (see save()).
+    """
+    scenarios = scenarios or list(SCENARIOS)
+    unknown = [name for name in scenarios if name not in SCENARIOS]
+    if unknown:
+        raise ValueError(f"Unknown scenarios: {unknown}")
+    if background is not None and (background not in SCENARIOS or mode == 'client'):
+        raise ValueError("The background scenario must be one of SCENARIOS and needs a server mode")
+
+    with tempfile.TemporaryDirectory(prefix='voter-bench-') as workdir:
+        csv_path = make_voter_csv(os.path.join(workdir, 'turnout.csv'), n_rows=rows, seed=seed)
+        # Keep every cache of the app under test inside the temporary directory
+        env = {
+            'VOTER_DATA_SOURCE': csv_path,
+            'VOTER_DATA_CACHE_DIR': os.path.join(workdir, 'cache'),
+            'MODEL_REGISTRY_PATH': os.path.join(workdir, 'models', 'registry.joblib'),
+            'JOB_STATE_DIR': os.path.join(workdir, 'jobs'),
+            'TRAINING_CACHE_DIR': os.path.join(workdir, 'training'),
+        }
+
+        startup = time.perf_counter()
+        if mode == 'client':
+            driver = TestClientDriver(env)
+        elif mode == 'gunicorn':
+            driver = GunicornDriver(env, workers=workers, threads=threads)
+        elif mode == 'asgi':
+            driver = AsgiDriver(env, workers=workers, threads=threads)
+        else:
+            raise ValueError(f"Unknown mode '{mode}'")
+        startup_seconds = time.perf_counter() - startup
+
+        endpoints = {}
+        background_statuses = None
+        try:
+            load = BackgroundLoad(driver, background, background_concurrency) if background else contextlib.nullcontext()
+            with load:
+                for name in scenarios:
+                    method, path, body, default_repeat = SCENARIOS[name]
+                    endpoints[name] = measure(driver, method, path, body, repeat or default_repeat,
+                                              concurrency if mode != 'client' else 1)
+                    print(f"{name:>36} p50 {endpoints[name]['p50_ms']:10.2f} ms", file=sys.stderr)
+            if background:
+                background_statuses = {str(status): n for status, n in sorted(load.statuses.items())}
+            peak_rss = driver.peak_rss_bytes()
+        finally:
+            driver.close()
+
+        stages = stage_timings(csv_path, stage_repeat) if stage_repeat else {}
+
+    return {
+        'meta': dict(_environment(), rows=rows, mode=mode, concurrency=concurrency,
+                     workers=workers if mode != 'client' else None, background=background),
+        'background_statuses': background_statuses,
+        'startup_seconds': startup_seconds,
+        'peak_rss_mb': peak_rss / 2**20 if peak_rss is not None else None,
+        'endpoints': endpoints,
+        'stages': stages,
+    }
+
+
+def _environment():
+    def git(*args):
+        try:
+            return subprocess.run(['git', *args], cwd=BACKEND_DIR, capture_output=True, text=True,
+                                  check=True).stdout.strip()
+        except (OSError, subprocess.CalledProcessError):
+            return None
+
+    return {
+        'commit': git('rev-parse', '--short', 'HEAD'),
+        'dirty': bool(git('status', '--porcelain', '--untracked-files=no')),
+        'timestamp': datetime.datetime.now(datetime.timezone.utc).isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpus': os.cpu_count(),
+    }
+
+
+def save(result, path=None):
+    """Write a result document; defaults to results/<commit>-<mode>-<rows>.json."""
+    if path is None:
+        meta = result['meta']
+        path = os.path.join(RESULTS_DIR, f"{meta['commit'] or 'unknown'}-{meta['mode']}-{meta['rows']}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    with open(path, 'w') as f:
+        json.dump(result, f, indent=2)
+    return path
+
+
+# ----------------------------------------------------------------------
+# Comparison
+# ----------------------------------------------------------------------
+def compare(baseline, candidate, threshold=0.10):
+    """
+    Compare two result documents.
+
+    Latencies and stage timings regress when they grow by more than
+    `threshold`; throughput regresses when it drops by more than `threshold`.
+
+    Returns:
+        list: (metric, baseline, candidate, relative change, regressed) tuples.
+    """
+    rows = []
+
+    def add(metric, old, new, higher_is_better=False):
+        if old is None or new is None or old == 0:
+            return
+        change = (new - old) / old
+        regressed = change < -threshold if higher_is_better else change > threshold
+        rows.append((metric, old, new, change, regressed))
+
+    for name in sorted(set(baseline['endpoints']) & set(candidate['endpoints'])):
+        old, new = baseline['endpoints'][name], candidate['endpoints'][name]
+        for key in ('p50_ms', 'p95_ms', 'p99_ms'):
+            add(f'{name} {key}', old[key], new[key])
+        add(f'{name} rps', old['rps'], new['rps'], higher_is_better=True)
+    for name in sorted(set(baseline['stages']) & set(candidate['stages'])):
+        add(f'stage {name} ms', baseline['stages'][name] * 1e3, candidate['stages'][name] * 1e3)
+    add('peak_rss_mb', baseline.get('peak_rss_mb'), candidate.get('peak_rss_mb'))
+    return rows
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    run_parser = commands.add_parser('run', help="Benchmark the API and save the results")
+    run_parser.add_argument('--rows', type=int, default=30)
+    run_parser.add_argument('--mode', choices=('client', 'gunicorn', 'asgi'), default='client')
+    run_parser.add_argument('--scenarios', help="Comma-separated subset of: " + ', '.join(SCENARIOS))
+    run_parser.add_argument('--repeat', type=int)
+    run_parser.add_argument('--concurrency', type=int, default=1)
+    run_parser.add_argument('--workers', type=int, default=2)
+    run_parser.add_argument('--threads', type=int, default=1)
+    run_parser.add_argument('--seed', type=int, default=0)
+    run_parser.add_argument('--stage-repeat', type=int, default=3)
+    run_parser.add_argument('--background', help="Scenario kept running during the measurements (server modes)")
+    run_parser.add_argument('--background-concurrency', type=int, default=2)
+    run_parser.add_argument('--output')
+
+    compare_parser = commands.add_parser('compare', help="Compare two result files")
+    compare_parser.add_argument('baseline')
+    compare_parser.add_argument('candidate')
+    compare_parser.add_argument('--threshold', type=float, default=0.10)
+
+    args = parser.parse_args(argv)
+    if args.command == 'run':
+        result = run(rows=args.rows, mode=args.mode,
+                     scenarios=args.scenarios.split(',') if args.scenarios else None,
+                     repeat=args.repeat, concurrency=args.concurrency, workers=args.workers,
+                     threads=args.threads, seed=args.seed, stage_repeat=args.stage_repeat,
+                     background=args.background, background_concurrency=args.background_concurrency)
+        print(save(result, args.output))
+        return 0
+
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    with open(args.candidate) as f:
+        candidate = json.load(f)
+    for key in ('rows', 'mode', 'concurrency', 'workers', 'cpus', 'background'):
+        if baseline['meta'].get(key) != candidate['meta'].get(key):
+            print(f"warning: runs differ in {key} ({baseline['meta'].get(key)} vs {candidate['meta'].get(key)})",
+                  file=sys.stderr)
+    rows = compare(baseline, candidate, threshold=args.threshold)
+    print(f"{'metric':<56} {'baseline':>12} {'candidate':>12} {'change':>9}")
+    for metric, old, new, change, regressed in rows:
+        print(f"{metric:<56} {old:>12.2f} {new:>12.2f} {change:>+8.1%}{'  REGRESSION' if regressed else ''}")
+    return 1 if any(row[4] for row in rows) else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
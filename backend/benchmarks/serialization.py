@@ -0,0 +1,145 @@
+"""
+Serialization benchmark: list-based JSON against the NumPy-native encoders.
+
+For every body the API builds from arrays, times the old path (`.tolist()`
+or `to_dict('records')` followed by `json.dumps`) against the new one
+(`serialization.dumps` on the arrays, and `DataPayload` row spans for
+/data) on synthetic datasets of several sizes. Both bodies are parsed and
+compared before anything is timed.
+
+Run from the backend directory:
+
+    python -m benchmarks.serialization
+    python -m benchmarks.serialization --rows 30 100000 --output results/serialization.json
+"""
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+from benchmarks.synthetic import make_voter_csv
+from data.cache import parse_csv
+from data.payload import DataPayload
+from serialization import MSGPACK_MIMETYPE, available_mimetypes, dumps, encode, loads
+
+
+def best_time(function, repeat):
+    """Best wall time of `repeat` calls, in seconds."""
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def records(frame):
+    # The /data body as it was built before: one dict per row, NaN as None
+    return json.dumps(frame.astype(object).where(frame.notna(), None).to_dict(orient='records'),
+                      separators=(',', ':')).encode()
+
+
+def forecast_body(frame):
+    # A /predict-style body: forecast years, one prediction per column, the actual series
+    years = frame['Year'].to_numpy()
+    full_years = np.arange(years.min(), 2029)
+    columns = list(frame.columns[2:])
+    predictions = {column: np.linspace(40, 60, len(full_years)) for column in columns}
+    actual = {column: {"years": years, "values": frame[column].to_numpy(dtype=np.float64, na_value=np.nan)}
+              for column in columns}
+    return {"message": "Prediction successful", "predictions": predictions, "actual_data": actual, "years": full_years}
+
+
+def tolist_body(body):
+    # Every array converted to lists first, as the handlers did
+    def convert(value):
+        if isinstance(value, dict):
+            return {key: convert(item) for key, item in value.items()}
+        if isinstance(value, np.ndarray):
+            return np.where(np.isnan(value), None, value).tolist() if value.dtype.kind == 'f' else value.tolist()
+        return value
+    return json.dumps(convert(body), separators=(',', ':')).encode()
+
+
+def cases(frame, payload):
+    """(name, old, new) callables producing equivalent bodies."""
+    window = frame.iloc[100:600] if len(frame) > 600 else frame.iloc[len(frame) // 4:]
+    offset, limit = window.index[0], len(window)
+    selected = np.sort(np.random.default_rng(0).choice(len(frame), size=min(500, len(frame)), replace=False))
+    body = forecast_body(frame)
+    yield 'data_full', lambda: records(frame), lambda: payload.encode()
+    yield 'data_window', lambda: records(window), lambda: payload.encode(offset=offset, limit=limit)
+    yield 'data_selection', lambda: records(frame.iloc[selected]), lambda: payload.encode(positions=selected)
+    yield ('data_projection', lambda: records(window[['Year', 'White']]),
+           lambda: payload.encode(columns=['Year', 'White'], offset=offset, limit=limit))
+    columnar = {'columns': {column: frame[column].to_numpy() for column in ['Year', 'White']}, 'n_rows': len(frame)}
+    yield 'data_columns', lambda: tolist_body(columnar), lambda: payload.encode(shape='columns', columns=['Year', 'White'])
+    yield 'forecast', lambda: tolist_body(body), lambda: dumps(body)
+    if MSGPACK_MIMETYPE in available_mimetypes():
+        yield 'forecast_msgpack', lambda: tolist_body(body), lambda: encode(body, MSGPACK_MIMETYPE)
+
+
+def measure(rows=(30, 10_000, 100_000), repeat=20, seed=0):
+    """
+    Time the old and new encoders.
+
+    Returns:
+        list: One dict per (dataset rows, case) with both timings in seconds,
+        the speedup and the body sizes.
+
+    Raises:
+        AssertionError: If a JSON body decodes differently from the old one.
+    """
+    results = []
+    with tempfile.TemporaryDirectory() as tmp:
+        for n_rows in rows:
+            path = make_voter_csv(os.path.join(tmp, f'turnout-{n_rows}.csv'), n_rows=n_rows, seed=seed)
+            with open(path, 'rb') as f:
+                frame = parse_csv(f.read())
+            build_seconds = best_time(lambda: DataPayload(frame, 'benchmark'), max(1, repeat // 10))
+            payload = DataPayload(frame, 'benchmark')
+            for name, old, new in cases(frame, payload):
+                old_body, new_body = old(), new()
+                if not name.endswith('msgpack') and json.loads(old_body) != loads(new_body):
+                    raise AssertionError(f"{name} body differs from the list-based encoding ({n_rows} rows)")
+                old_seconds = best_time(old, repeat)
+                new_seconds = best_time(new, repeat)
+                results.append({
+                    'rows': n_rows,
+                    'case': name,
+                    'payload_build_seconds': build_seconds,
+                    'old_seconds': old_seconds,
+                    'new_seconds': new_seconds,
+                    'speedup': old_seconds / new_seconds,
+                    'old_bytes': len(old_body),
+                    'new_bytes': len(new_body),
+                })
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Compare list-based and NumPy-native response serialization.")
+    parser.add_argument('--rows', type=int, nargs='+', default=[30, 10_000, 100_000])
+    parser.add_argument('--repeat', type=int, default=20)
+    parser.add_argument('--output', help="Where to save the results")
+    args = parser.parse_args(argv)
+
+    results = measure(args.rows, args.repeat)
+    print(f"{'rows':>8} {'case':<17} {'old (ms)':>10} {'new (ms)':>10} {'speedup':>8} {'old KB':>9} {'new KB':>9}")
+    for row in results:
+        print(f"{row['rows']:>8} {row['case']:<17} {row['old_seconds'] * 1e3:>10.3f} {row['new_seconds'] * 1e3:>10.3f} "
+              f"{row['speedup']:>7.1f}x {row['old_bytes'] / 1024:>9.1f} {row['new_bytes'] / 1024:>9.1f}")
+
+    if args.output:
+        os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,154 @@
+"""
+Startup benchmark: how long a fresh interpreter takes to `import app`.
+
+Each run imports the app in a new process with `-X importtime` against a
+synthetic dataset that is already in the local cache (the steady state of a
+restarted or autoscaled worker). Reports the best and median wall time of
+the import and the slowest top-level imports. It exits non-zero if the
+import exceeds a time budget, if it regressed against a saved baseline, or
+if a module that must stay off the serving path (plotting, sklearn) was
+imported.
+
+Run from the backend directory:
+
+    python -m benchmarks.startup
+    python -m benchmarks.startup --max-seconds 1.0 --output results/startup.json
+    python -m benchmarks.startup --baseline results/startup.json --tolerance 0.25
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+
+from benchmarks.synthetic import make_voter_csv
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Top-level packages that must not be imported when the app boots
+FORBIDDEN_MODULES = ('matplotlib', 'seaborn', 'sklearn', 'scipy')
+
+_PROBE = """
+import json, sys, time
+start = time.perf_counter()
+import app
+elapsed = time.perf_counter() - start
+print(json.dumps([elapsed, sorted({name.split('.')[0] for name in sys.modules})]))
+"""
+
+
+def parse_importtime(stderr, depth=1):
+    """
+    Parse `-X importtime` output.
+
+    Args:
+        stderr (str): The interpreter's stderr.
+        depth (int): Nesting level to report; 1 is the modules `app` imports directly.
+
+    Returns:
+        list: (module, self seconds, cumulative seconds) at that depth, slowest first.
+    """
+    rows = []
+    for line in stderr.splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        self_us, cumulative_us, name = line[len('import time:'):].split('|')
+        # Nesting is shown by two spaces of indentation per level
+        if len(name) - len(name.lstrip()) == 1 + 2 * depth:
+            rows.append((name.strip(), int(self_us) / 1e6, int(cumulative_us) / 1e6))
+    return sorted(rows, key=lambda row: row[2], reverse=True)
+
+
+def measure(runs=5, rows=30):
+    """
+    Time `import app` in `runs` fresh interpreters.
+
+    Returns:
+        dict: best/median seconds, the slowest top-level imports of the best
+        run and any forbidden modules that were imported.
+    """
+    with tempfile.TemporaryDirectory(prefix='voter-startup-') as workdir:
+        env = dict(
+            os.environ,
+            VOTER_DATA_SOURCE=make_voter_csv(os.path.join(workdir, 'turnout.csv'), n_rows=rows),
+            VOTER_DATA_CACHE_DIR=os.path.join(workdir, 'cache'),
+            MODEL_REGISTRY_PATH=os.path.join(workdir, 'models', 'registry.joblib'),
+            JOB_STATE_DIR=os.path.join(workdir, 'jobs'),
+            METRICS_DIR=os.path.join(workdir, 'metrics'),
+            TRAINING_CACHE_DIR=os.path.join(workdir, 'training'),
+        )
+        # Populate the dataset cache once; the timed runs read it from disk
+        subprocess.run([sys.executable, '-c', 'import app; app.dataset_manager.current()'],
+                       cwd=BACKEND_DIR, env=env, check=True, capture_output=True)
+
+        timings, best = [], None
+        for _ in range(runs):
+            result = subprocess.run([sys.executable, '-X', 'importtime', '-c', _PROBE],
+                                    cwd=BACKEND_DIR, env=env, check=True, capture_output=True, text=True)
+            elapsed, modules = json.loads(result.stdout.strip().splitlines()[-1])
+            timings.append(elapsed)
+            if best is None or elapsed < best[0]:
+                best = (elapsed, modules, result.stderr)
+
+    _, modules, stderr = best
+    return {
+        'runs': runs,
+        'best_seconds': min(timings),
+        'median_seconds': statistics.median(timings),
+        'slowest_imports': [
+            {'module': name, 'self_seconds': self_seconds, 'cumulative_seconds': cumulative}
+            for name, self_seconds, cumulative in parse_importtime(stderr)[:15]
+        ],
+        'forbidden_imported': [name for name in FORBIDDEN_MODULES if name in modules],
+    }
+
+
+def check(result, max_seconds=None, baseline=None, tolerance=0.25):
+    """Return a list of failure messages (empty when the startup budget holds)."""
+    failures = []
+    if result['forbidden_imported']:
+        failures.append(f"imported at boot: {', '.join(result['forbidden_imported'])}")
+    if max_seconds is not None and result['median_seconds'] > max_seconds:
+        failures.append(f"median import {result['median_seconds']:.3f}s exceeds the {max_seconds:.3f}s budget")
+    if baseline is not None:
+        limit = baseline['median_seconds'] * (1 + tolerance)
+        if result['median_seconds'] > limit:
+            failures.append(f"median import {result['median_seconds']:.3f}s regressed past {limit:.3f}s "
+                            f"(baseline {baseline['median_seconds']:.3f}s + {tolerance:.0%})")
+    return failures
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Measure and budget the import time of the Flask app.")
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--max-seconds', type=float, default=1.5)
+    parser.add_argument('--baseline', help="Result file of an earlier run to compare against")
+    parser.add_argument('--tolerance', type=float, default=0.25)
+    parser.add_argument('--output', help="Where to save this run's results")
+    args = parser.parse_args(argv)
+
+    result = measure(runs=args.runs)
+    print(f"import app: best {result['best_seconds'] * 1e3:.0f} ms, median {result['median_seconds'] * 1e3:.0f} ms")
+    print(f"{'module':<32} {'self (ms)':>10} {'cumulative (ms)':>16}")
+    for row in result['slowest_imports']:
+        print(f"{row['module']:<32} {row['self_seconds'] * 1e3:>10.1f} {row['cumulative_seconds'] * 1e3:>16.1f}")
+
+    if args.output:
+        os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+        with open(args.output, 'w') as f:
+            json.dump(result, f, indent=2)
+
+    baseline = None
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+    failures = check(result, args.max_seconds, baseline, args.tolerance)
+    for failure in failures:
+        print(f"FAIL: {failure}", file=sys.stderr)
+    return 1 if failures else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,66 @@
+"""
+Synthetic voter-turnout datasets with the same schema as `load_data()`.
+
+The CSV uses the upstream file's conventions (comma decimals, quoted
+values), so it goes through exactly the same parsing path.
+"""
+import math
+
+import numpy as np
+
+COLUMNS = [
+    'Year', 'Voting Population', 'Total Voter Turnout', 'White', 'Black', 'Asian', 'Hispanic',
+    'Male', 'Female', '18 to 24', '22 to 44', '45 to 64', '65 and Over',
+]
+N_YEARS = 30
+LATEST_YEAR = 2022
+
+
+def make_voter_csv(path, n_rows=30, nan_fraction=0.02, seed=0, chunk_rows=100_000):
+    """
+    Write a synthetic turnout CSV with `n_rows` rows.
+
+    Rows are spread evenly over 30 biennial elections, newest first like the
+    upstream file. Voting population strictly decreases down the file so the
+    engineered population-growth feature stays finite after normalization.
+
+    Args:
+        path (str): Output file.
+        n_rows (int): Number of rows (30 reproduces the national dataset's size).
+        nan_fraction (float): Share of turnout values left empty.
+        seed (int): Random seed.
+        chunk_rows (int): Rows generated per write, bounding memory for large files.
+
+    Returns:
+        str: The path written.
+    """
+    rng = np.random.default_rng(seed)
+    rows_per_year = math.ceil(n_rows / N_YEARS)
+    with open(path, 'w') as f:
+        f.write(','.join(COLUMNS) + '\n')
+        for start in range(0, n_rows, chunk_rows):
+            index = np.arange(start, min(start + chunk_rows, n_rows))
+            years = LATEST_YEAR - 2 * (index // rows_per_year)
+            population = 100_000 + (n_rows - index) * 1_000
+            # Turnout rates drift slowly with the year, plus noise
+            trend = 50 + 0.1 * (years - 1964)[:, None]
+            turnout = np.clip(trend + rng.normal(0, 6, size=(len(index), len(COLUMNS) - 2)), 5, 95)
+            missing = rng.random(turnout.shape) < nan_fraction
+
+            lines = []
+            for i in range(len(index)):
+                values = ['' if missing[i, j] else f'{turnout[i, j]:.1f}'.replace('.', ',') for j in range(turnout.shape[1])]
+                lines.append(f'{years[i]},"{population[i]}",' + ','.join(f'"{value}"' for value in values))
+            f.write('\n'.join(lines) + '\n')
+    return path
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Write a synthetic voter-turnout CSV.")
+    parser.add_argument('path')
+    parser.add_argument('--rows', type=int, default=30)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+    print(make_voter_csv(args.path, n_rows=args.rows, seed=args.seed))
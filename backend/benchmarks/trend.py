@@ -0,0 +1,94 @@
+"""
+Micro-benchmark: batched trend engine vs. the per-column LinearRegression loop.
+
+Run from the backend directory:
+
+    python -m benchmarks.trend
+"""
+import time
+
+import numpy as np
+import pandas as pd
+from sklearn.linear_model import LinearRegression
+from sklearn.metrics import mean_absolute_error, r2_score
+
+from model.trend import fit_linear_trends
+
+
+def make_frame(n_columns, n_years=30, nan_fraction=0.05, seed=0):
+    """Synthetic turnout-like frame with `n_columns` value columns and scattered NaNs."""
+    rng = np.random.default_rng(seed)
+    years = np.arange(1964, 1964 + 2 * n_years, 2)
+    values = rng.uniform(30, 75, size=(n_years, n_columns))
+    values[rng.random(values.shape) < nan_fraction] = np.nan
+    frame = pd.DataFrame(values, columns=[f'col_{i}' for i in range(n_columns)])
+    frame.insert(0, 'Year', years)
+    return frame
+
+
+def per_column_loop(voter_data, columns, full_years):
+    """The original /predict loop: one estimator and three predicts per column."""
+    results = {}
+    for column in columns:
+        valid_data = voter_data[['Year', column]].dropna()
+        actual_values = valid_data[column].values
+        model = LinearRegression()
+        model.fit(valid_data['Year'].values.reshape(-1, 1), actual_values)
+        predicted_values = model.predict(np.array(full_years).reshape(-1, 1))
+        results[column] = (
+            predicted_values,
+            mean_absolute_error(actual_values, model.predict(valid_data['Year'].values.reshape(-1, 1))),
+            r2_score(actual_values, model.predict(valid_data['Year'].values.reshape(-1, 1))),
+        )
+    return results
+
+
+def batched(voter_data, columns, full_years):
+    trends = fit_linear_trends(voter_data, columns)
+    return trends.predict(full_years), trends.mae, trends.r2
+
+
+def best_of(fn, repeat):
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        timings.append(time.perf_counter() - start)
+    return min(timings)
+
+
+def run(column_counts=(1, 15, 200), repeat=5):
+    """
+    Time both implementations and check they agree.
+
+    Returns:
+        list: One dict per column count with loop/batched seconds and speedup.
+    """
+    results = []
+    for n_columns in column_counts:
+        voter_data = make_frame(n_columns)
+        columns = [column for column in voter_data.columns if column != 'Year']
+        full_years = np.arange(voter_data['Year'].min(), 2031)
+
+        reference = per_column_loop(voter_data, columns, full_years)
+        predictions, mae, r2 = batched(voter_data, columns, full_years)
+        for i, column in enumerate(columns):
+            np.testing.assert_allclose(predictions[:, i], reference[column][0], rtol=1e-9)
+            np.testing.assert_allclose([mae[i], r2[i]], reference[column][1:], rtol=1e-7, atol=1e-9)
+
+        loop_seconds = best_of(lambda: per_column_loop(voter_data, columns, full_years), repeat)
+        batched_seconds = best_of(lambda: batched(voter_data, columns, full_years), repeat)
+        results.append({
+            'columns': n_columns,
+            'loop_seconds': loop_seconds,
+            'batched_seconds': batched_seconds,
+            'speedup': loop_seconds / batched_seconds,
+        })
+    return results
+
+
+if __name__ == '__main__':
+    print(f"{'columns':>8} {'loop (ms)':>12} {'batched (ms)':>14} {'speedup':>9}")
+    for row in run():
+        print(f"{row['columns']:>8} {row['loop_seconds'] * 1e3:>12.2f} "
+              f"{row['batched_seconds'] * 1e3:>14.3f} {row['speedup']:>8.0f}x")
@@ -0,0 +1,223 @@
+# Per-group turnout aggregates (summary statistics, histograms, year-over-year deltas) for the dashboard charts.
+from collections import OrderedDict
+import json
+import threading
+
+import numpy as np
+import pandas as pd
+
+from data.payload import DataPayload
+from instrumentation import count, stage
+
+# Column groups served under /aggregates/<group>
+AGGREGATE_GROUPS = {
+    'age': ['18 to 24', '22 to 44', '45 to 64', '65 and Over'],
+    'ethnicity': ['White', 'Black', 'Hispanic', 'Asian'],
+    'gender': ['Male', 'Female'],
+    'total': ['Total Voter Turnout'],
+}
+
+DEFAULT_BINS = 10
+MAX_BINS = 1000
+
+# Histograms with non-default bins are computed on request and kept per version
+MAX_CUSTOM_BINS = 32
+
+
+class AggregateError(ValueError):
+    """An aggregate request that cannot be answered (reported to the client as a 400)."""
+
+
+def _number(value):
+    # JSON-compliant float (NaN -> None)
+    value = float(value)
+    return None if np.isnan(value) else value
+
+
+def _numbers(values):
+    return [_number(value) for value in values]
+
+
+class DatasetAggregates:
+    """
+    Aggregates of every column group for one dataset version, built once.
+
+    For each group the column statistics (count, missing, mean, median,
+    quartiles, min, max, standard deviation), a histogram over edges shared
+    by the group's columns and the per-year mean with its change from the
+    previous year are materialized as JSON bytes with their compressed
+    variants, so serving a chart costs a dictionary lookup.
+
+    Args:
+        frame (DataFrame): The dataset; it is not modified.
+        version (str): Its dataset version.
+    """
+
+    def __init__(self, frame, version):
+        self.version = version
+        names = {str(column).strip(): column for column in frame.columns}
+        years = pd.to_numeric(frame[names['Year']], errors='coerce') if 'Year' in names else None
+        self._values = {}
+        self._by_year = {}
+        for group, columns in AGGREGATE_GROUPS.items():
+            for column in columns:
+                if column in names and column not in self._values:
+                    values = pd.to_numeric(frame[names[column]], errors='coerce').to_numpy(dtype=np.float64, na_value=np.nan)
+                    self._values[column] = values
+        if years is not None and self._values:
+            by_year = pd.DataFrame(self._values).groupby(years.to_numpy()).mean()
+            self._years = [int(year) for year in by_year.index]
+            self._by_year = {column: by_year[column].to_numpy() for column in by_year.columns}
+
+        self._lock = threading.Lock()
+        self._custom = OrderedDict()
+        self._summaries = {}
+        self._documents = {}
+        for group in AGGREGATE_GROUPS:
+            columns = self.columns(group)
+            if columns:
+                self._documents[group] = self._encode(self._document(group, columns, DEFAULT_BINS,
+                                                                     *self._range(columns, None, None)))
+
+    def columns(self, group):
+        """The group's columns present in this dataset version."""
+        return [column for column in AGGREGATE_GROUPS[group] if column in self._values]
+
+    def groups(self):
+        return list(self._documents)
+
+    def payload(self, group, bins=None, bin_min=None, bin_max=None):
+        """
+        Return the encoded aggregates of a group.
+
+        Args:
+            group (str): A key of AGGREGATE_GROUPS available in this version.
+            bins (int): Number of histogram bins (default DEFAULT_BINS).
+            bin_min, bin_max (float): Finite histogram range (default: the
+                group's minimum and maximum); values outside it are not counted.
+
+        Returns:
+            tuple: (ETag, dict of content coding -> body bytes).
+
+        Raises:
+            KeyError: If the group is not available.
+            AggregateError: If the bin parameters are invalid.
+        """
+        if group not in self._documents:
+            raise KeyError(group)
+        if bins is None and bin_min is None and bin_max is None:
+            count('aggregates', 'hits')
+            return f'{self.version}-{group}', self._documents[group]
+
+        bins = DEFAULT_BINS if bins is None else bins
+        if not 1 <= bins <= MAX_BINS:
+            raise AggregateError(f"'bins' must be between 1 and {MAX_BINS}")
+        for name, value in (('bin_min', bin_min), ('bin_max', bin_max)):
+            if value is not None and not np.isfinite(value):
+                raise AggregateError(f"'{name}' must be a finite number")
+        columns = self.columns(group)
+        low, high = self._range(columns, bin_min, bin_max)
+        key = (group, bins, low, high)
+        with self._lock:
+            encoded = self._custom.get(key)
+            if encoded is not None:
+                self._custom.move_to_end(key)
+        if encoded is None:
+            count('aggregates', 'misses')
+            encoded = self._encode(self._document(group, columns, bins, low, high))
+            with self._lock:
+                self._custom[key] = encoded
+                while len(self._custom) > MAX_CUSTOM_BINS:
+                    self._custom.popitem(last=False)
+        else:
+            count('aggregates', 'hits')
+        return f'{self.version}-{group}-{bins}-{bin_min}-{bin_max}', encoded
+
+    def _present(self, columns):
+        return np.concatenate([self._values[column][~np.isnan(self._values[column])] for column in columns])
+
+    def _range(self, columns, bin_min, bin_max):
+        # Histogram range: the requested bounds, or the columns' minimum and maximum
+        present = self._present(columns)
+        low = float(bin_min if bin_min is not None else (present.min() if len(present) else 0.0))
+        high = float(bin_max if bin_max is not None else (present.max() if len(present) else 1.0))
+        if low < high:
+            return low, high
+        if bin_min is None and bin_max is None:
+            # All values equal (or no values): one unit-wide range around them
+            return low - 0.5, low + 0.5
+        raise AggregateError(f"Empty histogram range [{low:g}, {high:g}]: 'bin_min' must be less than 'bin_max' "
+                             f"(default: the group's minimum and maximum)")
+
+    def _document(self, group, columns, bins, low, high):
+        values = {column: self._values[column] for column in columns}
+        present = self._present(columns)
+        edges = np.histogram_bin_edges(present, bins=bins, range=(low, high))
+        counts = {
+            column: np.histogram(column_values[~np.isnan(column_values)], bins=edges)[0].tolist()
+            for column, column_values in values.items()
+        }
+        return dict(self._summary(group, columns), bins={'edges': _numbers(edges), 'counts': counts})
+
+    def _summary(self, group, columns):
+        # Everything but the histogram; computed once per group
+        summary = self._summaries.get(group)
+        if summary is not None:
+            return summary
+        stats = {}
+        for column in columns:
+            column_values = self._values[column]
+            finite = column_values[~np.isnan(column_values)]
+            stats[column] = {'count': int(len(finite)), 'missing': int(len(column_values) - len(finite))}
+            if len(finite):
+                q1, median, q3 = np.percentile(finite, [25, 50, 75])
+                stats[column].update(mean=_number(finite.mean()), median=_number(median), q1=_number(q1),
+                                     q3=_number(q3), min=_number(finite.min()), max=_number(finite.max()),
+                                     std=_number(finite.std()))
+
+        summary = {'group': group, 'version': self.version, 'columns': columns, 'stats': stats}
+        if self._by_year:
+            means = {column: self._by_year[column] for column in columns}
+            summary['by_year'] = {
+                'years': self._years,
+                'mean': {column: _numbers(mean) for column, mean in means.items()},
+                'delta': {column: [None] + _numbers(np.diff(mean)) for column, mean in means.items()},
+            }
+        self._summaries[group] = summary
+        return summary
+
+    @staticmethod
+    def _encode(document):
+        body = json.dumps(document, separators=(',', ':'), allow_nan=False).encode()
+        encoded = {'identity': body}
+        for encoding in DataPayload.available_encodings():
+            encoded[encoding] = DataPayload.compress(body, encoding)
+        return encoded
+
+
+# Aggregates of the most recent dataset versions, like the /data payloads
+MAX_AGGREGATE_VERSIONS = 2
+_aggregates = OrderedDict()
+_aggregate_lock = threading.Lock()
+
+
+def get_aggregates(frame, version):
+    """
+    Return the DatasetAggregates for a dataset version, building them on first use.
+
+    Args:
+        frame (DataFrame): The dataset.
+        version (str): Its dataset version.
+    """
+    aggregates = _aggregates.get(version)
+    if aggregates is not None:
+        return aggregates
+    with _aggregate_lock:
+        aggregates = _aggregates.get(version)
+        if aggregates is None:
+            with stage('build_aggregates'):
+                aggregates = DatasetAggregates(frame, version)
+            _aggregates[version] = aggregates
+            while len(_aggregates) > MAX_AGGREGATE_VERSIONS:
+                _aggregates.popitem(last=False)
+        return aggregates
@@ -0,0 +1,495 @@
+# Local, versioned on-disk cache for the voter turnout dataset.
+import hashlib
+import io
+import json
+import logging
+import os
+import threading
+import time
+import urllib.error
+import urllib.request
+
+import numpy as np
+import pandas as pd
+
+from data.columnar import columnar_metadata, read_columnar, write_columnar
+from data.ingest import DEFAULT_CHUNK_ROWS, ingest_csv
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_CACHE_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), '.cache', 'dataset')
+
+# Local files at least this large are ingested in chunks (see data.ingest)
+DEFAULT_CHUNKED_MIN_BYTES = 64 * 1024 * 1024
+
+
+def parse_csv(raw):
+    """
+    Parse raw CSV bytes the same way the original loader did.
+
+    Args:
+        raw (bytes): The CSV file contents.
+
+    Returns:
+        DataFrame: The parsed dataset.
+    """
+    # Specify the decimal parameter to handle commas as decimal points
+    return pd.read_csv(io.BytesIO(raw), decimal=',', skipinitialspace=True)
+
+
+def content_hash(raw):
+    """Return the short content hash used as the dataset version."""
+    return hashlib.sha256(raw).hexdigest()[:16]
+
+
+def file_content_hash(path, block_size=1 << 20):
+    """Return `content_hash` of a file's contents, reading it block by block."""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(block_size), b''):
+            digest.update(block)
+    return digest.hexdigest()[:16]
+
+
+def frame_fingerprint(df):
+    """
+    Return a short content hash for a DataFrame.
+
+    Used as the dataset version for frames that did not come from a
+    DatasetStore (callers that know the store version should pass it).
+    """
+    digest = hashlib.sha256()
+    digest.update(repr([(str(column), str(dtype)) for column, dtype in df.dtypes.items()]).encode())
+    digest.update(pd.util.hash_pandas_object(df, index=True).values.tobytes())
+    return digest.hexdigest()[:16]
+
+
+def conform_rows(frame, rows):
+    """
+    Turn new records into a frame that can be appended to `frame`.
+
+    Column names are matched ignoring surrounding whitespace and missing
+    columns are left empty. Values of numeric columns must be numbers;
+    integer columns keep an integer dtype when every new value is integral.
+
+    Args:
+        frame (DataFrame): The dataset the rows are appended to.
+        rows (list): Records (dicts of column -> value), or a DataFrame.
+
+    Returns:
+        DataFrame: The rows, with the columns and names of `frame`.
+
+    Raises:
+        ValueError: If there are no rows, a column is unknown, a value is not
+            a number where one is expected or a row has no Year.
+    """
+    rows = rows if isinstance(rows, pd.DataFrame) else pd.DataFrame.from_records(list(rows))
+    if rows.empty:
+        raise ValueError("No rows to append")
+    names = {str(column).strip(): column for column in frame.columns}
+    given = {str(column).strip(): column for column in rows.columns}
+    unknown = sorted(name for name in given if name not in names)
+    if unknown:
+        raise ValueError(f"Unknown columns: {unknown}")
+    if 'Year' in names and ('Year' not in given or rows[given['Year']].isna().any()):
+        raise ValueError("Every row needs a 'Year'")
+
+    conformed = {}
+    for name, column in names.items():
+        dtype = frame[column].dtype
+        series = rows[given[name]].reset_index(drop=True) if name in given else pd.Series([None] * len(rows))
+        if pd.api.types.is_numeric_dtype(dtype) and not pd.api.types.is_bool_dtype(dtype):
+            values = pd.to_numeric(series, errors='coerce').astype(np.float64)
+            if (values.isna() & series.notna()).any():
+                raise ValueError(f"Column '{name}' expects numbers")
+            if pd.api.types.is_integer_dtype(dtype) and values.notna().all() and (values == values.round()).all():
+                values = values.astype(np.int64)
+            conformed[column] = values
+        elif pd.api.types.is_bool_dtype(dtype):
+            conformed[column] = series.astype(object)
+        else:
+            conformed[column] = series.astype('str')
+    return pd.DataFrame(conformed, columns=frame.columns)
+
+
+class DatasetStore:
+    """
+    Keeps a parsed copy of the dataset on local disk, memory-mapped.
+
+    The source can be an http(s) URL, a local file path or a callable
+    returning the raw CSV bytes (useful as an offline stub). Once a copy
+    exists on disk, `get()` never waits on the source: stale copies are
+    served immediately while a background thread revalidates them using
+    ETag/Last-Modified (URLs) or mtime/size (local files).
+
+    Each version is stored as per-column .npy files (see data.columnar) and
+    the frame held in memory maps them read-only, so gunicorn workers using
+    the same cache directory share a single copy of the data.
+
+    Fetching and parsing run without the store's lock, which is only taken
+    to compare versions and swap the frame in, so `stats()`, `sync()` and
+    `snapshot()` never wait on the source; a separate lock keeps refreshes
+    from overlapping.
+
+    Large local files are not read into memory at all: they are streamed
+    into the columnar store chunk by chunk with compact dtypes (see
+    data.ingest), which changes the column dtypes but not the values.
+
+    Args:
+        source: URL, file path or zero-argument callable returning bytes.
+        cache_dir (str): Directory holding the columnar frames and metadata.
+        ttl (float): Seconds before a cached copy is revalidated.
+        parser (callable): Turns raw bytes into a DataFrame.
+        ingest (str): 'auto' streams local files of at least
+            `chunked_min_bytes`, 'chunked' streams every local file and
+            'full' always uses `parser`.
+        chunk_rows (int): Rows per chunk when streaming.
+        chunked_min_bytes (int): File size from which 'auto' streams.
+    """
+
+    def __init__(self, source, cache_dir=DEFAULT_CACHE_DIR, ttl=3600, parser=parse_csv, ingest='auto',
+                 chunk_rows=DEFAULT_CHUNK_ROWS, chunked_min_bytes=DEFAULT_CHUNKED_MIN_BYTES):
+        if ingest not in ('auto', 'chunked', 'full'):
+            raise ValueError(f"ingest must be 'auto', 'chunked' or 'full', not {ingest!r}")
+        self.source = source
+        self.cache_dir = cache_dir
+        self.ttl = ttl
+        self.parser = parser
+        self.ingest = ingest
+        self.chunk_rows = chunk_rows
+        self.chunked_min_bytes = chunked_min_bytes
+        self._lock = threading.Lock()
+        self._refresh_lock = threading.Lock()
+        self._refresh_thread = None
+        self._frame = None
+        self._meta = {}
+        self._counters = {
+            'memory_hits': 0,
+            'disk_hits': 0,
+            'misses': 0,
+            'refreshes': 0,
+            'not_modified': 0,
+            'refresh_errors': 0,
+            'appends': 0,
+        }
+
+    # ------------------------------------------------------------------
+    # Public API
+    # ------------------------------------------------------------------
+    def get(self):
+        """
+        Return a copy of the current dataset.
+
+        Served from memory, then disk; only a cold cache fetches the source
+        synchronously.
+        """
+        frame, _ = self.snapshot()
+        return frame.copy()
+
+    def snapshot(self):
+        """
+        Return the shared (frame, version) pair without copying.
+
+        The frame is shared by every caller and must be treated as read-only.
+        """
+        with self._lock:
+            cold = False
+            if self._frame is not None:
+                self._counters['memory_hits'] += 1
+            elif self._load_from_disk():
+                self._counters['disk_hits'] += 1
+            else:
+                self._counters['misses'] += 1
+                cold = True
+        if cold:
+            self._refresh(conditional=False)
+        with self._lock:
+            frame = self._frame
+            stale = self._is_stale()
+            version = self.version
+        if stale:
+            self.refresh(block=False)
+        return frame, version
+
+    @property
+    def version(self):
+        """Content hash of the dataset currently held, or None before the first load."""
+        return self._meta.get('version')
+
+    def refresh(self, block=True):
+        """
+        Revalidate the cached copy against the source.
+
+        Args:
+            block (bool): Wait for the refresh to finish instead of running it
+                in a background thread.
+
+        Returns:
+            bool: True if a new dataset version was loaded (always False when
+            running in the background).
+        """
+        if block:
+            return self._revalidate()
+        with self._lock:
+            if self._refresh_thread is not None and self._refresh_thread.is_alive():
+                return False
+            self._refresh_thread = threading.Thread(target=self._background_refresh, daemon=True)
+            self._refresh_thread.start()
+        return False
+
+    def sync(self):
+        """
+        Pick up a newer version another process wrote to the shared disk cache.
+
+        Cheap (reads one small metadata file); never contacts the source.
+
+        Returns:
+            bool: True if the version held in memory changed.
+        """
+        with self._lock:
+            before = self.version
+            self._load_from_disk(only_if_newer=True)
+            return self.version != before
+
+    @property
+    def stale(self):
+        """True once the copy held is older than the TTL."""
+        return self._is_stale()
+
+    @property
+    def is_local_file(self):
+        """True when the source is a local path, which is cheap to revalidate (one stat call)."""
+        return not callable(self.source) and not str(self.source).startswith(('http://', 'https://'))
+
+    def append(self, rows):
+        """
+        Append rows to the dataset held, as a new version in the shared cache.
+
+        The combined frame is written to the cache directory like a fetched
+        version, so every gunicorn worker picks it up with `sync()`. The
+        source stays the system of record: when it changes, its new contents
+        replace the appended rows.
+
+        Args:
+            rows: Records or a DataFrame (see conform_rows).
+
+        Returns:
+            tuple: (frame, version, parent version, appended rows as conformed).
+
+        Raises:
+            ValueError: If the rows do not fit the dataset.
+        """
+        if self._frame is None:
+            self.snapshot()
+        with self._lock:
+            parent = self.version
+            appended = conform_rows(self._frame, rows)
+            # Content-addressed like fetched versions: the parent plus the new rows
+            version = content_hash(f'{parent}+{frame_fingerprint(appended)}'.encode())
+            if not os.path.isdir(self._frame_path(version)):
+                os.makedirs(self.cache_dir, exist_ok=True)
+                write_columnar(pd.concat([self._frame, appended], ignore_index=True), self._frame_path(version))
+            self._frame = read_columnar(self._frame_path(version))
+            self._write_meta(dict(self._meta, version=version, fetched_at=time.time(),
+                                  appended={'parent': parent, 'rows': len(appended)}))
+            self._counters['appends'] += 1
+            logger.info("Appended %d rows to dataset version %s as %s", len(appended), parent, version)
+            return self._frame, version, parent, appended
+
+    def lineage(self, version):
+        """
+        Return (parent version, number of rows) if `version` was made by
+        `append()` (the rows are the last rows of its frame), else None.
+        """
+        appended = self._meta.get('appended')
+        if appended is None or self._meta.get('version') != version:
+            return None
+        return appended['parent'], appended['rows']
+
+    def ingest_report(self, version=None):
+        """
+        Return the memory report of a version (default: the current one) if
+        it was streamed in chunks (see data.ingest.ingest_csv), else None.
+        """
+        version = version or self.version
+        if version is None:
+            return None
+        try:
+            return columnar_metadata(self._frame_path(version)).get('ingest')
+        except (OSError, ValueError):
+            return None
+
+    def stats(self):
+        """Return the hit/miss/refresh counters and the current version."""
+        with self._lock:
+            stats = dict(self._counters)
+        stats['version'] = self.version
+        stats['fetched_at'] = self._meta.get('fetched_at')
+        return stats
+
+    # ------------------------------------------------------------------
+    # Refreshes (take the locks themselves)
+    # ------------------------------------------------------------------
+    def _background_refresh(self):
+        try:
+            self._revalidate()
+        except Exception:
+            # The stale copy keeps being served; the next get() retries.
+            logger.exception("Background refresh of %s failed", self.source)
+
+    def _revalidate(self):
+        return self._refresh(conditional=True)
+
+    def _refresh(self, conditional):
+        # Only one refresh at a time; self._lock is held just around the disk checks and the swap
+        with self._refresh_lock:
+            with self._lock:
+                if conditional:
+                    # Another worker may already have refreshed the shared disk cache.
+                    if self._load_from_disk(only_if_newer=True) and not self._is_stale():
+                        return True
+                elif self._frame is not None or self._load_from_disk():
+                    # Loaded by the refresh this one waited for
+                    return False
+                loaded = self._frame is not None
+                validators = dict(self._meta) if conditional and loaded else {}
+                known = self._meta.get('version')
+            try:
+                fetched = self._download(validators, known, loaded)
+            except Exception:
+                if conditional:
+                    with self._lock:
+                        self._counters['refresh_errors'] += 1
+                raise
+            with self._lock:
+                changed = self._install(*fetched)
+                if conditional:
+                    self._counters['refreshes' if changed else 'not_modified'] += 1
+            return changed
+
+    def _download(self, validators, known, loaded):
+        """
+        Fetch the source and write a new version's columnar frame, without the lock.
+
+        Returns:
+            tuple: (version or None if the source is unchanged, new validators, fetch time).
+        """
+        streams = self._streams()
+        if streams:
+            # Only stat and hash the file here; ingest_csv streams it
+            validators = self._file_validators(validators)
+            raw = None if validators is None else self.source
+        else:
+            raw, validators = self._read_source(validators)
+        fetched_at = time.time()
+        if raw is None:
+            # 304 Not Modified / unchanged file
+            return None, {}, fetched_at
+
+        version = file_content_hash(self.source) if streams else content_hash(raw)
+        if version != known or not loaded:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            if streams:
+                if not os.path.isdir(self._frame_path(version)):
+                    ingest_csv(self.source, self._frame_path(version), chunk_rows=self.chunk_rows)
+            else:
+                write_columnar(self.parser(raw), self._frame_path(version))
+        return version, validators, fetched_at
+
+    # ------------------------------------------------------------------
+    # Internals (callers hold self._lock)
+    # ------------------------------------------------------------------
+    def _install(self, version, validators, fetched_at):
+        meta = dict(self._meta, fetched_at=fetched_at)
+        if version is None:
+            # Only bump the timestamp.
+            self._write_meta(meta)
+            return False
+
+        changed = version != self._meta.get('version')
+        if changed or self._frame is None:
+            # Serve the mapped copy so the parsed one can be freed
+            self._frame = read_columnar(self._frame_path(version))
+        meta.update(validators, version=version, source=str(self.source))
+        if changed:
+            # New source contents replace any appended rows
+            meta.pop('appended', None)
+        self._write_meta(meta)
+        logger.info("Loaded dataset version %s from %s", version, self.source)
+        return changed
+
+    def _is_stale(self):
+        return time.time() - self._meta.get('fetched_at', 0) > self.ttl
+
+    def _meta_path(self):
+        key = hashlib.sha256(repr(self.source).encode()).hexdigest()[:16]
+        return os.path.join(self.cache_dir, f'{key}.json')
+
+    def _frame_path(self, version):
+        return os.path.join(self.cache_dir, version)
+
+    def _load_from_disk(self, only_if_newer=False):
+        try:
+            with open(self._meta_path()) as f:
+                meta = json.load(f)
+            if only_if_newer and meta.get('fetched_at', 0) <= self._meta.get('fetched_at', 0):
+                return False
+            if meta.get('version') != self._meta.get('version') or self._frame is None:
+                self._frame = read_columnar(self._frame_path(meta['version']))
+        except (OSError, ValueError, KeyError, EOFError):
+            return False
+        self._meta = meta
+        return True
+
+    def _streams(self):
+        if not self.is_local_file or self.ingest == 'full':
+            return False
+        return self.ingest == 'chunked' or os.path.getsize(self.source) >= self.chunked_min_bytes
+
+    def _read_source(self, validators):
+        """Return (raw bytes or None if unchanged, new validators)."""
+        if callable(self.source):
+            return self.source(), {}
+
+        if str(self.source).startswith(('http://', 'https://')):
+            req = urllib.request.Request(self.source)
+            if validators.get('etag'):
+                req.add_header('If-None-Match', validators['etag'])
+            if validators.get('last_modified'):
+                req.add_header('If-Modified-Since', validators['last_modified'])
+            try:
+                with urllib.request.urlopen(req, timeout=30) as resp:
+                    return resp.read(), {
+                        'etag': resp.headers.get('ETag'),
+                        'last_modified': resp.headers.get('Last-Modified'),
+                    }
+            except urllib.error.HTTPError as e:
+                if e.code == 304:
+                    return None, {}
+                raise
+
+        file_id = self._file_validators(validators)
+        if file_id is None:
+            return None, {}
+        with open(self.source, 'rb') as f:
+            return f.read(), file_id
+
+    def _file_validators(self, validators):
+        """Return the local file's mtime/size, or None if they match `validators`."""
+        stat = os.stat(self.source)
+        file_id = {'mtime': stat.st_mtime, 'size': stat.st_size}
+        if validators.get('mtime') == file_id['mtime'] and validators.get('size') == file_id['size']:
+            return None
+        return file_id
+
+    def _write_meta(self, meta):
+        self._meta = meta
+        self._write_atomic(self._meta_path(), json.dumps(meta).encode())
+
+    def _write_atomic(self, path, payload):
+        os.makedirs(self.cache_dir, exist_ok=True)
+        tmp_path = f'{path}.{os.getpid()}.{threading.get_ident()}.tmp'
+        with open(tmp_path, 'wb') as f:
+            f.write(payload)
+        os.replace(tmp_path, path)
+
@@ -1,46 +1,74 @@
 # Handles missing values, outlier removal, normalization, and conversion to numeric.
+import logging
 import pandas as pd
 import numpy as np
-from sklearn.preprocessing import MinMaxScaler
 
-def handle_missing_values(df):
+logger = logging.getLogger(__name__)
+
+def _is_numeric(series):
+    return pd.api.types.is_numeric_dtype(series) and not pd.api.types.is_bool_dtype(series)
+
+def handle_missing_values(df, medians=None):
+    # `medians` (column -> median) come from CleaningStatistics when known
     for column in df.columns:
-        if df[column].dtype in ['float64', 'int64']:
-            df[column] = df[column].fillna(df[column].median())
+        if _is_numeric(df[column]):
+            median = medians[column] if medians and column in medians else df[column].median()
+            df[column] = df[column].fillna(median)
         else:
             df[column] = df[column].fillna(df[column].mode()[0])
     return df
 
-def remove_outliers(df):
+def remove_outliers(df, bounds=None):
     numeric_cols = df.select_dtypes(include=[np.number])
-    Q1 = numeric_cols.quantile(0.25)
-    Q3 = numeric_cols.quantile(0.75)
-    IQR = Q3 - Q1
+    if bounds and all(column in bounds for column in numeric_cols.columns):
+        # Precomputed by CleaningStatistics
+        lower_bound = pd.Series({column: bounds[column][0] for column in numeric_cols.columns}, dtype=np.float64)
+        upper_bound = pd.Series({column: bounds[column][1] for column in numeric_cols.columns}, dtype=np.float64)
+    else:
+        Q1 = numeric_cols.quantile(0.25)
+        Q3 = numeric_cols.quantile(0.75)
+        IQR = Q3 - Q1
 
-    # Define lower and upper bounds for each numeric column
-    lower_bound = Q1 - 1.5 * IQR
-    upper_bound = Q3 + 1.5 * IQR
+        # Define lower and upper bounds for each numeric column
+        lower_bound = Q1 - 1.5 * IQR
+        upper_bound = Q3 + 1.5 * IQR
 
     # Clip values to these bounds instead of removing rows
     df[numeric_cols.columns] = numeric_cols.clip(lower=lower_bound, upper=upper_bound, axis=1)
     return df
 
-def normalize_data(df, exclude_columns=[]):
+def normalize_data(df, exclude_columns=[], ranges=None):
+    numerical_columns = df.select_dtypes(include=[np.number]).columns.difference(exclude_columns)
+    if ranges and all(column in ranges for column in numerical_columns):
+        # Precomputed (min, max) from CleaningStatistics, scaled exactly like MinMaxScaler
+        data_min = np.array([ranges[column][0] for column in numerical_columns], dtype=np.float64)
+        data_range = np.array([ranges[column][1] for column in numerical_columns], dtype=np.float64) - data_min
+        scale = 1.0 / np.where(data_range < 10 * np.finfo(np.float64).eps, 1.0, data_range)
+        values = df[numerical_columns].to_numpy(dtype=np.float64, na_value=np.nan) * scale
+        values += 0 - data_min * scale
+        df[numerical_columns] = values
+        return df
+
+    from sklearn.preprocessing import MinMaxScaler  # Imported on first use to keep web-worker boot fast
     scaler = MinMaxScaler()
-    numerical_columns = df.select_dtypes(include=['float64', 'int64']).columns.difference(exclude_columns)
     df[numerical_columns] = scaler.fit_transform(df[numerical_columns])
     return df
 
 def convert_to_numeric(df):
+    # Numeric columns come back from to_numeric unchanged, so only text columns are converted,
+    # and medians are taken only for the numeric columns that still have gaps to fill
     for column in df.columns:
-        if column != "Year":
+        if column != "Year" and not pd.api.types.is_numeric_dtype(df[column]):
             df[column] = pd.to_numeric(df[column], errors='coerce')
-    df.fillna(df.median(numeric_only=True), inplace=True)
+    missing = [column for column in df.columns[df.isna().any().to_numpy()]
+               if pd.api.types.is_numeric_dtype(df[column])]
+    if missing:
+        df.fillna(df[missing].median(), inplace=True)
     return df
 
 def add_engineered_features(df):
     # Calculate gaps and population growth
-    print(df)
+    logger.debug("Adding engineered features to frame of shape %s", df.shape)
     df['Gender_Gap'] = df['Female'] - df['Male']
     df['White_Black_Gap'] = df['White'] - df['Black']
     df['White_Hispanic_Gap'] = df['White'] - df['Hispanic']
@@ -48,3 +76,369 @@ def add_engineered_features(df):
     df['Population_Growth'] = df['Voting Population'].pct_change().fillna(0)
     return df
 
+
+
+def _quantile_position(n, q):
+    """
+    Where quantile `q` of `n` sorted values falls under numpy's 'linear'
+    method (Hyndman & Fan method 7, alpha = beta = 1), computed with numpy's
+    own arithmetic so interpolating at it is bit-identical to np.quantile.
+
+    Returns:
+        tuple: (index of the lower value, weight gamma of the next one).
+    """
+    alpha = beta = 1
+    virtual = n * q + (alpha + q * (1 - alpha - beta)) - 1
+    lower = int(np.floor(virtual))
+    return lower, virtual - lower
+
+
+def _interpolate(a, b, gamma):
+    # numpy's _lerp, which is exact at both ends
+    return b - (b - a) * (1 - gamma) if gamma >= 0.5 else a + (b - a) * gamma
+
+
+def _filled_quantile(sorted_values, fill, n_fill, q):
+    """
+    np.quantile (linear method) of `sorted_values` with `n_fill` copies of
+    `fill` inserted, without building that array.
+    """
+    fill_at = np.searchsorted(sorted_values, fill)
+
+    def element(position):
+        if position < fill_at:
+            return sorted_values[position]
+        if position < fill_at + n_fill:
+            return fill
+        return sorted_values[position - n_fill]
+
+    n = len(sorted_values) + n_fill
+    lower, gamma = _quantile_position(n, q)
+    return _interpolate(element(lower), element(min(lower + 1, n - 1)), gamma)
+
+
+class CleaningStatistics:
+    """
+    The statistics handle_missing_values, remove_outliers and normalize_data
+    compute, maintained under appended rows instead of recomputed.
+
+    Every numeric column keeps its present values in sorted order and its
+    count of missing values. Appending k rows merges k sorted values in
+    (no re-sort of the history); the median, the quartiles of the filled
+    column and the min/max after clipping are then read off the sorted
+    values in O(1) per column, giving exactly what the cleaning functions compute on the full
+    frame. Instances are immutable: `extend()` returns a new one.
+
+    Args:
+        values (dict): Column -> sorted ndarray of its present values.
+        missing (dict): Column -> number of missing values.
+    """
+
+    def __init__(self, values, missing):
+        self.values = values
+        self.missing = missing
+
+    @classmethod
+    def from_frame(cls, df):
+        """Statistics of the numeric (non-boolean) columns of a frame."""
+        values, missing = {}, {}
+        for column in df.columns:
+            if _is_numeric(df[column]):
+                column_values = df[column].to_numpy(dtype=np.float64, na_value=np.nan)
+                present = column_values[~np.isnan(column_values)]
+                values[column] = np.sort(present)
+                missing[column] = len(column_values) - len(present)
+        return cls(values, missing)
+
+    def extend(self, rows):
+        """
+        Statistics of the frame with `rows` appended.
+
+        Args:
+            rows (DataFrame): The appended rows; columns not in it count as missing.
+
+        Returns:
+            CleaningStatistics: The updated statistics.
+        """
+        values, missing = {}, {}
+        for column, sorted_values in self.values.items():
+            if column in rows.columns:
+                new = pd.to_numeric(rows[column], errors='coerce').to_numpy(dtype=np.float64, na_value=np.nan)
+            else:
+                new = np.full(len(rows), np.nan)
+            present = np.sort(new[~np.isnan(new)])
+            values[column] = np.insert(sorted_values, np.searchsorted(sorted_values, present), present)
+            missing[column] = self.missing[column] + len(new) - len(present)
+        return CleaningStatistics(values, missing)
+
+    def medians(self):
+        """Column -> median of its present values (NaN if none), as handle_missing_values fills."""
+        medians = {}
+        for column, sorted_values in self.values.items():
+            n = len(sorted_values)
+            if n == 0:
+                medians[column] = np.nan
+            elif n % 2:
+                medians[column] = float(sorted_values[n // 2])
+            else:
+                medians[column] = float((sorted_values[n // 2 - 1] + sorted_values[n // 2]) / 2)
+        return medians
+
+    def bounds(self):
+        """Column -> (lower, upper) IQR clipping bounds of the filled column, as remove_outliers uses."""
+        bounds = {}
+        medians = self.medians()
+        for column, sorted_values in self.values.items():
+            if len(sorted_values) == 0:
+                bounds[column] = (np.nan, np.nan)
+                continue
+            # Quartiles of the column after handle_missing_values filled it with the median
+            q1 = _filled_quantile(sorted_values, medians[column], self.missing[column], 0.25)
+            q3 = _filled_quantile(sorted_values, medians[column], self.missing[column], 0.75)
+            iqr = q3 - q1
+            bounds[column] = (float(q1 - 1.5 * iqr), float(q3 + 1.5 * iqr))
+        return bounds
+
+    def ranges(self):
+        """Column -> (min, max) after clipping, as normalize_data scales by."""
+        ranges = {}
+        for column, (lower, upper) in self.bounds().items():
+            sorted_values = self.values[column]
+            if len(sorted_values) == 0:
+                ranges[column] = (np.nan, np.nan)
+            else:
+                ranges[column] = (float(np.clip(sorted_values[0], lower, upper)),
+                                  float(np.clip(sorted_values[-1], lower, upper)))
+        return ranges
+
+
+# Rows per step of the fused fill/clip/scale sweep, so a chunk and its NaN mask stay in cache
+SWEEP_ROWS = 8192
+# Columns sorted at a time when fitting, bounding the sorted copy
+FIT_COLUMNS = 64
+
+
+def _kernel_columns(df):
+    """
+    The numeric columns of a frame the fused kernel can hold exactly, or
+    None when the frame needs the per-column functions (nullable, float32
+    or complex columns, integers beyond 2**53, duplicate names, no rows).
+    """
+    if len(df) == 0 or not df.columns.is_unique:
+        return None
+    columns = []
+    for column in df.columns:
+        if not _is_numeric(df[column]):
+            continue
+        dtype = df[column].dtype
+        if not isinstance(dtype, np.dtype) or dtype.kind not in 'iuf' or (dtype.kind == 'f' and dtype != np.float64):
+            return None
+        if dtype.kind in 'iu' and np.abs(df[column].to_numpy()).max() >= 2 ** 53:
+            return None
+        columns.append(column)
+    return columns
+
+
+def _numeric_block(df, columns, dtype):
+    # One copy of the numeric data, column-major so every column (and its sort) is contiguous
+    block = np.empty((len(df), len(columns)), dtype=dtype, order='F')
+    for position, column in enumerate(columns):
+        block[:, position] = df[column].to_numpy()
+    return block
+
+
+def _filled_elements(ordered, columns, fill, fill_at, n_fill, position):
+    # _filled_quantile's element() for every column at once
+    shifted = np.where(position < fill_at, position, position - n_fill)
+    values = ordered[np.clip(shifted, 0, len(ordered) - 1), columns]
+    return np.where((position >= fill_at) & (position < fill_at + n_fill), fill, values)
+
+
+def _block_statistics(block):
+    """
+    Medians, IQR clipping bounds and min/max after clipping of every
+    column of a block, from one sort per column.
+
+    Returns:
+        tuple: (medians, lower, upper, data_min, data_max) float64 arrays.
+    """
+    n_rows, n_columns = block.shape
+    statistics = np.full((5, n_columns), np.nan)
+    positions = [_quantile_position(n_rows, q) for q in (0.25, 0.75)]
+
+    for start in range(0, n_columns, FIT_COLUMNS):
+        ordered = np.sort(block[:, start:start + FIT_COLUMNS], axis=0).astype(np.float64, copy=False)  # NaN sorts last
+        columns = np.arange(ordered.shape[1])
+        present = n_rows - np.count_nonzero(np.isnan(ordered), axis=0)
+        low = ordered[np.maximum((present - 1) // 2, 0), columns]
+        high = ordered[present // 2, columns]
+        median = np.where(present % 2 == 1, low, (low + high) / 2)
+        median[present == 0] = np.nan
+
+        # Quartiles of each column after its missing values are filled with the median
+        fill_at = np.count_nonzero(ordered < median, axis=0)
+        n_fill = n_rows - present
+        quartiles = []
+        for lower, gamma in positions:
+            a = _filled_elements(ordered, columns, median, fill_at, n_fill, lower)
+            b = _filled_elements(ordered, columns, median, fill_at, n_fill, min(lower + 1, n_rows - 1))
+            quartiles.append(_interpolate(a, b, gamma))
+        q1, q3 = quartiles
+        iqr = q3 - q1
+        lower_bound, upper_bound = q1 - 1.5 * iqr, q3 + 1.5 * iqr
+
+        data_min = np.clip(ordered[0], lower_bound, upper_bound)
+        data_max = np.clip(ordered[np.maximum(present - 1, 0), columns], lower_bound, upper_bound)
+        statistics[:, start:start + FIT_COLUMNS] = median, lower_bound, upper_bound, data_min, data_max
+    return tuple(statistics)
+
+
+class CleaningTransform:
+    """
+    handle_missing_values, remove_outliers and normalize_data as one fitted
+    transform.
+
+    The numeric columns are copied into a single column-major block. Fitting
+    sorts it once (a few columns at a time) and reads every column's median,
+    the quartiles of the median-filled column, the clipping bounds and the
+    min/max after clipping off the sorted values, as CleaningStatistics does.
+    Applying fills, clips and scales each chunk of rows of the block in
+    place, and the cleaned frame is assembled from views of the block, so
+    the numeric data is copied once instead of rebuilt column by column by
+    each function. In float64 the result equals the three functions' bit
+    for bit (checked by `python -m benchmarks.cleaning --check`);
+    `dtype=np.float32` halves the working set at float32 precision.
+
+    The fitted statistics are kept, so new rows (e.g. at inference) can be
+    cleaned exactly like the data the transform was fitted on.
+
+    Args:
+        columns (list): The numeric columns, in frame order.
+        medians, lower, upper, data_min, data_max (ndarray): Per-column
+            statistics aligned with `columns`.
+        modes (dict): Column -> fill value of non-numeric columns with gaps;
+            columns not in it are filled with their own mode.
+        dtype: Working precision of the block.
+    """
+
+    def __init__(self, columns, medians, lower, upper, data_min, data_max, modes=None, dtype=np.float64):
+        self.columns = list(columns)
+        self.medians = np.asarray(medians, dtype=np.float64)
+        self.lower = np.asarray(lower, dtype=np.float64)
+        self.upper = np.asarray(upper, dtype=np.float64)
+        self.data_min = np.asarray(data_min, dtype=np.float64)
+        self.data_max = np.asarray(data_max, dtype=np.float64)
+        self.modes = dict(modes or {})
+        self.dtype = np.dtype(dtype)
+
+    @classmethod
+    def fit(cls, df, dtype=np.float64):
+        """
+        Fit the transform to a frame.
+
+        Raises:
+            ValueError: If the frame has columns the block cannot hold exactly
+                (see `supports`); clean those with the per-column functions.
+        """
+        return cls._fit(df, dtype)[0]
+
+    @classmethod
+    def from_statistics(cls, medians, bounds, ranges, columns, dtype=np.float64):
+        """A transform from precomputed statistics (e.g. CleaningStatistics' medians(), bounds() and ranges())."""
+        return cls(columns, [medians[column] for column in columns], [bounds[column][0] for column in columns],
+                   [bounds[column][1] for column in columns], [ranges[column][0] for column in columns],
+                   [ranges[column][1] for column in columns], dtype=dtype)
+
+    @staticmethod
+    def supports(df):
+        """Whether the fused kernel can clean this frame."""
+        return _kernel_columns(df) is not None
+
+    @classmethod
+    def _fit(cls, df, dtype):
+        columns = _kernel_columns(df)
+        if columns is None:
+            raise ValueError("Frame has columns the cleaning kernel cannot hold exactly")
+        block = _numeric_block(df, columns, dtype)
+        modes = {column: df[column].mode()[0] for column in df.columns
+                 if column not in columns and df[column].isna().any()}
+        return cls(columns, *_block_statistics(block), modes=modes, dtype=dtype), block
+
+    @classmethod
+    def fit_apply(cls, df, exclude_columns=(), dtype=np.float64):
+        """Fit to a frame and clean it, sharing one copy of its numeric data."""
+        transform, block = cls._fit(df, dtype)
+        return transform, transform._apply(df, block, exclude_columns)
+
+    def apply(self, df, exclude_columns=()):
+        """
+        Clean a frame with the fitted statistics.
+
+        Args:
+            df (DataFrame): A frame with the numeric columns the transform was
+                fitted on (not modified).
+            exclude_columns (list): Numeric columns filled and clipped but not
+                scaled, as in normalize_data.
+
+        Returns:
+            DataFrame: The cleaned frame.
+
+        Raises:
+            ValueError: If the frame's numeric columns differ from the fitted ones.
+        """
+        columns = _kernel_columns(df)
+        if columns != self.columns:
+            raise ValueError(f"Expected numeric columns {self.columns}, got {columns}")
+        return self._apply(df, _numeric_block(df, columns, self.dtype), exclude_columns)
+
+    def _apply(self, df, block, exclude_columns):
+        excluded = np.isin(self.columns, list(exclude_columns))
+        # The MinMaxScaler formula; excluded columns get x * 1 + -0.0, which leaves every value as it is
+        data_range = self.data_max - self.data_min
+        scale = np.where(excluded, 1.0, 1.0 / np.where(data_range < 10 * np.finfo(np.float64).eps, 1.0, data_range))
+        offset = np.where(excluded, -0.0, 0 - self.data_min * scale)
+
+        fill, lower, upper = (values.astype(block.dtype) for values in (self.medians, self.lower, self.upper))
+        scale, offset = scale.astype(block.dtype), offset.astype(block.dtype)
+        for start in range(0, len(block), SWEEP_ROWS):
+            chunk = block[start:start + SWEEP_ROWS]
+            np.copyto(chunk, fill, where=np.isnan(chunk))
+            np.clip(chunk, lower, upper, out=chunk)
+            chunk *= scale
+            chunk += offset
+
+        positions = {column: position for position, column in enumerate(self.columns)}
+        data = {}
+        for column in df.columns:
+            if column not in positions:
+                values = df[column]
+                if values.isna().any():
+                    values = values.fillna(self.modes[column] if column in self.modes else values.mode()[0])
+                data[column] = values
+                continue
+            values = block[:, positions[column]]
+            dtype = df[column].dtype
+            # Unscaled integer columns stay integers when clipping kept them whole, as with DataFrame.clip
+            if dtype.kind in 'iu' and excluded[positions[column]] and np.array_equal(values, np.floor(values)):
+                values = values.astype(dtype)
+            data[column] = values
+        return pd.DataFrame(data, index=df.index, columns=df.columns, copy=False)
+
+
+def clean_frame(df, exclude_columns=[], medians=None, bounds=None, ranges=None):
+    """
+    handle_missing_values, remove_outliers and normalize_data in one pass
+    (see CleaningTransform), with the same arguments and result.
+
+    Frames the kernel cannot hold exactly, and statistics that do not cover
+    every numeric column, go through the three functions instead.
+    """
+    columns = _kernel_columns(df)
+    if columns is None or (any((medians, bounds, ranges)) and not all(
+            statistic and all(column in statistic for column in columns) for statistic in (medians, bounds, ranges))):
+        df = handle_missing_values(df, medians)
+        df = remove_outliers(df, bounds)
+        return normalize_data(df, exclude_columns, ranges)
+    if medians:
+        return CleaningTransform.from_statistics(medians, bounds, ranges, columns).apply(df, exclude_columns)
+    return CleaningTransform.fit_apply(df, exclude_columns)[1]
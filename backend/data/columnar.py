@@ -0,0 +1,117 @@
+# Memory-mapped columnar storage for parsed datasets (one .npy file per column).
+import json
+import os
+import pickle
+import shutil
+import threading
+
+import numpy as np
+import pandas as pd
+
+# numpy dtype kinds that np.load can memory-map (bool, integers, floats, complex, datetimes)
+MAPPABLE_KINDS = 'biufcmM'
+
+
+def write_columnar(frame, path):
+    """
+    Write a DataFrame as a directory of per-column .npy files.
+
+    Numeric columns are stored as raw .npy arrays that `read_columnar` maps
+    without copying; any other column (strings, categoricals) is pickled.
+    The directory is written under a temporary name and renamed into place,
+    so readers never see a partial dataset. An existing directory is kept
+    as is (the path is expected to be content-addressed).
+
+    Args:
+        frame (DataFrame): The dataset.
+        path (str): Target directory.
+
+    Returns:
+        str: The path.
+    """
+    if os.path.isdir(path):
+        return path
+    tmp_path = f'{path}.{os.getpid()}.{threading.get_ident()}.tmp'
+    os.makedirs(tmp_path)
+    try:
+        columns = []
+        for position, (name, series) in enumerate(frame.items()):
+            values = series.to_numpy()
+            if values.dtype.kind in MAPPABLE_KINDS and str(series.dtype) == str(values.dtype):
+                file_name = f'{position}.npy'
+                np.save(os.path.join(tmp_path, file_name), np.ascontiguousarray(values), allow_pickle=False)
+            else:
+                file_name = f'{position}.pkl'
+                with open(os.path.join(tmp_path, file_name), 'wb') as f:
+                    pickle.dump(series, f, protocol=pickle.HIGHEST_PROTOCOL)
+            columns.append({'name': name, 'file': file_name})
+
+        index = None
+        if not frame.index.equals(pd.RangeIndex(len(frame))):
+            index = 'index.pkl'
+            with open(os.path.join(tmp_path, index), 'wb') as f:
+                pickle.dump(frame.index, f, protocol=pickle.HIGHEST_PROTOCOL)
+        with open(os.path.join(tmp_path, 'columns.json'), 'w') as f:
+            json.dump({'columns': columns, 'n_rows': len(frame), 'index': index}, f)
+
+        try:
+            os.rename(tmp_path, path)
+        except OSError:
+            if not os.path.isdir(path):
+                raise
+            # Another process wrote the same version first
+            shutil.rmtree(tmp_path, ignore_errors=True)
+    except BaseException:
+        shutil.rmtree(tmp_path, ignore_errors=True)
+        raise
+    return path
+
+
+def columnar_metadata(path):
+    """Return the columns.json contents of a columnar directory."""
+    with open(os.path.join(path, 'columns.json')) as f:
+        return json.load(f)
+
+
+def read_columnar(path, mmap=True):
+    """
+    Load a dataset written by `write_columnar`.
+
+    Also reads directories written by `data.ingest.ingest_csv`, whose text
+    columns are stored as categorical codes.
+
+    With `mmap=True`, numeric columns are read-only NumPy views of the files,
+    so every process reading the same directory shares one copy in the OS
+    page cache instead of holding its own. Pandas copy-on-write keeps the
+    frame safe to share: modifying it copies the affected columns first.
+
+    Args:
+        path (str): Directory written by write_columnar.
+        mmap (bool): Map numeric columns instead of reading them into memory.
+
+    Returns:
+        DataFrame: The dataset, one block per column.
+
+    Raises:
+        OSError, ValueError: If the directory is missing or incomplete.
+    """
+    meta = columnar_metadata(path)
+    data = {}
+    for column in meta['columns']:
+        file_path = os.path.join(path, column['file'])
+        if column['file'].endswith('.npy'):
+            values = np.load(file_path, mmap_mode='r' if mmap else None, allow_pickle=False)
+            if 'categories' in column:
+                # Integer codes written by data.ingest; the codes stay mapped
+                values = pd.Categorical.from_codes(values, categories=column['categories'])
+            data[column['name']] = values
+        else:
+            with open(file_path, 'rb') as f:
+                data[column['name']] = pickle.load(f).array
+    index = None
+    if meta['index'] is not None:
+        with open(os.path.join(path, meta['index']), 'rb') as f:
+            index = pickle.load(f)
+    # copy=False keeps each mapped array as its own block instead of consolidating
+    return pd.DataFrame(data, index=index, copy=False)
+
@@ -0,0 +1,241 @@
+# Chunked, memory-bounded CSV ingestion straight into the columnar store.
+import json
+import logging
+import os
+import shutil
+import threading
+
+import numpy as np
+import pandas as pd
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_CHUNK_ROWS = 100_000
+
+# Text columns with more distinct values than this are kept as plain strings
+MAX_CATEGORIES = 1 << 15
+
+# Smallest integer type first; a column gets the first one that holds its range
+INTEGER_DTYPES = (np.int8, np.int16, np.int32, np.int64)
+
+# Rough CPython cost of one str object beyond its characters (header + pointer)
+_STR_OVERHEAD = 49 + 8
+
+
+def read_chunks(path, chunk_rows, text_columns=(), usecols=None):
+    """
+    Iterate over a turnout CSV file `chunk_rows` rows at a time.
+
+    Uses the options of `data.cache.parse_csv`, so numbers (including the
+    comma-decimal format) are coerced by pandas' C parser chunk by chunk.
+
+    Args:
+        path (str): CSV file.
+        chunk_rows (int): Rows per chunk.
+        text_columns (iterable): Columns to read as strings instead of inferring a type.
+        usecols (list): Only read these columns.
+    """
+    return pd.read_csv(path, chunksize=chunk_rows, decimal=',', skipinitialspace=True, usecols=usecols,
+                       dtype={column: str for column in text_columns} or None)
+
+
+class _ColumnProfile:
+    """What the first pass learned about one column."""
+
+    def __init__(self, name):
+        self.name = name
+        self.numeric = True
+        self.has_nan = False
+        self.integral = True
+        self.float32_exact = True
+        self.minimum = np.inf
+        self.maximum = -np.inf
+        self.categories = {}
+        self.too_many_categories = False
+        self.text_bytes = 0
+
+    def update_numbers(self, values):
+        if not self.numeric:
+            return
+        if values.dtype.kind not in 'biuf':
+            # One chunk with text makes the whole column text, as in a full parse
+            self.numeric = False
+            return
+        numbers = values.to_numpy(dtype=np.float64)
+        missing = np.isnan(numbers)
+        self.has_nan = self.has_nan or bool(missing.any())
+        present = numbers[~missing]
+        if not len(present):
+            return
+        self.minimum = min(self.minimum, float(present.min()))
+        self.maximum = max(self.maximum, float(present.max()))
+        if self.integral:
+            self.integral = bool(np.all(np.isfinite(present)) and np.all(present == np.trunc(present)))
+        if self.float32_exact:
+            with np.errstate(over='ignore'):
+                self.float32_exact = bool(np.all(present.astype(np.float32).astype(np.float64) == present))
+
+    def update_text(self, values):
+        self.text_bytes += int(values.str.len().fillna(0).sum()) + _STR_OVERHEAD * len(values)
+        if self.too_many_categories:
+            return
+        for value in values.dropna().unique():
+            self.categories.setdefault(value, len(self.categories))
+        if len(self.categories) > MAX_CATEGORIES:
+            self.too_many_categories = True
+            self.categories = {}
+
+    def storage(self):
+        """Return ('numeric', dtype), ('categorical', code dtype) or ('string', None)."""
+        if self.numeric:
+            if self.integral and not self.has_nan and self.minimum <= self.maximum:
+                for dtype in INTEGER_DTYPES:
+                    info = np.iinfo(dtype)
+                    if info.min <= self.minimum and self.maximum <= info.max:
+                        return 'numeric', np.dtype(dtype)
+            return 'numeric', np.dtype(np.float32 if self.float32_exact else np.float64)
+        if self.too_many_categories:
+            return 'string', None
+        for dtype in INTEGER_DTYPES:
+            if len(self.categories) < np.iinfo(dtype).max:
+                return 'categorical', np.dtype(dtype)
+
+    def naive_bytes(self, n_rows):
+        """Memory of this column as a plain `read_csv` holds it (float64 or Python str objects)."""
+        return 8 * n_rows if self.numeric else self.text_bytes
+
+
+def ingest_csv(path, target, chunk_rows=DEFAULT_CHUNK_ROWS):
+    """
+    Stream a CSV file into a columnar dataset directory without loading it whole.
+
+    The file is read in chunks of `chunk_rows` rows, so peak memory is
+    bounded by the chunk size (plus the category dictionaries of text
+    columns) rather than by the file size:
+
+    1. Every chunk is parsed with comma decimals to find the columns that
+       are numeric throughout, their range and whether they hold NaNs or
+       non-integral values. Text columns are then read once more, on their
+       own, to collect their distinct values.
+    2. Each column gets its most compact lossless type (the smallest integer
+       type for whole numbers without gaps, float32 when every value
+       survives the round trip, else float64; text becomes a categorical)
+       and every chunk is appended to the column's .npy file.
+
+    The values match `data.cache.parse_csv` on the same file; only the
+    dtypes differ. The result is the directory layout of `data.columnar`,
+    written under a temporary name and renamed into place, and its
+    columns.json also records the memory report returned here. Columns
+    whose text has more than MAX_CATEGORIES distinct values are kept as
+    plain strings, which are held in memory until the end.
+
+    Args:
+        path (str): CSV file in the turnout format (comma decimals).
+        target (str): Directory to create.
+        chunk_rows (int): Rows parsed per chunk.
+
+    Returns:
+        dict: Memory report with the rows, chunks, per-column dtype and size,
+        the size as a plain `read_csv` would hold it ('naive_bytes'), the
+        stored size ('bytes') and the difference ('saved_bytes').
+    """
+    profiles, n_rows, n_chunks = None, 0, 0
+    for chunk in read_chunks(path, chunk_rows):
+        if profiles is None:
+            profiles = [_ColumnProfile(name) for name in chunk.columns]
+        for profile, (_, values) in zip(profiles, chunk.items()):
+            profile.update_numbers(values)
+        n_rows += len(chunk)
+        n_chunks += 1
+    if profiles is None:
+        raise ValueError(f"{path} has no header row")
+
+    text_columns = [profile.name for profile in profiles if not profile.numeric]
+    if text_columns:
+        by_name = {profile.name: profile for profile in profiles}
+        for chunk in read_chunks(path, chunk_rows, text_columns, usecols=text_columns):
+            for name, values in chunk.items():
+                by_name[name].update_text(values)
+
+    tmp_path = f'{target}.{os.getpid()}.{threading.get_ident()}.tmp'
+    os.makedirs(tmp_path)
+    try:
+        columns, report = _write_columns(path, tmp_path, profiles, n_rows, chunk_rows, text_columns)
+        report.update(rows=n_rows, chunks=n_chunks, chunk_rows=chunk_rows)
+        with open(os.path.join(tmp_path, 'columns.json'), 'w') as f:
+            json.dump({'columns': columns, 'n_rows': n_rows, 'index': None, 'ingest': report}, f)
+        try:
+            os.rename(tmp_path, target)
+        except OSError:
+            if not os.path.isdir(target):
+                raise
+            # Another process ingested the same version first
+            shutil.rmtree(tmp_path, ignore_errors=True)
+    except BaseException:
+        shutil.rmtree(tmp_path, ignore_errors=True)
+        raise
+
+    logger.info("Ingested %s: %d rows in %d chunks, %.1f MB instead of %.1f MB (saved %.0f%%)",
+                path, n_rows, n_chunks, report['bytes'] / 1e6, report['naive_bytes'] / 1e6,
+                100 * report['saved_fraction'])
+    return report
+
+
+def _write_columns(path, directory, profiles, n_rows, chunk_rows, text_columns):
+    columns, outputs, dtypes, strings = [], [], [], {}
+    for position, profile in enumerate(profiles):
+        kind, dtype = profile.storage()
+        dtypes.append(dtype)
+        entry = {'name': profile.name}
+        if kind == 'string':
+            entry['file'] = f'{position}.pkl'
+            strings[position] = []
+            outputs.append(None)
+        else:
+            entry['file'] = f'{position}.npy'
+            # Appending chunks through a plain file keeps written pages out of this process
+            output = open(os.path.join(directory, entry['file']), 'wb')
+            np.lib.format.write_array_header_1_0(output, {
+                'descr': np.lib.format.dtype_to_descr(dtype), 'fortran_order': False, 'shape': (n_rows,)})
+            outputs.append(output)
+            if kind == 'categorical':
+                entry['categories'] = list(profile.categories)
+        columns.append(entry)
+
+    try:
+        for chunk in read_chunks(path, chunk_rows, text_columns):
+            for position, (profile, (_, values)) in enumerate(zip(profiles, chunk.items())):
+                output = outputs[position]
+                if output is None:
+                    strings[position].append(values.to_numpy(dtype=object))
+                    continue
+                if not profile.numeric:
+                    values = values.map(profile.categories).fillna(-1)
+                output.write(values.to_numpy(dtype=dtypes[position]).tobytes())
+    finally:
+        for output in outputs:
+            if output is not None:
+                output.close()
+
+    report_columns, total, naive_total = {}, 0, 0
+    for position, (profile, entry) in enumerate(zip(profiles, columns)):
+        if outputs[position] is None:
+            values = np.concatenate(strings.pop(position)) if n_rows else np.array([], dtype=object)
+            pd.to_pickle(pd.Series(values, dtype=object), os.path.join(directory, entry['file']))
+            nbytes, dtype = profile.text_bytes, 'object'
+        else:
+            categories = entry.get('categories', ())
+            nbytes = n_rows * dtypes[position].itemsize + sum(len(value) + _STR_OVERHEAD for value in categories)
+            dtype = 'category' if 'categories' in entry else str(dtypes[position])
+        naive = profile.naive_bytes(n_rows)
+        report_columns[profile.name] = {'dtype': dtype, 'bytes': nbytes, 'naive_bytes': naive}
+        total += nbytes
+        naive_total += naive
+
+    return columns, {
+        'columns': report_columns,
+        'bytes': total,
+        'naive_bytes': naive_total,
+        'saved_bytes': naive_total - total,
+        'saved_fraction': (naive_total - total) / naive_total if naive_total else 0.0,
+    }
@@ -1,10 +1,48 @@
-import pandas as pd
-import seaborn as sns
+import os
+import threading
 
-# Set visual style for plots
-sns.set(style="whitegrid")
+from data.cache import DatasetStore, DEFAULT_CACHE_DIR
+from data.ingest import DEFAULT_CHUNK_ROWS
+from instrumentation import stage
 
-def load_data(url="https://raw.githubusercontent.com/drewmayberry11/ML/main/voter_turnout_project_5.csv"):
-    # Specify the decimal parameter to handle commas as decimal points
-    voter_data = pd.read_csv(url, decimal=',', skipinitialspace=True)
+DEFAULT_URL = "https://raw.githubusercontent.com/drewmayberry11/ML/main/voter_turnout_project_5.csv"
+
+_stores = {}
+_stores_lock = threading.Lock()
+
+
+def get_dataset_store(source=None):
+    """
+    Return the shared DatasetStore for a source, creating it on first use.
+
+    The default source, cache directory and TTL can be overridden with the
+    VOTER_DATA_SOURCE, VOTER_DATA_CACHE_DIR and VOTER_DATA_TTL environment
+    variables (e.g. point VOTER_DATA_SOURCE at a local CSV to run offline).
+    VOTER_DATA_INGEST ('auto', 'chunked' or 'full'), VOTER_DATA_CHUNK_ROWS and
+    VOTER_DATA_CHUNKED_MIN_MB control when local files are streamed in chunks.
+    """
+    if source is None:
+        source = os.environ.get('VOTER_DATA_SOURCE', DEFAULT_URL)
+    with _stores_lock:
+        store = _stores.get(source)
+        if store is None:
+            store = DatasetStore(
+                source,
+                cache_dir=os.environ.get('VOTER_DATA_CACHE_DIR', DEFAULT_CACHE_DIR),
+                ttl=float(os.environ.get('VOTER_DATA_TTL', 3600)),
+                ingest=os.environ.get('VOTER_DATA_INGEST', 'auto'),
+                chunk_rows=int(os.environ.get('VOTER_DATA_CHUNK_ROWS', DEFAULT_CHUNK_ROWS)),
+                chunked_min_bytes=int(float(os.environ.get('VOTER_DATA_CHUNKED_MIN_MB', 64)) * 1024 * 1024),
+            )
+            _stores[source] = store
+    return store
+
+
+def load_data(url=None):
+    # Served from the local dataset cache; see data.cache.DatasetStore.
+    # A shallow copy: its columns are read-only views of the shared memory-mapped
+    # dataset, and pandas copy-on-write copies any column the caller modifies.
+    with stage('load_data'):
+        frame, _ = get_dataset_store(url).snapshot()
+        voter_data = frame.copy(deep=False)
     return voter_data
@@ -0,0 +1,162 @@
+# Precomputed, compressed JSON payloads for the GET /data endpoint.
+from collections import OrderedDict
+import gzip
+import threading
+
+import numpy as np
+import pandas as pd
+
+from instrumentation import count, stage
+from serialization import JSON_MIMETYPE, array_tokens, dumps, encode_columns
+
+try:
+    import brotli
+except ImportError:  # brotli is optional; gzip is always available
+    brotli = None
+
+
+class DataPayload:
+    """
+    Serialized form of one dataset version, built once and reused.
+
+    Holds every column as a NumPy array, the full records payload as JSON
+    bytes with the byte span of each row in it, and its gzip/brotli
+    variants. Row windows and index selections are answered by splicing
+    those spans, column projections by encoding just the selected slices,
+    so no request builds per-row dicts.
+
+    Args:
+        frame (DataFrame): The dataset; it is not modified.
+        version (str): Dataset version, used as the ETag.
+    """
+
+    def __init__(self, frame, version):
+        self.version = version
+        self.etag = f'"{version}"'
+        # Strip any leading/trailing spaces in column names
+        self.columns = [str(column).strip() for column in frame.columns]
+        self.arrays = {name: _column_array(frame[column]) for name, column in zip(self.columns, frame.columns)}
+        self.n_rows = len(frame)
+
+        with stage('serialize_json'):
+            rows = self._encode_rows(self.columns, slice(None))
+            lengths = np.fromiter(map(len, rows), dtype=np.int64, count=len(rows))
+            self.body = b'[' + b','.join(rows) + b']'
+        # Row i is body[starts[i]:ends[i]]; rows are separated by one comma after the opening bracket
+        self.starts = 1 + np.concatenate([[0], np.cumsum(lengths + 1)[:-1]]).astype(np.int64)
+        self.ends = self.starts + lengths
+        self.encoded = {'identity': self.body, 'gzip': gzip.compress(self.body, compresslevel=6)}
+        if brotli is not None:
+            self.encoded['br'] = brotli.compress(self.body)
+
+    def encode(self, mimetype=JSON_MIMETYPE, shape='records', positions=None, columns=None, offset=0, limit=None):
+        """
+        Encode a selection of the dataset.
+
+        Args:
+            mimetype (str): JSON_MIMETYPE, MSGPACK_MIMETYPE or ARROW_MIMETYPE.
+            shape (str): 'records' (a JSON array of row objects) or 'columns'
+                (`{"columns": {name: [...]}, "n_rows": n}`); MessagePack and
+                Arrow are always column-oriented.
+            positions (ndarray): Row positions (e.g. from a DatasetIndex); when
+                omitted, the rows from `offset` up to `limit` of them.
+            columns (list): Column projection; defaults to every column.
+
+        Returns:
+            bytes: The encoded body.
+        """
+        selection = self._selection(positions, offset, limit)
+        if mimetype == JSON_MIMETYPE and shape == 'records':
+            return self._json_rows(selection, columns)
+        columns = self.columns if columns is None else columns
+        arrays = {column: self.arrays[column][selection] for column in columns}
+        return encode_columns(arrays, len(self.starts[selection]), mimetype)
+
+    def _selection(self, positions, offset, limit):
+        if positions is not None:
+            return np.asarray(positions, dtype=np.intp)
+        stop = self.n_rows if limit is None else min(offset + limit, self.n_rows)
+        return slice(min(offset, self.n_rows), stop)
+
+    def _json_rows(self, selection, columns):
+        with stage('serialize_json'):
+            if columns is not None and columns != self.columns:
+                return b'[' + b','.join(self._encode_rows(columns, selection)) + b']'
+            starts, ends = self.starts[selection], self.ends[selection]
+            if len(starts) == 0:
+                return b'[]'
+            if isinstance(selection, slice):
+                # A window of consecutive rows is one slice of the full body
+                return b'[' + self.body[starts[0]:ends[-1]] + b']'
+            body = memoryview(self.body)
+            return b'[' + b','.join([body[start:end] for start, end in zip(starts.tolist(), ends.tolist())]) + b']'
+
+    def _encode_rows(self, columns, selection):
+        # One JSON object per row, assembled from per-column value tokens
+        n_rows = len(range(self.n_rows)[selection]) if isinstance(selection, slice) else len(selection)
+        if not columns:
+            return [b'{}'] * n_rows
+        parts = []
+        for position, column in enumerate(columns):
+            key = dumps(column) + b':'
+            if position == 0:
+                key = b'{' + key
+            tokens = [key + token for token in array_tokens(self.arrays[column][selection])]
+            if position == len(columns) - 1:
+                tokens = [token + b'}' for token in tokens]
+            parts.append(tokens)
+        return list(map(b','.join, zip(*parts)))
+
+    @staticmethod
+    def compress(body, encoding):
+        if encoding == 'gzip':
+            return gzip.compress(body, compresslevel=6)
+        if encoding == 'br':
+            return brotli.compress(body)
+        return body
+
+    @staticmethod
+    def available_encodings():
+        """Content codings this process can produce, in order of preference."""
+        return ['br', 'gzip'] if brotli is not None else ['gzip']
+
+
+def _column_array(series):
+    # float64 (NaN for missing), int64 or bool for numeric columns; objects (None for missing) otherwise
+    if pd.api.types.is_bool_dtype(series) and not series.isna().any():
+        return series.to_numpy(dtype=bool)
+    if pd.api.types.is_integer_dtype(series) and not series.isna().any():
+        return series.to_numpy(dtype=np.int64)
+    if pd.api.types.is_numeric_dtype(series) and not pd.api.types.is_bool_dtype(series):
+        return series.to_numpy(dtype=np.float64, na_value=np.nan)
+    return series.astype(object).where(series.notna(), None).to_numpy()
+
+
+# Payloads of the most recent dataset versions (requests still using the previous
+# snapshot during a reload keep hitting the cache)
+MAX_PAYLOAD_VERSIONS = 2
+_payloads = OrderedDict()
+_payload_lock = threading.Lock()
+
+
+def get_data_payload(frame, version):
+    """
+    Return the DataPayload for a dataset version, building it on first use.
+
+    Args:
+        frame (DataFrame): The dataset.
+        version (str): Its dataset version.
+    """
+    payload = _payloads.get(version)
+    if payload is not None:
+        count('data_payload', 'hits')
+        return payload
+    with _payload_lock:
+        payload = _payloads.get(version)
+        if payload is None:
+            count('data_payload', 'misses')
+            payload = DataPayload(frame, version)
+            _payloads[version] = payload
+            while len(_payloads) > MAX_PAYLOAD_VERSIONS:
+                _payloads.popitem(last=False)
+        return payload
@@ -1,4 +1,6 @@
-from sklearn.model_selection import train_test_split
+import logging
+
+logger = logging.getLogger(__name__)
 
 def define_features_and_target(voter_data):
     """
@@ -41,19 +43,17 @@ def split_dataset(voter_data, features, target, test_size=0.2, random_state=42):
               - 'y_train': Training target
               - 'y_test': Testing target
     """
-    print(features)
-    print(target)
+    from sklearn.model_selection import train_test_split  # Imported on first use to keep web-worker boot fast
+
     X = voter_data[features]
     y = voter_data[target]
-    print(X)
-    print(y)
     X_train, X_test, y_train, y_test = train_test_split(
         X, y, test_size=test_size, random_state=random_state
     )
-    print(X_train)
-    print(X_test)
-    print(y_train)
-    print(y_test)
+    logger.debug(
+        "Split %d rows into %d train / %d test (target=%s, %d features)",
+        len(X), len(X_train), len(X_test), target, len(features)
+    )
     return {
         'X_train': X_train,
         'X_test': X_test,
@@ -0,0 +1,287 @@
+# Year-sorted, partitioned index over a dataset version for filtered, paginated /data queries.
+import base64
+from collections import OrderedDict, namedtuple
+import hashlib
+import json
+import operator
+import re
+import threading
+
+import numpy as np
+import pandas as pd
+
+from instrumentation import count, stage
+
+# Columns the dataset is partitioned by when present (matched case-insensitively)
+PARTITION_KEYS = ('State', 'County')
+
+YEAR_COLUMN = 'Year'
+
+OPERATORS = {
+    '==': operator.eq,
+    '=': operator.eq,
+    '!=': operator.ne,
+    '>=': operator.ge,
+    '<=': operator.le,
+    '>': operator.gt,
+    '<': operator.lt,
+}
+_FILTER_PATTERN = re.compile(r'^\s*(.+?)\s*(==|!=|>=|<=|=|>|<)\s*(.*?)\s*$')
+
+# Query parameters that select the indexed query path of GET /data
+QUERY_PARAMETERS = ('year_from', 'year_to', 'filter', 'sort', 'cursor', 'state', 'county')
+
+# A parsed /data query. `keys` maps partition columns to required values,
+# `filters` holds (column, operator, value) predicates and `sort` holds
+# (column, descending) pairs.
+DataQuery = namedtuple('DataQuery', ['year_from', 'year_to', 'keys', 'filters', 'sort', 'columns', 'limit', 'offset'])
+
+
+class QueryError(ValueError):
+    """A /data query that cannot be answered (reported to the client as a 400)."""
+
+
+class DatasetIndex:
+    """
+    Row index of one dataset version, sorted by Year and partitioned by key.
+
+    Rows are ordered by Year once (stable, so ties keep file order, missing
+    years last). Each partition key column present in the dataset (State,
+    County) additionally maps every value to its rows, again in Year order.
+    A query picks the smallest matching partition and binary-searches the
+    year range in it, so selecting k rows costs O(log n + k) rather than a
+    scan of the dataset; filters and sorting only touch those k rows.
+
+    Args:
+        frame (DataFrame): The dataset; it is not modified.
+        version (str): Its dataset version.
+    """
+
+    def __init__(self, frame, version):
+        self.version = version
+        self.frame = frame
+        self.n_rows = len(frame)
+        self.columns = [str(column).strip() for column in frame.columns]
+        self._names = dict(zip(self.columns, frame.columns))
+        self._values = {}
+
+        if YEAR_COLUMN in self._names:
+            years = self.values(YEAR_COLUMN)
+            order = np.argsort(years, kind='stable')
+        else:
+            years, order = np.zeros(self.n_rows), np.arange(self.n_rows)
+        self.partitions = {None: {None: (order, years[order])}}
+
+        by_name = {column.lower(): column for column in self.columns}
+        self.keys = [by_name[key.lower()] for key in PARTITION_KEYS if key.lower() in by_name]
+        for key in self.keys:
+            codes, uniques = pd.factorize(self.values(key)[order])
+            grouping = np.argsort(codes, kind='stable')
+            bounds = np.searchsorted(codes[grouping], np.arange(len(uniques) + 1))
+            self.partitions[key] = {
+                value: (order[grouping[start:stop]], years[order[grouping[start:stop]]])
+                for value, start, stop in zip(uniques, bounds[:-1], bounds[1:])
+            }
+
+    def values(self, column):
+        """A column as a NumPy array: float64 for numeric columns, else Python objects."""
+        values = self._values.get(column)
+        if values is None:
+            series = self.frame[self._names[column]]
+            if pd.api.types.is_numeric_dtype(series) and not pd.api.types.is_bool_dtype(series):
+                values = series.to_numpy(dtype=np.float64, na_value=np.nan)
+            else:
+                values = series.astype(object).to_numpy()
+            self._values[column] = values
+        return values
+
+    def is_numeric(self, column):
+        return self.values(column).dtype.kind == 'f'
+
+    def select(self, query):
+        """
+        Return the row positions matching a query, in result order.
+
+        Args:
+            query (DataQuery): A parsed query; its columns must exist.
+
+        Returns:
+            ndarray: Row positions into the frame.
+        """
+        # Smallest partition first; any other key becomes an ordinary filter
+        candidates = [(key, self.partitions[key].get(value)) for key, value in query.keys.items()]
+        if any(partition is None for _, partition in candidates):
+            return np.empty(0, dtype=np.intp)
+        key, (rows, years) = min(candidates, key=lambda item: len(item[1][0]), default=(None, self.partitions[None][None]))
+        filters = [(column, operator.eq, value) for column, value in query.keys.items() if column != key]
+        filters += query.filters
+
+        start = 0 if query.year_from is None else np.searchsorted(years, query.year_from, side='left')
+        stop = len(rows) if query.year_to is None else np.searchsorted(years, query.year_to, side='right')
+        rows = rows[start:stop]
+
+        if filters:
+            mask = np.ones(len(rows), dtype=bool)
+            for column, compare, value in filters:
+                with np.errstate(invalid='ignore'):
+                    mask &= np.asarray(compare(self.values(column)[rows], value), dtype=bool)
+            rows = rows[mask]
+        if query.sort:
+            rows = rows[self._sort_order(rows, query.sort)]
+        return rows
+
+    def _sort_order(self, rows, sort):
+        # np.lexsort sorts by its last key first; missing values go last in either direction
+        keys = []
+        for column, descending in reversed(sort):
+            values = self.values(column)[rows]
+            if self.is_numeric(column):
+                missing = np.isnan(values)
+                ranks = np.where(missing, 0, values)
+            else:
+                missing = pd.isna(values)
+                ranks = pd.factorize(values, sort=True)[0].astype(np.float64)
+            keys += [-ranks if descending else ranks, missing]
+        return np.lexsort(keys)
+
+
+def parse_query(args, index):
+    """
+    Parse the query string of GET /data.
+
+    Supported parameters: `year_from`/`year_to` (inclusive), `state` and
+    `county` (partition keys), repeatable `filter=<column><op><value>` with
+    op in ==, =, !=, >, >=, <, <=, `sort=<column>[,-<column>...]` (a leading
+    '-' sorts descending), `columns`, `limit`, `offset` and `cursor` (from
+    the previous page's X-Next-Cursor header, replacing `offset`).
+
+    Args:
+        args (MultiDict): The request arguments.
+        index (DatasetIndex): Index of the dataset version being queried.
+
+    Returns:
+        DataQuery: The parsed query.
+
+    Raises:
+        QueryError: If a parameter is malformed or names an unknown column.
+    """
+    def known(column):
+        if column not in index.columns:
+            raise QueryError(f"Unknown column: {column!r}")
+        return column
+
+    def integer(name):
+        value = args.get(name)
+        if value is None or value == '':
+            return None
+        try:
+            return int(value)
+        except ValueError:
+            raise QueryError(f"'{name}' must be an integer")
+
+    keys = {}
+    for parameter in ('state', 'county'):
+        if args.get(parameter):
+            column = next((key for key in index.keys if key.lower() == parameter), None)
+            if column is None:
+                raise QueryError(f"The dataset has no {parameter} column")
+            keys[column] = args[parameter]
+            if index.is_numeric(column):
+                try:
+                    keys[column] = float(keys[column])
+                except ValueError:
+                    raise QueryError(f"'{parameter}' must be a number")
+
+    filters = []
+    for expression in args.getlist('filter'):
+        match = _FILTER_PATTERN.match(expression)
+        if not match:
+            raise QueryError(f"Invalid filter {expression!r}; expected <column><op><value>")
+        column, op, value = known(match.group(1)), match.group(2), match.group(3)
+        if index.is_numeric(column):
+            try:
+                value = float(value)
+            except ValueError:
+                raise QueryError(f"Filter value for {column!r} must be a number")
+        elif op not in ('==', '=', '!='):
+            raise QueryError(f"Only ==, = and != can filter the text column {column!r}")
+        if column in index.keys and op in ('==', '=') and column not in keys:
+            keys[column] = value
+        else:
+            filters.append((column, OPERATORS[op], value))
+
+    sort = []
+    for column in (args.get('sort') or '').split(','):
+        column = column.strip()
+        if column:
+            descending = column.startswith('-')
+            sort.append((known(column.lstrip('-').strip()), descending))
+
+    columns = args.get('columns')
+    columns = [known(column.strip()) for column in columns.split(',') if column.strip()] if columns else None
+
+    limit, offset = integer('limit'), integer('offset') or 0
+    if (limit is not None and limit < 0) or offset < 0:
+        raise QueryError("'offset' and 'limit' must be non-negative")
+
+    query = DataQuery(integer('year_from'), integer('year_to'), keys, filters, sort, columns, limit, offset)
+    cursor = args.get('cursor')
+    if cursor:
+        state = decode_cursor(cursor)
+        if state.get('v') != index.version:
+            raise QueryError("The dataset changed since this cursor was issued; start again without 'cursor'")
+        if state.get('q') != query_fingerprint(args):
+            raise QueryError("The cursor belongs to a different query")
+        query = query._replace(offset=state['o'])
+    return query
+
+
+def query_fingerprint(args):
+    """Short hash of every query parameter except the cursor, tying a cursor to its query."""
+    items = sorted((name, value) for name, value in args.items(multi=True) if name not in ('cursor', 'offset'))
+    return hashlib.sha1(json.dumps(items).encode()).hexdigest()[:8]
+
+
+def encode_cursor(version, args, offset):
+    state = {'v': version, 'q': query_fingerprint(args), 'o': offset}
+    return base64.urlsafe_b64encode(json.dumps(state, separators=(',', ':')).encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor):
+    try:
+        state = json.loads(base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)))
+        if not isinstance(state.get('o'), int) or state['o'] < 0:
+            raise ValueError
+        return state
+    except (ValueError, TypeError, AttributeError):
+        raise QueryError("Invalid cursor")
+
+
+# Indexes of the most recent dataset versions, like the /data payloads
+MAX_INDEX_VERSIONS = 2
+_indexes = OrderedDict()
+_index_lock = threading.Lock()
+
+
+def get_dataset_index(frame, version):
+    """
+    Return the DatasetIndex for a dataset version, building it on first use.
+
+    Args:
+        frame (DataFrame): The dataset.
+        version (str): Its dataset version.
+    """
+    index = _indexes.get(version)
+    if index is not None:
+        count('dataset_index', 'hits')
+        return index
+    with _index_lock:
+        index = _indexes.get(version)
+        if index is None:
+            count('dataset_index', 'misses')
+            with stage('build_dataset_index'):
+                index = DatasetIndex(frame, version)
+            _indexes[version] = index
+            while len(_indexes) > MAX_INDEX_VERSIONS:
+                _indexes.popitem(last=False)
+        return index
@@ -0,0 +1,199 @@
+# Immutable, versioned dataset snapshots with atomic hot-reload.
+from collections import namedtuple
+import logging
+import os
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+# One published dataset version. `frame` is shared by every request using the
+# snapshot and must never be modified (pandas copy-on-write makes derived
+# frames safe); `version` keys every downstream cache. Versions made by
+# appending rows also carry their `parent` version and the `appended` rows,
+# so warmers can update the parent's caches instead of rebuilding them.
+DatasetSnapshot = namedtuple('DatasetSnapshot', ['frame', 'version', 'loaded_at', 'parent', 'appended'],
+                             defaults=(None, None))
+
+
+def _strip_columns(frame):
+    return frame.rename(columns=lambda column: column.strip() if isinstance(column, str) else column)
+
+
+def build_snapshot(frame, version, parent=None, appended=None):
+    """
+    Wrap a dataset version as a snapshot.
+
+    Column names are stripped of surrounding whitespace once here, so no
+    request handler needs to touch the shared frame. The copy is shallow:
+    column data stays shared with the DatasetStore.
+    """
+    appended = _strip_columns(appended) if appended is not None else None
+    return DatasetSnapshot(_strip_columns(frame), version, time.time(), parent, appended)
+
+
+class DatasetManager:
+    """
+    Publishes immutable dataset snapshots and swaps them atomically.
+
+    Readers call `current()`, a plain attribute read with no lock, and use
+    that snapshot for the whole request. `reload()` builds the next snapshot
+    off to the side, runs the registered warmers on it (e.g. fitting the
+    trend lines for the new version) and only then publishes it, so requests
+    never wait on a reload and caches keyed on the old version keep serving
+    requests that are still in flight.
+
+    Args:
+        store (DatasetStore): Where dataset versions come from.
+    """
+
+    def __init__(self, store):
+        self.store = store
+        self._snapshot = None
+        self._warmers = []
+        self._load_lock = threading.Lock()
+        self._reload_lock = threading.Lock()
+        self._thread_lock = threading.Lock()
+        self._reload_thread = None
+        self._watcher_pid = None
+        self._counters = {'reloads': 0, 'unchanged': 0, 'reload_errors': 0, 'appends': 0}
+
+    def current(self):
+        """Return the published snapshot, loading the first one if needed."""
+        snapshot = self._snapshot
+        if snapshot is None:
+            with self._load_lock:
+                if self._snapshot is None:
+                    frame, version = self.store.snapshot()
+                    self._snapshot = build_snapshot(frame, version)
+                snapshot = self._snapshot
+        return snapshot
+
+    def add_warmer(self, warmer):
+        """
+        Run `warmer(snapshot)` on every new snapshot before it is published.
+
+        Warmer failures are logged and do not block the reload.
+        """
+        self._warmers.append(warmer)
+
+    def reload(self, block=True, revalidate=True):
+        """
+        Load the store's newest version and publish it if it changed.
+
+        Args:
+            block (bool): Wait for the reload instead of running it in a
+                background thread.
+            revalidate (bool): Check the source itself; False only picks up
+                versions other workers already wrote to the shared cache.
+
+        Returns:
+            bool: True if a new snapshot was published (always False when
+            running in the background).
+        """
+        if block:
+            with self._reload_lock:
+                return self._reload(revalidate)
+        with self._thread_lock:
+            if self._reload_thread is not None and self._reload_thread.is_alive():
+                return False
+            self._reload_thread = threading.Thread(target=self._background_reload, args=(revalidate,), daemon=True)
+            self._reload_thread.start()
+        return False
+
+    def append(self, rows):
+        """
+        Append rows to the live dataset and publish the result.
+
+        The new version is written to the store's shared cache (see
+        DatasetStore.append) and published like a reload, after the warmers
+        ran on a snapshot carrying the parent version and the appended rows.
+
+        Args:
+            rows: Records or a DataFrame (see data.cache.conform_rows).
+
+        Returns:
+            DatasetSnapshot: The published snapshot.
+
+        Raises:
+            ValueError: If the rows do not fit the dataset.
+        """
+        with self._reload_lock:
+            current = self.current()
+            frame, version, parent, appended = self.store.append(rows)
+            snapshot = build_snapshot(frame, version, parent=parent, appended=appended)
+            self._publish(snapshot, current)
+            self._counters['appends'] += 1
+            return snapshot
+
+    def watch(self, interval):
+        """
+        Poll for new dataset versions every `interval` seconds in a daemon thread.
+
+        Local files are revalidated on every tick (one stat call); URLs only
+        once the store's TTL has expired. Every tick also picks up versions
+        other gunicorn workers have loaded. Safe to call repeatedly: one
+        watcher runs per process, and a process forked from a watching one
+        starts its own.
+        """
+        if not interval or self._watcher_pid == os.getpid():
+            return
+        self._watcher_pid = os.getpid()
+        threading.Thread(target=self._watch, args=(interval,), daemon=True).start()
+
+    def stats(self):
+        snapshot = self._snapshot
+        return dict(self._counters, version=snapshot.version if snapshot else None)
+
+    # ------------------------------------------------------------------
+    # Internals
+    # ------------------------------------------------------------------
+    def _reload(self, revalidate):
+        try:
+            if revalidate:
+                self.store.refresh(block=True)
+            else:
+                self.store.sync()
+            frame, version = self.store.snapshot()
+        except Exception:
+            self._counters['reload_errors'] += 1
+            raise
+        current = self.current()
+        if version == current.version:
+            self._counters['unchanged'] += 1
+            return False
+
+        # Rows another worker appended to the version we serve: warm incrementally here too
+        lineage = self.store.lineage(version)
+        if lineage is not None and lineage[0] == current.version:
+            snapshot = build_snapshot(frame, version, parent=lineage[0], appended=frame.iloc[len(frame) - lineage[1]:])
+        else:
+            snapshot = build_snapshot(frame, version)
+        self._publish(snapshot, current)
+        self._counters['reloads'] += 1
+        return True
+
+    def _publish(self, snapshot, current):
+        for warmer in self._warmers:
+            try:
+                warmer(snapshot)
+            except Exception:
+                logger.exception("Warming dataset version %s failed", snapshot.version)
+        # A single reference assignment: readers see the old or the new snapshot, never a mix
+        self._snapshot = snapshot
+        logger.info("Published dataset version %s (was %s)", snapshot.version, current.version)
+
+    def _background_reload(self, revalidate):
+        try:
+            self.reload(block=True, revalidate=revalidate)
+        except Exception:
+            # The current snapshot keeps being served
+            logger.exception("Background reload of the dataset failed")
+
+    def _watch(self, interval):
+        while True:
+            time.sleep(interval)
+            try:
+                self.reload(block=True, revalidate=self.store.is_local_file or self.store.stale)
+            except Exception:
+                logger.exception("Dataset watcher could not reload %s", self.store.source)
@@ -0,0 +1,23 @@
+# gunicorn settings (see Procfile); also picked up by a plain `gunicorn app:app` run from this directory.
+import os
+
+from data.cache import DEFAULT_CACHE_DIR
+
+# Import the app (and map the dataset) once in the master; workers inherit it on fork
+preload_app = True
+
+
+def on_starting(server):
+    # Per-worker metrics snapshots from a previous run would be added to this run's totals
+    from instrumentation import metrics
+    metrics.set_directory(os.environ.get('METRICS_DIR', os.path.join(os.path.dirname(DEFAULT_CACHE_DIR), 'metrics')))
+    metrics.clear_directory()
+
+
+def pre_fork(server, worker):
+    # With preload_app the master runs app.warm_up(); fork only once it is done, so no
+    # worker inherits a lock held mid-load (and every worker starts warm)
+    import sys
+    app_module = sys.modules.get('app')
+    if app_module is not None and app_module.warm_up_state['thread'] is not None:
+        app_module.warm_up_state['thread'].join()
@@ -0,0 +1,357 @@
+# Request/stage timing, cache counters, a Prometheus /metrics exporter and an opt-in request profiler.
+import bisect
+from contextlib import contextmanager
+import functools
+import glob
+import json
+import logging
+import os
+import re
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+# Histogram bucket upper bounds, in seconds
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+# Cache statistics that are gauges for every cache; register_cache adds a cache's own,
+# and every other numeric statistic is a counter
+CACHE_GAUGES = ('entries', 'nbytes')
+
+
+class Metrics:
+    """
+    Thread-safe counters, gauges and histograms for one process.
+
+    Series are identified by a metric name plus a dict of labels. When
+    `directory` is set, the process periodically writes its snapshot there
+    so that any gunicorn worker can export the sum over all workers.
+
+    Args:
+        directory (str): Shared directory for per-process snapshots, or None.
+        flush_interval (float): Minimum seconds between snapshot writes.
+        buckets (tuple): Histogram bucket upper bounds.
+    """
+
+    def __init__(self, directory=None, flush_interval=1.0, buckets=DEFAULT_BUCKETS):
+        self.directory = None
+        self.flush_interval = flush_interval
+        self.buckets = tuple(buckets)
+        self._counters = {}
+        self._histograms = {}
+        self._caches = {}
+        self._lock = threading.Lock()
+        self._last_flush = 0.0
+        self._flusher_pid = None
+        self.set_directory(directory)
+
+    def set_directory(self, directory):
+        """Share snapshots through `directory` (None keeps metrics process-local)."""
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+
+    def clear_directory(self):
+        """Delete every snapshot in the shared directory, e.g. when the server starts."""
+        if not self.directory:
+            return
+        for path in glob.glob(os.path.join(self.directory, '*.json')):
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+    @staticmethod
+    def _series(name, labels):
+        return json.dumps([name, sorted((labels or {}).items())])
+
+    def increment(self, name, labels=None, amount=1):
+        key = self._series(name, labels)
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + amount
+
+    def observe(self, name, seconds, labels=None):
+        key = self._series(name, labels)
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = {'buckets': [0] * len(self.buckets), 'sum': 0.0, 'count': 0}
+            position = bisect.bisect_left(self.buckets, seconds)
+            if position < len(self.buckets):
+                histogram['buckets'][position] += 1
+            histogram['sum'] += seconds
+            histogram['count'] += 1
+
+    def register_cache(self, name, stats, gauges=()):
+        """
+        Export a cache's `stats()` dict on every scrape.
+
+        Statistics are exported as voter_cache_events_total counters, except
+        CACHE_GAUGES and `gauges`, which are current levels (sizes, pool
+        widths, requests in flight) exported as voter_cache_<stat> gauges.
+
+        Args:
+            name (str): Value of the 'cache' label.
+            stats (callable): Returns a dict of numeric statistics (e.g. hits, misses, entries).
+            gauges (iterable): Statistics of this cache that are gauges.
+        """
+        with self._lock:
+            self._caches[name] = (stats, frozenset(CACHE_GAUGES).union(gauges))
+
+    def snapshot(self):
+        """Plain-data copy of this process's series, including current cache statistics."""
+        with self._lock:
+            counters = dict(self._counters)
+            histograms = {key: dict(value, buckets=list(value['buckets'])) for key, value in self._histograms.items()}
+            caches = dict(self._caches)
+
+        gauges = {}
+        for cache, (stats, cache_gauges) in caches.items():
+            try:
+                values = stats()
+            except Exception:
+                logger.exception("Could not collect statistics for cache %s", cache)
+                continue
+            for stat, value in values.items():
+                if isinstance(value, bool) or not isinstance(value, (int, float)):
+                    continue
+                if stat in cache_gauges:
+                    gauges[self._series(f'voter_cache_{stat}', {'cache': cache})] = value
+                else:
+                    counters[self._series('voter_cache_events_total', {'cache': cache, 'event': stat})] = value
+        return {'pid': os.getpid(), 'buckets': list(self.buckets), 'counters': counters,
+                'gauges': gauges, 'histograms': histograms}
+
+    def flush(self, force=False):
+        """Write this process's snapshot to the shared directory (rate-limited)."""
+        if not self.directory:
+            return
+        if self._flusher_pid != os.getpid():
+            # One background thread per (forked) worker writes what rate-limiting held back
+            self._flusher_pid = os.getpid()
+            threading.Thread(target=self._flush_periodically, daemon=True).start()
+        now = time.monotonic()
+        if not force and now - self._last_flush < self.flush_interval:
+            return
+        self._last_flush = now
+        path = os.path.join(self.directory, f'{os.getpid()}.json')
+        tmp_path = f'{path}.tmp'
+        try:
+            with open(tmp_path, 'w') as f:
+                json.dump(self.snapshot(), f)
+            os.replace(tmp_path, path)
+        except OSError:
+            logger.exception("Could not write metrics snapshot to %s", path)
+
+    def _flush_periodically(self):
+        while True:
+            time.sleep(self.flush_interval)
+            if time.monotonic() - self._last_flush >= self.flush_interval:
+                self.flush()
+
+    def collect(self):
+        """
+        Snapshots of every process sharing the directory (or just this one).
+
+        Counters and histograms of exited workers are kept so totals never go
+        backwards; their gauges are dropped.
+        """
+        if not self.directory:
+            return [self.snapshot()]
+        self.flush(force=True)
+        snapshots = []
+        for path in glob.glob(os.path.join(self.directory, '*.json')):
+            try:
+                with open(path) as f:
+                    snapshot = json.load(f)
+            except (OSError, ValueError):
+                continue
+            if snapshot['pid'] != os.getpid() and not _pid_alive(snapshot['pid']):
+                snapshot['gauges'] = {}
+            snapshots.append(snapshot)
+        return snapshots
+
+    def render(self):
+        """The aggregated series in the Prometheus text exposition format."""
+        counters, gauges, histograms = {}, {}, {}
+        for snapshot in self.collect():
+            for key, value in snapshot['counters'].items():
+                counters[key] = counters.get(key, 0) + value
+            for key, value in snapshot['gauges'].items():
+                gauges[key] = gauges.get(key, 0) + value
+            if snapshot['buckets'] != list(self.buckets):
+                continue
+            for key, value in snapshot['histograms'].items():
+                total = histograms.setdefault(key, {'buckets': [0] * len(self.buckets), 'sum': 0.0, 'count': 0})
+                total['buckets'] = [a + b for a, b in zip(total['buckets'], value['buckets'])]
+                total['sum'] += value['sum']
+                total['count'] += value['count']
+
+        lines = []
+        for kind, series in (('counter', counters), ('gauge', gauges)):
+            for name, labels, value in _sorted_series(series):
+                _type_line(lines, name, kind)
+                lines.append(f'{name}{_labels(labels)} {_number(value)}')
+        for name, labels, value in _sorted_series(histograms):
+            _type_line(lines, name, 'histogram')
+            cumulative = 0
+            for bound, observations in zip(self.buckets, value['buckets']):
+                cumulative += observations
+                lines.append(f'{name}_bucket{_labels(labels + [("le", _number(bound))])} {cumulative}')
+            lines.append(f'{name}_bucket{_labels(labels + [("le", "+Inf")])} {value["count"]}')
+            lines.append(f'{name}_sum{_labels(labels)} {_number(value["sum"])}')
+            lines.append(f'{name}_count{_labels(labels)} {value["count"]}')
+        return '\n'.join(lines) + '\n'
+
+
+def _pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except OSError:
+        return True
+    return True
+
+
+def _sorted_series(series):
+    parsed = [(json.loads(key), value) for key, value in series.items()]
+    return sorted(((name, [tuple(label) for label in labels], value) for (name, labels), value in parsed),
+                  key=lambda item: (item[0], item[1]))
+
+
+def _type_line(lines, name, kind):
+    header = f'# TYPE {name} {kind}'
+    if header not in lines:
+        lines.append(header)
+
+
+def _labels(labels):
+    if not labels:
+        return ''
+    escaped = (str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, value in labels)
+    return '{' + ','.join(f'{name}="{value}"' for (name, _), value in zip(labels, escaped)) + '}'
+
+
+def _number(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+# Process-wide registry used by the app and the data/model modules
+metrics = Metrics(os.environ.get('METRICS_DIR') or None)
+
+
+@contextmanager
+def stage(name):
+    """Time a block of work as one observation of voter_stage_seconds{stage=name}."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        metrics.observe('voter_stage_seconds', time.perf_counter() - start, {'stage': name})
+
+
+def timed_stage(name):
+    """Decorator form of stage()."""
+    def decorator(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            with stage(name):
+                return function(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def count(name, event, amount=1):
+    """Increment voter_cache_events_total for caches without a stats() method."""
+    metrics.increment('voter_cache_events_total', {'cache': name, 'event': event}, amount)
+
+
+# ----------------------------------------------------------------------
+# Flask integration
+# ----------------------------------------------------------------------
+PROFILE_HEADER = 'X-Debug-Profile'
+
+
+def init_app(app, registry=None, profile_dir=None):
+    """
+    Record per-route latency histograms and JSON serialization time, and
+    enable the request profiler.
+
+    Profiling is opt-in: it runs only when PROFILE_TOKEN is set in the
+    environment and a request carries the header `X-Debug-Profile: <token>`.
+    Traces are written to `profile_dir` (pyinstrument HTML when pyinstrument
+    is installed, otherwise cProfile stats) and the file name is returned in
+    the `X-Profile-Path` response header.
+
+    Args:
+        app (Flask): The application.
+        registry (Metrics): Where to record; defaults to the process-wide registry.
+        profile_dir (str): Directory for profile traces.
+    """
+    from flask import g, request
+
+    registry = registry or metrics
+    profile_token = os.environ.get('PROFILE_TOKEN')
+    profile_dir = profile_dir or os.environ.get('PROFILE_DIR', 'profiles')
+
+    # Times the provider the app already uses (see serialization.json_provider)
+    class TimedJSONProvider(type(app.json)):
+        def dumps(self, obj, **kwargs):
+            with stage('serialize_json'):
+                return super().dumps(obj, **kwargs)
+
+    app.json = TimedJSONProvider(app)
+
+    @app.before_request
+    def _start_timer():
+        g.metrics_start = time.perf_counter()
+        if profile_token and request.headers.get(PROFILE_HEADER) == profile_token:
+            g.profiler = _start_profiler()
+
+    @app.after_request
+    def _record_request(response):
+        # Streamed responses (e.g. /predict/batch) are timed to their first byte
+        start = g.pop('metrics_start', None)
+        if start is not None:
+            route = request.url_rule.rule if request.url_rule is not None else 'unmatched'
+            labels = {'route': route, 'method': request.method, 'status': str(response.status_code)}
+            registry.observe('voter_request_seconds', time.perf_counter() - start, labels)
+        profiler = g.pop('profiler', None)
+        if profiler is not None:
+            response.headers['X-Profile-Path'] = os.path.basename(_stop_profiler(profiler, profile_dir, request.path))
+        registry.flush()
+        return response
+
+    @app.route('/metrics', methods=['GET'])
+    def export_metrics():
+        return app.response_class(registry.render(), mimetype='text/plain; version=0.0.4')
+
+
+def _start_profiler():
+    try:
+        from pyinstrument import Profiler
+    except ImportError:  # pyinstrument is optional; cProfile is always available
+        import cProfile
+        profiler = cProfile.Profile()
+        profiler.enable()
+        return profiler
+    profiler = Profiler(async_mode='disabled')
+    profiler.start()
+    return profiler
+
+
+def _stop_profiler(profiler, profile_dir, path):
+    os.makedirs(profile_dir, exist_ok=True)
+    name = f"{time.strftime('%Y%m%d-%H%M%S')}-{os.getpid()}-{re.sub(r'[^A-Za-z0-9]+', '_', path).strip('_') or 'root'}"
+    if hasattr(profiler, 'disable'):
+        profiler.disable()
+        trace_path = os.path.join(profile_dir, f'{name}.prof')
+        profiler.dump_stats(trace_path)
+    else:
+        profiler.stop()
+        trace_path = os.path.join(profile_dir, f'{name}.html')
+        with open(trace_path, 'w') as f:
+            f.write(profiler.output_html())
+    return trace_path
@@ -0,0 +1,396 @@
+# Rolling-origin backtests of the per-column year-trend forecasts, with linear cutoffs from prefix sums.
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from concurrent.futures.process import BrokenProcessPool
+import atexit
+import json
+import multiprocessing
+import threading
+
+import numpy as np
+
+from instrumentation import stage
+from model.forecast import RANDOM_FOREST_PARAMS
+from model.registry import MODEL_FACTORIES, model_factory
+
+DEFAULT_HORIZONS = 3
+MAX_HORIZONS = 10
+DEFAULT_MIN_TRAIN_YEARS = 5
+DEFAULT_MAX_FOLDS = 20_000
+
+# Head counts rather than turnout rates: backtested only on request, and never
+# pooled into 'overall', whose errors are in percentage points
+COUNT_COLUMNS = ('Voting Population',)
+
+# Hyperparameters of each model type unless the request overrides them (those of /predict*)
+DEFAULT_PARAMS = {'linear': {}, 'random_forest': RANDOM_FOREST_PARAMS}
+
+
+class BacktestError(ValueError):
+    """Invalid backtest request (reported to the caller as a 400)."""
+
+
+class BacktestData:
+    """
+    A dataset's year-trend series, sorted by year, for rolling-origin splits.
+
+    Rows are grouped by year; cutoff `g` trains on every row of the first
+    `g + 1` years and a forecast `h` cycles ahead is scored on the rows of
+    year `g + h`.
+
+    Attributes:
+        columns (list): Numeric columns other than 'Year'.
+        years (ndarray): Year of every row, ascending, as float64.
+        values (ndarray): Values, shape (n_rows, n_columns), NaN where missing.
+        unique_years (ndarray): Distinct years, ascending.
+        group (ndarray): Index into `unique_years` of every row.
+        ends (ndarray): Number of rows up to and including each year.
+        order (ndarray): Position in the dataset of every sorted row.
+    """
+
+    def __init__(self, voter_data):
+        columns = [column for column in voter_data.select_dtypes('number').columns if column != 'Year']
+        years = voter_data['Year'].to_numpy(dtype=np.float64)
+        order = np.argsort(years, kind='stable')
+        self.columns = columns
+        self.order = order
+        self.years = years[order]
+        self.values = voter_data[columns].to_numpy(dtype=np.float64, na_value=np.nan)[order]
+        self.mask = ~np.isnan(self.values)
+        self.unique_years, self.group = np.unique(self.years, return_inverse=True)
+        self.ends = np.searchsorted(self.years, self.unique_years, side='right')
+        self._index = {column: i for i, column in enumerate(columns)}
+
+    def index(self, columns):
+        unknown = [column for column in columns if column not in self._index]
+        if unknown:
+            raise BacktestError(f"Invalid or non-numeric columns: {unknown}")
+        return np.array([self._index[column] for column in columns], dtype=np.intp)
+
+
+def linear_cutoff_predictions(data, columns_idx, cutoffs):
+    """
+    Trend-line forecasts of every later year from every cutoff, without refits.
+
+    Sums of x, y, xy, x² (about the overall means, for conditioning) and the
+    counts are accumulated once over the year-sorted rows; the fit at a
+    cutoff is read off the prefix sums at its last row, so each cutoff costs
+    O(columns) however long the history. Coefficients are those of sklearn's
+    LinearRegression on the cutoff's training rows.
+
+    Args:
+        data (BacktestData): The series.
+        columns_idx (ndarray): Columns to backtest.
+        cutoffs (ndarray): Cutoff year groups.
+
+    Returns:
+        ndarray: Shape (n_cutoffs, n_years, n_columns); entry [i, t, c] is the
+        forecast of year t from cutoff i (NaN for t at or before the cutoff,
+        or when the column has no training value).
+    """
+    x = data.years[:, None]
+    y = data.values[:, columns_idx]
+    mask = data.mask[:, columns_idx]
+    with np.errstate(invalid='ignore', divide='ignore'):
+        origin_x = data.years.mean()
+        present = mask.sum(axis=0)
+        origin_y = np.where(present > 0, np.where(mask, y, 0.0).sum(axis=0) / np.maximum(present, 1), 0.0)
+        dx = np.where(mask, x - origin_x, 0.0)
+        dy = np.where(mask, y - origin_y, 0.0)
+        prefix = np.cumsum(np.stack([mask.astype(np.float64), dx, dy, dx * dy, dx * dx]), axis=1)
+
+        n, s_x, s_y, s_xy, s_xx = prefix[:, data.ends[cutoffs] - 1]
+        mean_dx, mean_dy = s_x / n, s_y / n
+        sxx = np.maximum(s_xx - n * mean_dx * mean_dx, 0.0)
+        sxy = s_xy - n * mean_dx * mean_dy
+        slopes = np.where(sxx > 0, sxy / np.where(sxx > 0, sxx, 1.0), 0.0)
+        intercepts = (origin_y + mean_dy) - slopes * (origin_x + mean_dx)
+        intercepts = np.where(n > 0, intercepts, np.nan)
+
+    predictions = intercepts[:, None, :] + slopes[:, None, :] * data.unique_years[None, :, None]
+    later = np.arange(len(data.unique_years))[None, :] > cutoffs[:, None]
+    return np.where(later[:, :, None], predictions, np.nan)
+
+
+# ----------------------------------------------------------------------
+# Cutoff tasks (run inside the pool workers)
+# ----------------------------------------------------------------------
+def _init_worker():
+    from threadpoolctl import threadpool_limits
+
+    # One core per task; the pool provides the parallelism
+    threadpool_limits(limits=1)
+
+
+def _fit_cutoff(model_type, params, years, values, target_years):
+    """
+    Fit one model per column on a cutoff's training rows and forecast the later years.
+
+    Returns:
+        ndarray: Shape (n_target_years, n_columns), NaN for columns without training rows.
+    """
+    predictions = np.full((len(target_years), values.shape[1]), np.nan)
+    for position in range(values.shape[1]):
+        present = ~np.isnan(values[:, position])
+        if not present.any():
+            continue
+        estimator = model_factory(model_type)(**params)
+        estimator.fit(years[present].reshape(-1, 1), values[present, position])
+        predictions[:, position] = estimator.predict(np.asarray(target_years).reshape(-1, 1))
+    return predictions
+
+
+class Backtester:
+    """
+    Rolling-origin backtests of the /predict and /predict-randomforest models.
+
+    For every cutoff year, each model is trained on the years up to the
+    cutoff and scored on the next `horizons` election years, giving error
+    tables per forecast horizon instead of in-sample metrics. Linear trends
+    come from prefix sums (see linear_cutoff_predictions); other model types
+    are fitted with one task per cutoff in a process pool. Forecasts of
+    every (model, hyperparameters, column, cutoff) fold are cached per
+    dataset version, so later requests with other horizons, columns or
+    cutoffs only fit the folds they have not seen.
+
+    Args:
+        max_workers (int): Pool processes; 0 fits the cutoffs in this process.
+        max_versions (int): Dataset versions whose series are cached (LRU).
+        max_folds (int): Fold forecasts cached across versions (LRU).
+    """
+
+    def __init__(self, max_workers=2, max_versions=2, max_folds=DEFAULT_MAX_FOLDS):
+        self.max_workers = max_workers
+        self.max_versions = max_versions
+        self.max_folds = max_folds
+        self._data = OrderedDict()
+        self._folds = OrderedDict()
+        self._lock = threading.Lock()
+        self._pool = None
+        self._counters = {'folds_fitted': 0, 'folds_cached': 0, 'folds_evicted': 0, 'linear_cutoffs': 0}
+        atexit.register(self.shutdown)
+
+    def backtest(self, voter_data, version, models=None, columns=None, params=None, horizons=DEFAULT_HORIZONS,
+                 min_train_years=DEFAULT_MIN_TRAIN_YEARS, cutoffs=None):
+        """
+        Backtest forecasts from every cutoff year.
+
+        Args:
+            voter_data (DataFrame): The raw dataset.
+            version (str): Its dataset version.
+            models (list): Model types of MODEL_FACTORIES (default: all).
+            columns (list): Columns to forecast (default: every numeric column
+                but COUNT_COLUMNS).
+            params (dict): Per-model hyperparameters replacing DEFAULT_PARAMS.
+            horizons (int): Score forecasts 1 to `horizons` election years ahead.
+            min_train_years (int): Distinct years the first cutoff trains on.
+            cutoffs (list): Explicit cutoff years (default: every year from the
+                first eligible one up to the second-to-last).
+
+        Returns:
+            dict: 'cutoffs', 'horizons', 'pooled_columns' and, per model,
+            'overall' (pooled over the pooled columns, i.e. all but
+            COUNT_COLUMNS) and 'columns' error tables: one row per horizon
+            with the MAE, RMSE, bias (mean of actual minus forecast) and
+            number of scored values. 'failed' lists models whose fits raised.
+
+        Raises:
+            BacktestError: On invalid parameters.
+        """
+        models = list(MODEL_FACTORIES) if models is None else models
+        unknown = [model for model in models if model not in MODEL_FACTORIES]
+        if unknown:
+            raise BacktestError(f"Unknown models {unknown}, expected some of {list(MODEL_FACTORIES)}")
+        params = params or {}
+        if not isinstance(params, dict) or not all(isinstance(value, dict) for value in params.values()):
+            raise BacktestError("'params' must map model names to hyperparameter objects")
+        if not isinstance(horizons, int) or not 1 <= horizons <= MAX_HORIZONS:
+            raise BacktestError(f"'horizons' must be an integer between 1 and {MAX_HORIZONS}")
+        if not isinstance(min_train_years, int) or min_train_years < 2:
+            raise BacktestError("'min_train_years' must be an integer of at least 2")
+
+        if columns is not None and (not isinstance(columns, list)
+                                    or not all(isinstance(column, str) for column in columns)):
+            raise BacktestError("'columns' must be a list of column names")
+
+        data = self._series(voter_data, version)
+        if columns is None:
+            columns = [column for column in data.columns if column not in COUNT_COLUMNS]
+        else:
+            columns = [column.strip() for column in columns]
+        columns_idx = data.index(columns)
+        pooled = np.array([column not in COUNT_COLUMNS for column in columns], dtype=bool)
+        cutoffs = self._cutoffs(data, cutoffs, min_train_years)
+
+        tables, failed = {}, []
+        for model in models:
+            try:
+                if model == 'linear' and not params.get(model):
+                    with stage('backtest_linear'):
+                        predictions = linear_cutoff_predictions(data, columns_idx, cutoffs)
+                    with self._lock:
+                        self._counters['linear_cutoffs'] += len(cutoffs)
+                else:
+                    predictions = self._fold_predictions(data, version, model, params.get(model, DEFAULT_PARAMS.get(model, {})),
+                                                         columns, columns_idx, cutoffs)
+            except Exception as e:
+                failed.append({'model': model, 'error': f"{type(e).__name__}: {e}"})
+                continue
+            tables[model] = self._score(data, columns, columns_idx, cutoffs, predictions, horizons, pooled)
+
+        return {
+            'cutoffs': data.unique_years[cutoffs].astype(int).tolist(),
+            'horizons': list(range(1, horizons + 1)),
+            'pooled_columns': [column for column, is_pooled in zip(columns, pooled) if is_pooled],
+            'models': tables,
+            'failed': failed,
+        }
+
+    def _series(self, voter_data, version):
+        with self._lock:
+            data = self._data.get(version)
+            if data is not None:
+                self._data.move_to_end(version)
+                return data
+        data = BacktestData(voter_data)
+        with self._lock:
+            self._data[version] = data
+            while len(self._data) > self.max_versions:
+                evicted, _ = self._data.popitem(last=False)
+                for key in [key for key in self._folds if key[0] == evicted]:
+                    del self._folds[key]
+        return data
+
+    @staticmethod
+    def _cutoffs(data, cutoffs, min_train_years):
+        # Cutoffs need enough training years before them and at least one year after
+        eligible = np.arange(min_train_years - 1, len(data.unique_years) - 1)
+        if cutoffs is None:
+            if not len(eligible):
+                raise BacktestError(f"{len(data.unique_years)} years are too few to backtest with "
+                                    f"{min_train_years} training years")
+            return eligible
+        if not isinstance(cutoffs, list) or not cutoffs:
+            raise BacktestError("'cutoffs' must be a non-empty list of years")
+        groups = np.searchsorted(data.unique_years, np.asarray(cutoffs, dtype=np.float64))
+        invalid = [year for year, group in zip(cutoffs, groups)
+                   if group not in eligible or data.unique_years[group] != year]
+        if invalid:
+            raise BacktestError(f"Invalid cutoffs {invalid}: cutoffs must be years of the dataset with at least "
+                                f"{min_train_years} years up to them and one after")
+        return np.unique(groups)
+
+    def _fold_predictions(self, data, version, model, model_params, columns, columns_idx, cutoffs):
+        # Cached folds are reused; the missing ones are fitted one task per cutoff
+        params_key = json.dumps(model_params, sort_keys=True, default=str)
+        predictions = np.full((len(cutoffs), len(data.unique_years), len(columns)), np.nan)
+        missing = {}
+        with self._lock:
+            for i, cutoff in enumerate(cutoffs):
+                for position, column in enumerate(columns):
+                    key = (version, model, params_key, column, int(cutoff))
+                    cached = self._folds.get(key)
+                    if cached is None:
+                        missing.setdefault(i, []).append(position)
+                    else:
+                        self._folds.move_to_end(key)
+                        predictions[i, cutoff + 1:, position] = cached
+
+        tasks = []
+        for i, positions in missing.items():
+            end = data.ends[cutoffs[i]]
+            # Training rows in dataset order, as the served per-column models see them (forests depend on it)
+            rows = np.argsort(data.order[:end], kind='stable')
+            tasks.append((i, positions, (model, model_params, data.years[:end][rows],
+                                         data.values[:end][rows][:, columns_idx[positions]],
+                                         data.unique_years[cutoffs[i] + 1:])))
+        with stage('backtest_fit'):
+            results = self._run(tasks)
+        for i, positions, fitted in results:
+            cutoff = cutoffs[i]
+            # fitted is (later years, positions); the mixed index puts positions first
+            predictions[i, cutoff + 1:, positions] = fitted.T
+            with self._lock:
+                for k, position in enumerate(positions):
+                    self._folds[(version, model, params_key, columns[position], int(cutoff))] = fitted[:, k]
+                while len(self._folds) > self.max_folds:
+                    self._folds.popitem(last=False)
+                    self._counters['folds_evicted'] += 1
+
+        n_fitted = sum(len(positions) for positions in missing.values())
+        with self._lock:
+            self._counters['folds_fitted'] += n_fitted
+            self._counters['folds_cached'] += len(cutoffs) * len(columns) - n_fitted
+        return predictions
+
+    def _run(self, tasks):
+        if self.max_workers == 0 or len(tasks) <= 1:
+            return [(i, positions, _fit_cutoff(*args)) for i, positions, args in tasks]
+
+        pool = self._executor()
+        futures = {pool.submit(_fit_cutoff, *args): (i, positions) for i, positions, args in tasks}
+        results = []
+        try:
+            for future in as_completed(futures):
+                results.append((*futures[future], future.result()))
+        except BrokenProcessPool:
+            # A worker died (e.g. out of memory); start a fresh pool next time
+            with self._lock:
+                if self._pool is pool:
+                    self._pool = None
+            raise
+        return results
+
+    def _executor(self):
+        with self._lock:
+            if self._pool is None:
+                self._pool = ProcessPoolExecutor(self.max_workers, mp_context=multiprocessing.get_context('spawn'),
+                                                 initializer=_init_worker)
+            return self._pool
+
+    @staticmethod
+    def _score(data, columns, columns_idx, cutoffs, predictions, horizons, pooled):
+        # Every row h years after one of the cutoffs is scored against that cutoff's forecast
+        cutoff_position = np.full(len(data.unique_years), -1)
+        cutoff_position[cutoffs] = np.arange(len(cutoffs))
+        actual = data.values[:, columns_idx]
+        per_horizon = []
+        for h in range(1, horizons + 1):
+            source = data.group - h
+            rows = np.flatnonzero((source >= 0) & (cutoff_position[np.maximum(source, 0)] >= 0))
+            forecast = predictions[cutoff_position[source[rows]], data.group[rows]]
+            errors = actual[rows] - forecast
+            scored = ~np.isnan(errors)
+            errors = np.where(scored, errors, 0.0)
+            per_horizon.append((scored.sum(axis=0), np.abs(errors).sum(axis=0), (errors * errors).sum(axis=0),
+                                errors.sum(axis=0)))
+
+        def table(counts, abs_sums, sq_sums, sums):
+            rows = []
+            for h, (n, abs_sum, sq_sum, sum_) in enumerate(zip(counts, abs_sums, sq_sums, sums), start=1):
+                rows.append({
+                    'horizon': h,
+                    'n': int(n),
+                    'mae': round(float(abs_sum / n), 4) if n else None,
+                    'rmse': round(float(np.sqrt(sq_sum / n)), 4) if n else None,
+                    'bias': round(float(sum_ / n), 4) if n else None,
+                })
+            return rows
+
+        stacked = [np.array(values) for values in zip(*per_horizon)]  # (horizons, n_columns) each
+        return {
+            'overall': table(*(values[:, pooled].sum(axis=1) for values in stacked)),
+            'columns': {column: table(*(values[:, position] for values in stacked))
+                        for position, column in enumerate(columns)},
+        }
+
+    def shutdown(self):
+        with self._lock:
+            if self._pool is not None:
+                self._pool.shutdown(cancel_futures=True)
+                self._pool = None
+
+    def stats(self):
+        with self._lock:
+            return dict(self._counters, versions=len(self._data),
+                        folds=len(self._folds), workers=self.max_workers)
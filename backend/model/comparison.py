@@ -0,0 +1,352 @@
+# Cross-validated comparison of several regressors on shared folds, run in a process pool.
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from concurrent.futures.process import BrokenProcessPool
+import atexit
+import importlib
+import logging
+import multiprocessing
+import threading
+import time
+
+import numpy as np
+
+from instrumentation import count, stage
+from model.pipeline import CleaningPipeline, default_pipeline
+from model.registry import MODEL_FACTORIES
+
+logger = logging.getLogger(__name__)
+
+# Candidates of /compare-models: estimator class path, default hyperparameters and
+# whether features are standardized first (as the linear training paths do)
+COMPARISON_MODELS = {
+    'linear': {'estimator': 'sklearn.linear_model.LinearRegression', 'params': {}, 'scale': True},
+    'lasso': {'estimator': 'sklearn.linear_model.Lasso', 'params': {'alpha': 0.1, 'random_state': 42}, 'scale': True},
+    'random_forest': {'estimator': 'sklearn.ensemble.RandomForestRegressor',
+                      'params': {'n_estimators': 100, 'random_state': 42, 'n_jobs': 1}, 'scale': False},
+}
+
+DEFAULT_FOLDS = 5
+MAX_FOLDS = 20
+RANK_METRICS = {'mae': False, 'rmse': False, 'r2': True, 'fit_seconds': False, 'predict_seconds': False}
+
+
+def register_model(name, estimator, params=None, scale=False):
+    """
+    Add a candidate to /compare-models.
+
+    Args:
+        name (str): Name used in requests and in the leaderboard.
+        estimator (str): Dotted path of a regressor class with fit/predict.
+        params (dict): Default hyperparameters.
+        scale (bool): Standardize features (fitted on each training fold) first.
+    """
+    COMPARISON_MODELS[name] = {'estimator': estimator, 'params': dict(params or {}), 'scale': scale}
+
+
+def available_models():
+    """Candidate names: COMPARISON_MODELS plus the per-column model types of the registry."""
+    candidates = dict(COMPARISON_MODELS)
+    for name, estimator in MODEL_FACTORIES.items():
+        if name not in candidates and estimator not in (spec['estimator'] for spec in candidates.values()):
+            candidates[name] = {'estimator': estimator, 'params': {}, 'scale': False}
+    return candidates
+
+
+class SharedFolds:
+    """
+    A cleaned dataset and its K-fold assignment in one shared memory block.
+
+    The block holds the feature matrix, the target and each row's fold
+    number, so pool workers attach to it by name and slice their training
+    and held-out rows without the arrays being pickled into every task.
+
+    Args:
+        X (ndarray): Features, shape (n_rows, n_features).
+        y (ndarray): Target, shape (n_rows,).
+        n_folds (int): Number of folds.
+        random_state (int): Seed of the shuffled fold assignment.
+    """
+
+    def __init__(self, X, y, n_folds, random_state=42):
+        from multiprocessing import shared_memory
+        from sklearn.model_selection import KFold
+
+        X = np.ascontiguousarray(X, dtype=np.float64)
+        folds = np.empty(len(X), dtype=np.int64)
+        for fold, (_, held_out) in enumerate(KFold(n_folds, shuffle=True, random_state=random_state).split(X)):
+            folds[held_out] = fold
+
+        self.n_rows, self.n_features = X.shape
+        self.n_folds = n_folds
+        self.users = 0
+        self._memory = shared_memory.SharedMemory(create=True, size=max(1, 8 * self.n_rows * (self.n_features + 2)))
+        self.spec = (self._memory.name, self.n_rows, self.n_features, n_folds)
+        shared_X, shared_y, shared_folds = _views(self._memory.buf, self.n_rows, self.n_features)
+        shared_X[:], shared_y[:], shared_folds[:] = X, y, folds
+
+    def close(self):
+        self._memory.close()
+        self._memory.unlink()
+
+
+def _views(buffer, n_rows, n_features):
+    # X, y and fold arrays laid out back to back in the block
+    X = np.ndarray((n_rows, n_features), dtype=np.float64, buffer=buffer)
+    y = np.ndarray((n_rows,), dtype=np.float64, buffer=buffer, offset=X.nbytes)
+    folds = np.ndarray((n_rows,), dtype=np.int64, buffer=buffer, offset=X.nbytes + y.nbytes)
+    return X, y, folds
+
+
+# ----------------------------------------------------------------------
+# Fold tasks (run inside the pool workers)
+# ----------------------------------------------------------------------
+_attached = OrderedDict()
+
+
+def _attach(spec):
+    from multiprocessing import shared_memory
+
+    name, n_rows, n_features, _ = spec
+    memory = _attached.get(name)
+    if memory is None:
+        memory = _attached[name] = shared_memory.SharedMemory(name=name)
+        while len(_attached) > 4:
+            _attached.popitem(last=False)[1].close()
+    return _views(memory.buf, n_rows, n_features)
+
+
+def _init_worker():
+    from threadpoolctl import threadpool_limits
+
+    # One core per task; the pool provides the parallelism
+    threadpool_limits(limits=1)
+
+
+def _fit_fold(spec, name, estimator, params, scale, fold):
+    """Fit one candidate on all folds but `fold` and score it on `fold`."""
+    from sklearn.metrics import mean_absolute_error, mean_squared_error, r2_score
+
+    X, y, folds = _attach(spec)
+    held_out = folds == fold
+    X_train, y_train, X_test, y_test = X[~held_out], y[~held_out], X[held_out], y[held_out]
+
+    module_name, class_name = estimator.rsplit('.', 1)
+    model = getattr(importlib.import_module(module_name), class_name)(**params)
+    start = time.perf_counter()
+    if scale:
+        from sklearn.preprocessing import StandardScaler
+        scaler = StandardScaler().fit(X_train)
+        X_train, X_test = scaler.transform(X_train), scaler.transform(X_test)
+    model.fit(X_train, y_train)
+    fit_seconds = time.perf_counter() - start
+
+    start = time.perf_counter()
+    y_pred = model.predict(X_test)
+    predict_seconds = time.perf_counter() - start
+    return {
+        'model': name,
+        'fold': fold,
+        'mae': float(mean_absolute_error(y_test, y_pred)),
+        'rmse': float(np.sqrt(mean_squared_error(y_test, y_pred))),
+        'r2': float(r2_score(y_test, y_pred)) if len(y_test) > 1 else None,
+        'fit_seconds': fit_seconds,
+        'predict_seconds': predict_seconds,
+    }
+
+
+# ----------------------------------------------------------------------
+# Comparison (runs in each web worker)
+# ----------------------------------------------------------------------
+class ModelComparison:
+    """
+    Trains several regressors on the same K folds and ranks them.
+
+    The dataset is cleaned once through the shared CleaningPipeline (the
+    same stages as clean_and_prepare_data, without its train/test split)
+    and its folds are materialized once per (dataset version, K) in shared
+    memory. Every (candidate, fold) pair is then one task in a process
+    pool, so candidates train concurrently and see identical folds.
+
+    Args:
+        max_workers (int): Pool processes; 0 runs the tasks in this process.
+        max_versions (int): Shared fold sets kept alive (LRU).
+    """
+
+    def __init__(self, max_workers=2, max_versions=2):
+        self.max_workers = max_workers
+        self.max_versions = max_versions
+        self._folds = OrderedDict()
+        self._lock = threading.Lock()
+        self._pool = None
+        atexit.register(self.shutdown)
+
+    def compare(self, voter_data, version, models=None, params=None, n_folds=DEFAULT_FOLDS, rank_by='rmse'):
+        """
+        Cross-validate candidates and return a leaderboard.
+
+        Args:
+            voter_data (DataFrame): The raw dataset.
+            version (str): Its dataset version.
+            models (list): Candidate names (default: every available one).
+            params (dict): Per-candidate hyperparameters, merged over the defaults.
+            n_folds (int): Number of folds.
+            rank_by (str): Key of RANK_METRICS to sort the leaderboard by.
+
+        Returns:
+            dict: 'leaderboard' (one entry per candidate with mean MAE, RMSE,
+            R², fit and predict seconds per fold, best first), 'failed'
+            (candidates that raised), 'folds', 'rows' and 'rank_by'.
+
+        Raises:
+            ValueError: If a candidate, parameter or fold count is invalid.
+        """
+        candidates = available_models()
+        models = list(models or candidates)
+        unknown = [name for name in models if name not in candidates]
+        if unknown:
+            raise ValueError(f"Unknown models {unknown}; available: {sorted(candidates)}")
+        params = params or {}
+        if not isinstance(params, dict) or not all(isinstance(value, dict) for value in params.values()):
+            raise ValueError("'params' must map model names to hyperparameter objects")
+        if not isinstance(n_folds, int) or not 2 <= n_folds <= MAX_FOLDS:
+            raise ValueError(f"'folds' must be an integer between 2 and {MAX_FOLDS}")
+        if rank_by not in RANK_METRICS:
+            raise ValueError(f"'rank_by' must be one of {sorted(RANK_METRICS)}")
+
+        shared = self._acquire(voter_data, version, n_folds)
+        try:
+            tasks = [
+                (shared.spec, name, candidates[name]['estimator'],
+                 dict(candidates[name]['params'], **params.get(name, {})), candidates[name]['scale'], fold)
+                for name in models for fold in range(n_folds)
+            ]
+            with stage('compare_models'):
+                results, errors = self._run(tasks)
+        finally:
+            self._release(shared)
+
+        leaderboard = []
+        for name in models:
+            if name in errors:
+                continue
+            folds = [result for result in results if result['model'] == name]
+            entry = {'model': name, 'params': dict(candidates[name]['params'], **params.get(name, {}))}
+            for metric in ('mae', 'rmse', 'r2'):
+                values = [result[metric] for result in folds if result[metric] is not None]
+                entry[metric] = round(float(np.mean(values)), 4) if values else None
+                entry[f'{metric}_std'] = round(float(np.std(values)), 4) if values else None
+            for timing in ('fit_seconds', 'predict_seconds'):
+                entry[timing] = round(float(np.mean([result[timing] for result in folds])), 6)
+            leaderboard.append(entry)
+
+        def rank_key(entry):
+            # Missing scores last; higher is better for R² only
+            value = entry[rank_by]
+            if value is None:
+                return (1, 0.0)
+            return (0, -value if RANK_METRICS[rank_by] else value)
+
+        leaderboard.sort(key=rank_key)
+        for rank, entry in enumerate(leaderboard, start=1):
+            entry['rank'] = rank
+        return {
+            'leaderboard': leaderboard,
+            'failed': [{'model': name, 'error': error} for name, error in errors.items()],
+            'folds': n_folds,
+            'rows': shared.n_rows,
+            'rank_by': rank_by,
+        }
+
+    def _run(self, tasks):
+        results, errors = [], {}
+        if self.max_workers == 0:
+            for task in tasks:
+                try:
+                    results.append(_fit_fold(*task))
+                except Exception as e:
+                    errors.setdefault(task[1], f"{type(e).__name__}: {e}")
+            return results, errors
+
+        pool = self._executor()
+        futures = {pool.submit(_fit_fold, *task): task[1] for task in tasks}
+        for future in as_completed(futures):
+            try:
+                results.append(future.result())
+            except BrokenProcessPool as e:
+                # A worker died (e.g. out of memory); start a fresh pool next time
+                errors.setdefault(futures[future], f"{type(e).__name__}: {e}")
+                with self._lock:
+                    if self._pool is pool:
+                        self._pool = None
+            except Exception as e:
+                errors.setdefault(futures[future], f"{type(e).__name__}: {e}")
+        return results, errors
+
+    def _executor(self):
+        with self._lock:
+            if self._pool is None:
+                self._pool = ProcessPoolExecutor(self.max_workers, mp_context=multiprocessing.get_context('spawn'),
+                                                 initializer=_init_worker)
+            return self._pool
+
+    def _acquire(self, voter_data, version, n_folds):
+        # Clean once (shared with the training endpoints) and materialize the folds once
+        from data.preparation import define_features_and_target
+
+        key = (version, n_folds)
+        with self._lock:
+            shared = self._folds.get(key)
+            if shared is not None:
+                self._folds.move_to_end(key)
+                shared.users += 1
+                count('shared_folds', 'hits')
+                return shared
+
+        stages = CleaningPipeline.stages(exclude_columns=['Year'], statistics=default_pipeline.statistics(version))
+        cleaned = default_pipeline.run(voter_data, stages[:-1], version=version)
+        features, target = define_features_and_target(cleaned)
+        if len(cleaned) < n_folds:
+            raise ValueError(f"{len(cleaned)} rows after cleaning cannot be split into {n_folds} folds")
+        with stage('materialize_folds'):
+            created = SharedFolds(cleaned[features].to_numpy(dtype=np.float64), cleaned[target].to_numpy(dtype=np.float64), n_folds)
+
+        with self._lock:
+            shared = self._folds.get(key)
+            if shared is None:
+                count('shared_folds', 'misses')
+                shared, created = created, None
+                self._folds[key] = shared
+                self._evict()
+            else:
+                self._folds.move_to_end(key)
+            shared.users += 1
+        if created is not None:
+            created.close()
+        return shared
+
+    def _release(self, shared):
+        with self._lock:
+            shared.users -= 1
+            self._evict()
+
+    def _evict(self):
+        # Callers hold self._lock; fold sets still used by a comparison survive until released
+        for key in list(self._folds):
+            if len(self._folds) <= self.max_versions:
+                break
+            if self._folds[key].users == 0:
+                self._folds.pop(key).close()
+
+    def shutdown(self):
+        with self._lock:
+            if self._pool is not None:
+                self._pool.shutdown(cancel_futures=True)
+                self._pool = None
+            for shared in self._folds.values():
+                shared.close()
+            self._folds.clear()
+
+    def stats(self):
+        with self._lock:
+            return {'fold_sets': len(self._folds), 'workers': self.max_workers}
@@ -0,0 +1,154 @@
+import numpy as np
+
+from model.trend import get_linear_trends
+
+FORECAST_MODELS = ('linear', 'random_forest')
+
+# Hyperparameters of the per-column forests served by /predict-randomforest
+RANDOM_FOREST_PARAMS = {'random_state': 42, 'n_estimators': 100}
+
+
+class ForecastError(ValueError):
+    """Invalid forecast request (reported to the caller as a 400)."""
+
+
+def validate_forecast_request(columns, predict_years):
+    """
+    Check the 'columns' and 'predict_years' parameters of a forecast request.
+
+    Raises:
+        ForecastError: With the same messages the /predict endpoints return.
+    """
+    if not columns or not isinstance(columns, list):
+        raise ForecastError("Invalid or missing 'columns' parameter")
+    if not predict_years:
+        raise ForecastError("Missing 'predict_years' parameter")
+
+
+def forecast_years(voter_data, predict_years):
+    """Every year from the earliest year in the data up to the last requested year."""
+    min_year = voter_data['Year'].min()
+    max_year = max(predict_years)
+    return np.arange(min_year, max_year + 1)
+
+
+def forecast_linear(voter_data, version, columns, predict_years, include_actual=True, include_metrics=True):
+    """
+    Linear year-trend forecasts for several columns.
+
+    Args:
+        voter_data (DataFrame): The dataset.
+        version (str): Its dataset version (trends are cached per version).
+        columns (list): Columns to forecast.
+        predict_years (list): Years requested by the caller.
+        include_actual (bool): Include the historical values of each column.
+        include_metrics (bool): Include in-sample MAE and R².
+
+    Returns:
+        dict: The /predict response body; series are NumPy arrays (see serialization.dumps).
+
+    Raises:
+        ForecastError: On invalid parameters or columns.
+    """
+    validate_forecast_request(columns, predict_years)
+    full_years = forecast_years(voter_data, predict_years)
+    for column in columns:
+        if column not in voter_data.columns:
+            raise ForecastError(f"Invalid column '{column}'")
+
+    # Every column's trend is fitted in one pass per dataset version
+    trends = get_linear_trends(voter_data, version)
+    try:
+        idx = trends.index(columns)
+    except KeyError as e:
+        raise ForecastError(f"Column {e} is not numeric")
+    # One contiguous row per column, so each prediction is encoded straight from the array
+    predicted_values = np.ascontiguousarray(trends.predict(full_years, columns).T)
+
+    predictions = {}
+    actual_data = {}
+    metrics = {}
+    for position, column in enumerate(columns):
+        predictions[column] = predicted_values[position]
+        if include_metrics:
+            metrics[column] = {
+                "mae": float(trends.mae[idx[position]]),
+                "r2": float(trends.r2[idx[position]]),
+            }
+        if include_actual:
+            actual_years, actual_values = trends.actual(column)
+            actual_data[column] = {
+                "years": actual_years,
+                "values": actual_values
+            }
+    return _response(predictions, actual_data, metrics, full_years, include_actual, include_metrics)
+
+
+def forecast_random_forest(voter_data, version, columns, predict_years, registry, params=RANDOM_FOREST_PARAMS,
+                           include_actual=True, include_metrics=True, interval=None):
+    """
+    Random Forest year-trend forecasts for several columns.
+
+    Args:
+        voter_data (DataFrame): The dataset.
+        version (str): Its dataset version.
+        columns (list): Columns to forecast (surrounding whitespace is ignored).
+        predict_years (list): Years requested by the caller.
+        registry (ModelRegistry): Cache of fitted per-column forests.
+        params (dict): RandomForestRegressor hyperparameters.
+        include_actual (bool): Include the historical values of each column.
+        include_metrics (bool): Include in-sample MAE and R².
+        interval (float): If set, also return the range covering this share
+            of the trees' individual predictions for every year.
+
+    Returns:
+        dict: The /predict-randomforest response body; series are NumPy arrays.
+
+    Raises:
+        ForecastError: On invalid parameters or columns.
+    """
+    if isinstance(columns, list):
+        columns = [column.strip() for column in columns]  # Remove extra whitespace
+    validate_forecast_request(columns, predict_years)
+    if interval is not None and not (isinstance(interval, (int, float)) and 0 < interval < 1):
+        raise ForecastError("'interval' must be a number between 0 and 1")
+    full_years = forecast_years(voter_data, predict_years)
+
+    predictions = {}
+    intervals = {}
+    actual_data = {}
+    metrics = {}
+    for column in columns:
+        if column not in voter_data.columns:
+            raise ForecastError(f"Invalid column '{column}'")
+
+        # Fitted Random Forest and in-sample metrics come from the registry
+        model = registry.get_or_fit('random_forest', column, params, version, voter_data)
+        if interval is None:
+            predictions[column] = model.predict(full_years)
+        else:
+            predicted, lower, upper = model.predict_interval(full_years, interval)
+            predictions[column] = predicted
+            intervals[column] = {"lower": lower, "upper": upper}
+        if include_metrics:
+            metrics[column] = model.metrics
+        if include_actual:
+            actual_data[column] = {
+                "years": model.years,
+                "values": model.values
+            }
+    body = _response(predictions, actual_data, metrics, full_years, include_actual, include_metrics)
+    if interval is not None:
+        body["intervals"] = intervals
+        body["interval"] = interval
+    return body
+
+
+def _response(predictions, actual_data, metrics, full_years, include_actual, include_metrics):
+    body = {"message": "Prediction successful", "predictions": predictions}
+    if include_actual:
+        body["actual_data"] = actual_data
+    if include_metrics:
+        body["metrics"] = metrics
+    body["years"] = full_years
+    return body
@@ -0,0 +1,333 @@
+from collections import OrderedDict
+import copy
+import hashlib
+import json
+import threading
+
+import numpy as np
+
+from instrumentation import stage
+
+
+def data_key(X, y):
+    """Short content hash identifying a training set."""
+    digest = hashlib.sha256()
+    for array in (X, y):
+        array = np.ascontiguousarray(np.asarray(array, dtype=np.float64))
+        digest.update(repr(array.shape).encode())
+        digest.update(array.tobytes())
+    return digest.hexdigest()[:16]
+
+
+def forest_params_key(params):
+    """
+    Canonical key for RandomForestRegressor hyperparameters.
+
+    Explicit defaults (e.g. max_depth=None) and omitted ones map to the same key.
+    """
+    from sklearn.ensemble import RandomForestRegressor
+
+    full_params = RandomForestRegressor(**params).get_params()
+    for name in ('n_estimators', 'warm_start', 'verbose', 'n_jobs'):
+        full_params.pop(name)
+    return json.dumps(full_params, sort_keys=True, default=str)
+
+
+def subset_forest(forest, n_estimators):
+    """
+    Return a forest made of the first `n_estimators` trees of `forest`.
+
+    Trees are shared, not copied. Because warm-started forests draw their
+    tree seeds in sequence, this is the same model a fresh fit with
+    `n_estimators` trees and the same random_state would produce.
+    """
+    subset = copy.copy(forest)
+    subset.estimators_ = forest.estimators_[:n_estimators]
+    subset.n_estimators = n_estimators
+    subset.warm_start = False
+    for attribute in ('oob_score_', 'oob_prediction_'):
+        subset.__dict__.pop(attribute, None)
+    return subset
+
+
+class FlatForest:
+    """
+    A fitted random forest flattened into contiguous NumPy node arrays.
+
+    Every tree's nodes are concatenated into one set of arrays (feature,
+    threshold, children, value) with child indices made global, and a
+    batch of rows is routed through all trees at once: one vectorized step
+    per tree level instead of sklearn's per-tree dispatch, which dominates
+    for the few dozen rows the forecast endpoints predict. Leaves point to
+    themselves, so every row can take `max_depth` steps without masking.
+
+    Predictions are bit-for-bit those of the forest's `predict`: inputs are
+    cast to float32 and compared to the float64 thresholds like sklearn
+    does, and per-tree outputs are summed in tree order before dividing by
+    the number of trees.
+
+    Args:
+        estimators (list): Fitted DecisionTreeRegressor objects (e.g. `forest.estimators_`).
+    """
+
+    def __init__(self, estimators):
+        if not estimators:
+            raise ValueError("A FlatForest needs at least one fitted tree")
+        trees = [estimator.tree_ for estimator in estimators]
+        sizes = np.array([tree.node_count for tree in trees])
+        offsets = np.concatenate([[0], np.cumsum(sizes)[:-1]])
+        self.n_trees = len(trees)
+        self.n_features = estimators[0].n_features_in_
+        self.n_outputs = trees[0].n_outputs
+        self.roots = offsets.astype(np.intp)
+        self.max_depth = max(tree.max_depth for tree in trees)
+
+        self.feature = np.zeros(sizes.sum(), dtype=np.intp)
+        self.threshold = np.empty(sizes.sum(), dtype=np.float64)
+        # children[node] = (left, right)
+        self.children = np.empty((sizes.sum(), 2), dtype=np.intp)
+        self.missing_left = np.zeros(sizes.sum(), dtype=bool)
+        self.value = np.empty((sizes.sum(), self.n_outputs), dtype=np.float64)
+        for tree, offset, size in zip(trees, offsets, sizes):
+            nodes = slice(offset, offset + size)
+            own = np.arange(offset, offset + size)
+            leaf = tree.children_left == -1
+            self.feature[nodes] = np.where(leaf, 0, tree.feature)
+            self.threshold[nodes] = np.where(leaf, np.inf, tree.threshold)
+            self.children[nodes, 0] = np.where(leaf, own, tree.children_left + offset)
+            self.children[nodes, 1] = np.where(leaf, own, tree.children_right + offset)
+            if getattr(tree, 'missing_go_to_left', None) is not None:
+                self.missing_left[nodes] = np.asarray(tree.missing_go_to_left, dtype=bool) & ~leaf
+            self.value[nodes] = tree.value[:, :, 0]
+
+    @classmethod
+    def from_estimator(cls, forest):
+        """Flatten a fitted RandomForestRegressor."""
+        return cls(forest.estimators_)
+
+    @property
+    def nbytes(self):
+        return sum(array.nbytes for array in (self.roots, self.feature, self.threshold, self.children,
+                                              self.missing_left, self.value))
+
+    def apply(self, X):
+        """
+        Return the leaf reached by every row in every tree.
+
+        Args:
+            X (array-like): Rows of shape (n_rows, n_features).
+
+        Returns:
+            ndarray: Global node indices of shape (n_trees, n_rows).
+        """
+        X = np.asarray(X, dtype=np.float32)
+        if X.ndim != 2 or X.shape[1] != self.n_features:
+            raise ValueError(f"X has shape {X.shape}; expected (n_rows, {self.n_features})")
+        children = self.children.ravel()
+        has_missing = self.missing_left.any()
+        # With a single feature (the year) every node reads the same value per row
+        single = X[:, 0] if self.n_features == 1 else None
+        offsets = np.arange(len(X)) * self.n_features
+        X = X.ravel()
+        nodes = np.repeat(self.roots[:, None], len(offsets), axis=1)
+        for _ in range(self.max_depth):
+            values = single if single is not None else X[offsets + self.feature[nodes]]
+            go_right = ~(values <= self.threshold[nodes])
+            if has_missing:
+                go_right &= ~(np.isnan(values) & self.missing_left[nodes])
+            nodes = children[2 * nodes + go_right]
+        return nodes
+
+    def predict_trees(self, X):
+        """
+        Per-tree predictions.
+
+        Returns:
+            ndarray: Shape (n_trees, n_rows), or (n_trees, n_rows, n_outputs)
+            for multi-output forests.
+        """
+        values = self.value[self.apply(X)]
+        return values[:, :, 0] if self.n_outputs == 1 else values
+
+    def predict(self, X):
+        """Mean prediction over the trees, identical to RandomForestRegressor.predict."""
+        per_tree = self.predict_trees(X)
+        # A running sum in tree order, as sklearn accumulates it
+        return np.cumsum(per_tree, axis=0)[-1] / self.n_trees
+
+    def predict_interval(self, X, coverage=0.9):
+        """
+        Mean prediction with an empirical interval from the spread of the trees.
+
+        Args:
+            X (array-like): Rows to predict.
+            coverage (float): Share of tree predictions inside the interval.
+
+        Returns:
+            tuple: (mean, lower, upper) arrays.
+        """
+        if not 0 < coverage < 1:
+            raise ValueError("coverage must be between 0 and 1")
+        per_tree = self.predict_trees(X)
+        mean = np.cumsum(per_tree, axis=0)[-1] / self.n_trees
+        lower, upper = np.quantile(per_tree, [(1 - coverage) / 2, (1 + coverage) / 2], axis=0)
+        return mean, lower, upper
+
+
+# Size of one node of a fitted sklearn tree (the Node struct of sklearn.tree._tree)
+NODE_BYTES = 64
+
+
+def forest_nbytes(forest):
+    """Approximate memory held by a fitted forest: the node and value arrays of its trees."""
+    return sum(tree.tree_.node_count * NODE_BYTES + tree.tree_.value.nbytes for tree in forest.estimators_)
+
+
+class ForestBuilder:
+    """
+    Grows random forests incrementally and reuses them across requests.
+
+    Forests are cached per (training data, hyperparameters other than
+    n_estimators). Asking for more trees than are cached grows the cached
+    forest with `warm_start`; asking for fewer returns a subset of its
+    trees. Either way the result is identical to fitting from scratch. The
+    least recently used forests are evicted once either `max_entries` or
+    `max_bytes` is exceeded.
+
+    Args:
+        max_entries (int): Maximum number of cached forests.
+        max_bytes (int): Approximate memory cap for cached forests.
+    """
+
+    def __init__(self, max_entries=64, max_bytes=256 * 1024 * 1024):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._forests = OrderedDict()
+        self._sizes = {}
+        self._nbytes = 0
+        self._key_locks = {}
+        self._lock = threading.Lock()
+        self._counters = {'reused': 0, 'grown': 0, 'built': 0, 'trees_fitted': 0, 'evictions': 0}
+
+    def grow(self, X, y, params, n_estimators=None, key=None):
+        """
+        Return a fitted RandomForestRegressor with `n_estimators` trees.
+
+        Args:
+            X, y: Training data.
+            params (dict): RandomForestRegressor hyperparameters.
+            n_estimators (int): Number of trees; defaults to params['n_estimators'] or 100.
+            key (str): Identifier of (X, y); computed from the content if omitted.
+
+        Returns:
+            RandomForestRegressor: A forest the caller may use but must not refit in place.
+        """
+        from sklearn.ensemble import RandomForestRegressor
+
+        params = dict(params)
+        n_estimators = n_estimators or params.get('n_estimators', 100)
+        # Parallelism and logging do not change the trees, so they are not part of the key
+        n_jobs = params.pop('n_jobs', None)
+        for name in ('n_estimators', 'warm_start', 'verbose'):
+            params.pop(name, None)
+        cache_key = (key or data_key(X, y), forest_params_key(params))
+
+        with self._lock:
+            key_lock = self._key_locks.setdefault(cache_key, threading.Lock())
+        with key_lock:
+            with self._lock:
+                forest = self._forests.get(cache_key)
+                if forest is not None:
+                    self._forests.move_to_end(cache_key)
+
+            if forest is None:
+                forest = RandomForestRegressor(n_estimators=n_estimators, warm_start=True, n_jobs=n_jobs, **params)
+                with stage('fit'):
+                    forest.fit(X, y)
+                counter, new_trees = 'built', n_estimators
+            elif len(forest.estimators_) < n_estimators:
+                new_trees = n_estimators - len(forest.estimators_)
+                forest.set_params(n_estimators=n_estimators, n_jobs=n_jobs)
+                with stage('fit'):
+                    forest.fit(X, y)
+                counter = 'grown'
+            else:
+                counter, new_trees = 'reused', 0
+
+            nbytes = forest_nbytes(forest)
+            with self._lock:
+                self._counters[counter] += 1
+                self._counters['trees_fitted'] += new_trees
+                self._forests[cache_key] = forest
+                self._nbytes += nbytes - self._sizes.get(cache_key, 0)
+                self._sizes[cache_key] = nbytes
+                while self._forests and (len(self._forests) > self.max_entries or self._nbytes > self.max_bytes):
+                    evicted, _ = self._forests.popitem(last=False)
+                    self._nbytes -= self._sizes.pop(evicted)
+                    self._key_locks.pop(evicted, None)
+                    self._counters['evictions'] += 1
+            return subset_forest(forest, n_estimators)
+
+    def staged_scores(self, X_train, y_train, X_eval, y_eval, params, checkpoints, scorer, key=None):
+        """
+        Score one growing forest at several n_estimators checkpoints.
+
+        Args:
+            X_train, y_train: Training data.
+            X_eval, y_eval: Evaluation data.
+            params (dict): Hyperparameters other than n_estimators.
+            checkpoints (list): n_estimators values to score.
+            scorer (callable): sklearn scorer, called as scorer(model, X, y).
+            key (str): Identifier of the training data.
+
+        Returns:
+            dict: {n_estimators: score}.
+        """
+        forest = self.grow(X_train, y_train, params, n_estimators=max(checkpoints), key=key)
+        return {n: scorer(subset_forest(forest, n), X_eval, y_eval) for n in sorted(checkpoints)}
+
+    def oob_scores(self, X, y, params, checkpoints, key=None):
+        """
+        Out-of-bag R² and MSE at several n_estimators checkpoints, without refits.
+
+        Requires bootstrap sampling (the RandomForestRegressor default).
+
+        Returns:
+            dict: {n_estimators: {'r2', 'mse', 'coverage'}}, where coverage is the
+            share of rows that were out-of-bag for at least one tree.
+        """
+        from sklearn.metrics import mean_squared_error, r2_score
+
+        forest = self.grow(X, y, params, n_estimators=max(checkpoints), key=key)
+        if not forest.bootstrap:
+            raise ValueError("Out-of-bag scores need bootstrap=True")
+        X = np.asarray(X, dtype=np.float32)
+        y = np.asarray(y, dtype=np.float64)
+        n_samples = len(y)
+        sums = np.zeros(n_samples)
+        counts = np.zeros(n_samples, dtype=np.intp)
+
+        results = {}
+        remaining = sorted(checkpoints)
+        for i, (tree, in_bag) in enumerate(zip(forest.estimators_, forest.estimators_samples_), start=1):
+            oob = np.ones(n_samples, dtype=bool)
+            oob[in_bag] = False
+            sums[oob] += tree.predict(X[oob], check_input=False) if oob.any() else 0.0
+            counts[oob] += 1
+            while remaining and remaining[0] == i:
+                covered = counts > 0
+                prediction = sums[covered] / counts[covered]
+                results[remaining.pop(0)] = {
+                    'r2': float(r2_score(y[covered], prediction)) if covered.sum() > 1 else None,
+                    'mse': float(mean_squared_error(y[covered], prediction)) if covered.any() else None,
+                    'coverage': float(covered.mean()),
+                }
+        return results
+
+    def stats(self):
+        with self._lock:
+            return dict(self._counters, entries=len(self._forests), nbytes=self._nbytes)
+
+
+# Shared by the training, tuning and prediction paths in this process
+default_builder = ForestBuilder()
@@ -1,5 +1,18 @@
+import math
+import time
+
+import numpy as np
+from sklearn.base import clone
+from sklearn.ensemble import RandomForestRegressor
+from sklearn.metrics import get_scorer
+from sklearn.model_selection import GridSearchCV, ParameterGrid, ParameterSampler, check_cv, cross_val_score
+
+from instrumentation import timed_stage
+from model.forest import data_key, default_builder
+
+SEARCH_STRATEGIES = ('grid', 'random', 'halving')
+HALVING_RESOURCES = ('n_samples', 'n_estimators')
 
-from sklearn.model_selection import GridSearchCV
 
 def perform_grid_search(estimator, param_grid, X_train, y_train, cv=5, scoring='neg_mean_squared_error', n_jobs=-1):
     """
@@ -18,6 +31,12 @@ def perform_grid_search(estimator, param_grid, X_train, y_train, cv=5, scoring='
         best_model: The model with the best hyperparameters.
         best_params (dict): The best hyperparameters found during the search.
     """
+    grid_search = _grid_search(estimator, param_grid, X_train, y_train, cv, scoring, n_jobs)
+    return grid_search.best_estimator_, grid_search.best_params_
+
+
+def _grid_search(estimator, param_grid, X_train, y_train, cv, scoring, n_jobs):
+    # The fitted GridSearchCV, for callers that also report its best_score_
     grid_search = GridSearchCV(
         estimator=estimator,
         param_grid=param_grid,
@@ -26,5 +45,305 @@ def perform_grid_search(estimator, param_grid, X_train, y_train, cv=5, scoring='
         n_jobs=n_jobs
     )
     grid_search.fit(X_train, y_train)
+    return grid_search
 
-    return grid_search.best_estimator_, grid_search.best_params_
+
+def validate_param_grid(estimator, param_grid):
+    """
+    Check a (possibly caller-supplied) grid against the estimator.
+
+    Raises:
+        ValueError: If the grid is not a dict of non-empty lists of known
+            parameters, a list mixes value types (None aside), or
+            n_estimators has values other than positive integers.
+    """
+    if not isinstance(param_grid, dict) or not param_grid:
+        raise ValueError("param_grid must be a non-empty object")
+    valid_params = estimator.get_params()
+    for name, values in param_grid.items():
+        if name not in valid_params:
+            raise ValueError(f"Unknown hyperparameter '{name}' for {type(estimator).__name__}")
+        if not isinstance(values, (list, tuple)) or not values:
+            raise ValueError(f"param_grid['{name}'] must be a non-empty list")
+        # None stands for "no limit" (e.g. max_depth) next to values of any type; ints and floats mix freely
+        kinds = {_value_kind(value) for value in values if value is not None}
+        if len(kinds) > 1:
+            raise ValueError(f"param_grid['{name}'] mixes value types ({', '.join(sorted(kinds))})")
+        if name == 'n_estimators' and not all(_value_kind(value) == 'number' and isinstance(value, int) and value > 0
+                                              for value in values):
+            raise ValueError("param_grid['n_estimators'] must be a list of positive integers")
+
+
+def _value_kind(value):
+    if isinstance(value, bool):
+        return 'bool'
+    if isinstance(value, (int, float)):
+        return 'number'
+    return type(value).__name__
+
+
+def parse_search_options(options):
+    """
+    Validate search options taken from a request body.
+
+    Args:
+        options (dict): Any of strategy, n_iter, resource, factor, max_fits, max_seconds.
+
+    Returns:
+        dict: Keyword arguments for perform_search.
+
+    Raises:
+        ValueError: On unknown options or values of the wrong type.
+    """
+    if options is None:
+        return {}
+    if not isinstance(options, dict):
+        raise ValueError("search must be an object")
+    types = {'strategy': str, 'resource': str, 'n_iter': int, 'factor': int, 'max_fits': int, 'max_seconds': (int, float)}
+    unknown = set(options) - set(types)
+    if unknown:
+        raise ValueError(f"Unknown search options: {sorted(unknown)}")
+    for name, value in options.items():
+        if value is not None and (not isinstance(value, types[name]) or isinstance(value, bool)):
+            raise ValueError(f"Invalid value for search option '{name}'")
+        if isinstance(value, (int, float)) and value <= 0 or name == 'factor' and value is not None and value < 2:
+            raise ValueError(f"Invalid value for search option '{name}'")
+    return {name: value for name, value in options.items() if value is not None}
+
+
+@timed_stage('hyperparameter_search')
+def perform_search(estimator, param_grid, X_train, y_train, strategy='grid', cv=5,
+                   scoring='neg_mean_squared_error', n_jobs=-1, n_iter=10, resource='n_samples',
+                   factor=3, max_fits=None, max_seconds=None, random_state=42):
+    """
+    Hyperparameter search with a choice of strategy and an optional budget.
+
+    Strategies:
+        grid: every combination in `param_grid` (GridSearchCV when unbudgeted).
+        random: `n_iter` combinations sampled from `param_grid`.
+        halving: successive halving; all candidates start on a small amount of
+            `resource` (training rows, or trees when 'n_estimators') and only
+            the best 1/`factor` move on to the next, larger round.
+
+    The search stops early once `max_fits` CV fits or `max_seconds` of
+    wall-clock time are spent, returning the best candidate seen so far.
+
+    Args:
+        estimator: The model to tune.
+        param_grid (dict): The hyperparameter grid to search.
+        X_train: Training features.
+        y_train: Training labels.
+        strategy (str): One of SEARCH_STRATEGIES.
+        cv (int): Number of cross-validation folds (default=5).
+        scoring (str): Scoring metric for optimization (default='neg_mean_squared_error').
+        n_jobs (int): Number of parallel jobs per cross-validation.
+        n_iter (int): Number of sampled candidates for 'random'.
+        resource (str): Resource grown by 'halving' (one of HALVING_RESOURCES).
+        factor (int): Halving reduction factor.
+        max_fits (int): Optional budget of CV fits.
+        max_seconds (float): Optional wall-clock budget.
+        random_state (int): Seed for candidate sampling and row subsampling.
+
+    Returns:
+        best_model: The best model, refit on all of X_train.
+        best_params (dict): The best hyperparameters found.
+        report (dict): Strategy, fits and seconds spent, candidates evaluated,
+            best CV score and whether the budget cut the search short.
+    """
+    if strategy not in SEARCH_STRATEGIES:
+        raise ValueError(f"Unknown search strategy '{strategy}', expected one of {SEARCH_STRATEGIES}")
+    if resource not in HALVING_RESOURCES:
+        raise ValueError(f"Unknown halving resource '{resource}', expected one of {HALVING_RESOURCES}")
+    validate_param_grid(estimator, param_grid)
+    if strategy == 'halving' and resource == 'n_estimators' and 'n_estimators' not in estimator.get_params():
+        raise ValueError(f"Halving on n_estimators needs an ensemble; {type(estimator).__name__} has no n_estimators, "
+                         f"use resource '{HALVING_RESOURCES[0]}'")
+
+    start = time.perf_counter()
+    budgeted = max_fits is not None or max_seconds is not None
+    # Forests are grown with warm_start and scored at every n_estimators checkpoint
+    warm_forest = isinstance(estimator, RandomForestRegressor)
+    if strategy == 'grid' and not budgeted and not warm_forest:
+        grid_search = _grid_search(estimator, param_grid, X_train, y_train, cv, scoring, n_jobs)
+        best_model, best_params = grid_search.best_estimator_, grid_search.best_params_
+        n_candidates = len(ParameterGrid(param_grid))
+        return best_model, best_params, {
+            'strategy': strategy,
+            'fits': n_candidates * cv + 1,
+            'seconds': round(time.perf_counter() - start, 3),
+            'candidates': n_candidates,
+            # Mean CV score of the winner, same sign as _BudgetedSearch.best_score()
+            'best_score': float(grid_search.best_score_),
+            'budget_exhausted': False,
+        }
+
+    trees_before = default_builder.stats()['trees_fitted']
+    search = _BudgetedSearch(estimator, X_train, y_train, cv, scoring, n_jobs, max_fits, max_seconds, start, warm_forest)
+    if strategy == 'halving':
+        best_params = _successive_halving(search, param_grid, resource, factor, random_state)
+    elif strategy == 'grid' and warm_forest and len(param_grid.get('n_estimators', [])) > 1:
+        # One forest per combination of the other parameters, read off at each size
+        grid = dict(param_grid)
+        checkpoints = sorted(grid.pop('n_estimators'))
+        for params in (ParameterGrid(grid) if grid else [{}]):
+            if search.evaluate(params, checkpoints=checkpoints) is None:
+                break
+        best_params = search.best_params()
+    else:
+        if strategy == 'grid':
+            candidates = list(ParameterGrid(param_grid))
+        else:
+            candidates = list(ParameterSampler(param_grid, n_iter=min(n_iter, len(ParameterGrid(param_grid))), random_state=random_state))
+        for params in candidates:
+            if search.evaluate(params) is None:
+                break
+        best_params = search.best_params()
+    if best_params is None:
+        raise ValueError("Search budget too small to evaluate a single candidate")
+
+    # Refit the winner on the full training set, as GridSearchCV does
+    if warm_forest:
+        best_model = default_builder.grow(X_train, y_train, dict(estimator.get_params(), **best_params, n_jobs=n_jobs))
+    else:
+        best_model = clone(estimator).set_params(**best_params)
+        best_model.fit(X_train, y_train)
+    search.fits += 1
+
+    report = {
+        'strategy': strategy,
+        'fits': search.fits,
+        'seconds': round(time.perf_counter() - start, 3),
+        'candidates': search.candidates,
+        'best_score': search.best_score(),
+        'budget_exhausted': search.exhausted,
+    }
+    if warm_forest:
+        report['trees_fitted'] = default_builder.stats()['trees_fitted'] - trees_before
+    return best_model, best_params, report
+
+
+class _BudgetedSearch:
+    """Cross-validates candidates one at a time while tracking the fit/time budget."""
+
+    def __init__(self, estimator, X, y, cv, scoring, n_jobs, max_fits, max_seconds, start, warm_forest=False):
+        self.estimator = estimator
+        self.X, self.y = X, y
+        self.cv, self.scoring, self.n_jobs = cv, scoring, n_jobs
+        self.max_fits, self.max_seconds, self.start = max_fits, max_seconds, start
+        self.warm_forest = warm_forest
+        self.fits = 0
+        self.candidates = 0
+        self.exhausted = False
+        # Scores of the most recent round, so halving compares like with like
+        self.scores = []
+        self._folds = {}
+
+    def has_budget(self, cost):
+        if self.max_fits is not None and self.fits + cost > self.max_fits:
+            self.exhausted = True
+        if self.max_seconds is not None and time.perf_counter() - self.start >= self.max_seconds:
+            self.exhausted = True
+        return not self.exhausted
+
+    def evaluate(self, params, rows=None, checkpoints=None):
+        """
+        Mean CV score of one candidate, or None if the budget is spent.
+
+        With `checkpoints` (forests only) the candidate is scored at each
+        n_estimators value from a single growing forest per fold, and the
+        score of the largest checkpoint is returned.
+        """
+        checkpoints = checkpoints or [None]
+        if not self.has_budget(self.cv * len(checkpoints)):
+            return None
+        X, y = self.X, self.y
+        if rows is not None:
+            X = X.iloc[rows] if hasattr(X, 'iloc') else X[rows]
+            y = y.iloc[rows] if hasattr(y, 'iloc') else y[rows]
+
+        if self.warm_forest:
+            forest_params = dict(self.estimator.get_params(), **params, n_jobs=self.n_jobs)
+            sizes = [n or forest_params['n_estimators'] for n in checkpoints]
+            scorer = get_scorer(self.scoring)
+            fold_scores = {n: [] for n in sizes}
+            for X_fit, y_fit, X_eval, y_eval, key in self._split(X, y, rows):
+                staged = default_builder.staged_scores(X_fit, y_fit, X_eval, y_eval, forest_params, sizes, scorer, key=key)
+                for n, score in staged.items():
+                    fold_scores[n].append(score)
+            results = [(n, float(np.mean(fold_scores[n]))) for n in sizes]
+        else:
+            model = clone(self.estimator).set_params(**params)
+            results = [(None, float(np.mean(cross_val_score(model, X, y, cv=self.cv, scoring=self.scoring, n_jobs=self.n_jobs))))]
+
+        for n, score in results:
+            self.fits += self.cv
+            self.candidates += 1
+            self.scores.append((score, params if n is None or len(checkpoints) == 1 else dict(params, n_estimators=n)))
+        return results[-1][1]
+
+    def _split(self, X, y, rows):
+        """CV folds (as GridSearchCV would make them) and their training-data keys, cached per row subset."""
+        cache_key = None if rows is None else tuple(rows)
+        if cache_key not in self._folds:
+            folds = []
+            for train_index, test_index in check_cv(self.cv, y).split(X, y):
+                X_fit = X.iloc[train_index] if hasattr(X, 'iloc') else X[train_index]
+                y_fit = y.iloc[train_index] if hasattr(y, 'iloc') else y[train_index]
+                X_eval = X.iloc[test_index] if hasattr(X, 'iloc') else X[test_index]
+                y_eval = y.iloc[test_index] if hasattr(y, 'iloc') else y[test_index]
+                folds.append((X_fit, y_fit, X_eval, y_eval, data_key(X_fit, y_fit)))
+            self._folds[cache_key] = folds
+        return self._folds[cache_key]
+
+    def best_params(self):
+        # Strict comparison keeps the first of tied candidates, like GridSearchCV
+        best_score, best = None, None
+        for score, params in self.scores:
+            if best_score is None or score > best_score:
+                best_score, best = score, params
+        return best
+
+    def best_score(self):
+        return max(score for score, _ in self.scores) if self.scores else None
+
+
+def _successive_halving(search, param_grid, resource, factor, random_state):
+    grid = dict(param_grid)
+    if resource == 'n_estimators':
+        # Trees become the resource; every finalist is compared at the largest size
+        max_resource = max(grid.pop('n_estimators', [search.estimator.get_params()['n_estimators']]))
+        min_resource = 10
+    else:
+        max_resource = len(search.y)
+        min_resource = 2 * search.cv
+    candidates = list(ParameterGrid(grid)) if grid else [{}]
+
+    # Enough rounds to whittle the candidates down, but no more than the resource allows
+    n_rounds = 1 + int(math.floor(math.log(len(candidates), factor))) if len(candidates) > 1 else 1
+    n_rounds = max(1, min(n_rounds, 1 + int(math.floor(math.log(max(max_resource / min_resource, 1), factor)))))
+    base = max(min_resource, int(max_resource / factor ** (n_rounds - 1)))
+    row_order = np.random.RandomState(random_state).permutation(max_resource) if resource == 'n_samples' else None
+
+    best_params = None
+    for round_index in range(n_rounds):
+        amount = max_resource if round_index == n_rounds - 1 else min(max_resource, base * factor ** round_index)
+        search.scores = []
+        for params in candidates:
+            if resource == 'n_estimators':
+                score = search.evaluate(dict(params, n_estimators=amount))
+            else:
+                score = search.evaluate(params, rows=np.sort(row_order[:amount]))
+            if score is None:
+                break
+        if not search.scores:
+            break
+        # Keep the top 1/factor of this round's candidates
+        ranked = sorted(range(len(search.scores)), key=lambda i: -search.scores[i][0])
+        best_params = search.scores[ranked[0]][1]
+        candidates = [candidates[i] for i in ranked[:max(1, math.ceil(len(candidates) / factor))]]
+        if search.exhausted or len(candidates) == 1:
+            break
+
+    if resource == 'n_estimators' and best_params is not None:
+        best_params = dict(best_params, n_estimators=max_resource)
+    return best_params
@@ -0,0 +1,378 @@
+import hashlib
+import json
+import logging
+import multiprocessing
+import os
+import queue
+import socket
+import threading
+import time
+import uuid
+
+from model.result_cache import TRAINERS, train_cached, training_response
+
+logger = logging.getLogger(__name__)
+
+QUEUED, RUNNING, SUCCEEDED, FAILED, CANCELLED = 'queued', 'running', 'succeeded', 'failed', 'cancelled'
+TERMINAL_STATES = (SUCCEEDED, FAILED, CANCELLED)
+
+# The owning worker touches its in-flight job records this often; records of other
+# owners untouched for `orphan_after` seconds are treated as abandoned
+HEARTBEAT_SECONDS = 5
+
+
+# ----------------------------------------------------------------------
+# Job bodies (run inside the child process)
+# ----------------------------------------------------------------------
+# Job kinds, named after the synchronous endpoints they mirror; both run through model.result_cache
+JOB_KINDS = tuple(TRAINERS)
+
+
+def _job_main(job_id, kind, voter_data, version, params, n_jobs, events, training_cache):
+    """Child-process entry point: run one job and report its outcome."""
+    from threadpoolctl import threadpool_limits
+
+    # Keep BLAS/OpenMP pools inside the job's CPU budget as well
+    with threadpool_limits(limits=n_jobs):
+        events.put((job_id, RUNNING, None))
+        try:
+            # Results stored by the endpoints (or earlier jobs) for the same key are returned as they are
+            result = training_response(kind, train_cached(
+                training_cache, kind, voter_data, version, param_grid=params.get('param_grid'),
+                search=params.get('search'), n_jobs=n_jobs))
+        except Exception as e:
+            events.put((job_id, FAILED, f"{type(e).__name__}: {e}"))
+        else:
+            events.put((job_id, SUCCEEDED, result))
+
+
+# ----------------------------------------------------------------------
+# Job manager (runs in each web worker)
+# ----------------------------------------------------------------------
+class JobManager:
+    """
+    Runs training and tuning jobs in a bounded pool of child processes.
+
+    Each job runs in its own process, at most `max_workers` at a time, so a
+    running job can be cancelled by terminating it. Job records are JSON
+    files under `state_dir`, so any gunicorn worker can report status,
+    return results, cancel a job or deduplicate identical in-flight
+    submissions, even if another worker owns the job.
+
+    Each record names its owner (host, pid and an ID of the manager), and
+    the owner touches the records of its queued and running jobs as a
+    heartbeat. A job whose owner has exited, or whose record has not been
+    touched for `orphan_after` seconds, is marked failed when read, so it
+    is neither reported as in flight nor deduplicated onto. Finished
+    records beyond `max_records`, or older than `retention` seconds, are
+    deleted at startup and whenever the manager goes idle.
+
+    Args:
+        state_dir (str): Directory holding job records.
+        max_workers (int): Maximum number of concurrently running jobs.
+        cpu_budget (int): Default number of cores a job may use (its n_jobs).
+        max_queued (int): Maximum number of jobs waiting for a slot.
+        training_cache (TrainingResultCache): Results shared with the
+            synchronous endpoints; jobs are not cached when omitted.
+        max_records (int): Finished job records kept.
+        retention (float): Seconds finished job records are kept.
+        orphan_after (float): Seconds without a heartbeat after which
+            another owner's job is considered abandoned.
+    """
+
+    def __init__(self, state_dir, max_workers=2, cpu_budget=1, max_queued=32, training_cache=None,
+                 max_records=1000, retention=7 * 24 * 3600, orphan_after=60):
+        self.state_dir = state_dir
+        self.training_cache = training_cache
+        self.max_workers = max_workers
+        self.cpu_budget = cpu_budget
+        self.max_queued = max_queued
+        self.max_records = max_records
+        self.retention = retention
+        self.orphan_after = orphan_after
+        self._owner = {'host': socket.gethostname(), 'pid': os.getpid(), 'id': uuid.uuid4().hex}
+        self._heartbeat_at = 0.0
+        self._ctx = multiprocessing.get_context('spawn')
+        self._events = None
+        self._pending = []
+        self._running = {}
+        self._payloads = {}
+        self._lock = threading.Lock()
+        self._thread = None
+        os.makedirs(state_dir, exist_ok=True)
+        self._prune()
+
+    # ------------------------------------------------------------------
+    # Public API
+    # ------------------------------------------------------------------
+    def submit(self, kind, voter_data, version, params=None, n_jobs=None):
+        """
+        Queue a job, or return the identical job already in flight.
+
+        Args:
+            kind (str): Key into JOB_KINDS.
+            voter_data (DataFrame): The dataset to train on.
+            version (str): Dataset version, part of the deduplication key.
+            params (dict): Job parameters (e.g. a custom 'param_grid').
+            n_jobs (int): Cores for this job; capped at the manager's budget.
+
+        Returns:
+            tuple: (job record dict, True if newly created).
+        """
+        if kind not in JOB_KINDS:
+            raise ValueError(f"Unknown job kind '{kind}'")
+        params = params or {}
+        n_jobs = max(1, min(int(n_jobs or self.cpu_budget), self.cpu_budget))
+        key = hashlib.sha256(json.dumps([kind, version, params], sort_keys=True, default=str).encode()).hexdigest()[:24]
+
+        with self._lock:
+            existing = self._find_in_flight(key)
+            if existing is not None:
+                return existing, False
+            if len(self._pending) >= self.max_queued:
+                raise RuntimeError("Job queue is full, try again later")
+
+            job = {
+                'id': uuid.uuid4().hex,
+                'kind': kind,
+                'key': key,
+                'dataset_version': version,
+                'params': params,
+                'n_jobs': n_jobs,
+                'status': QUEUED,
+                'owner': self._owner,
+                'submitted_at': time.time(),
+                'started_at': None,
+                'finished_at': None,
+                'result': None,
+                'error': None,
+            }
+            self._write(job)
+            self._write_key(key, job['id'])
+            self._pending.append(job['id'])
+            self._payloads[job['id']] = voter_data
+            self._ensure_thread()
+        return job, True
+
+    def get(self, job_id):
+        """
+        Return the job record, or None if the job is unknown.
+
+        An unfinished job whose owner is gone is recorded as failed first.
+        """
+        path = self._job_path(job_id)
+        try:
+            with open(path) as f:
+                job = json.load(f)
+            touched = os.path.getmtime(path)
+        except (OSError, ValueError):
+            return None
+        if job['status'] not in TERMINAL_STATES and self._abandoned(job, touched):
+            owner = job.get('owner') or {}
+            job.update(status=FAILED, finished_at=time.time(),
+                       error=f"Job owner (pid {owner.get('pid')} on {owner.get('host')}) stopped before the job finished")
+            self._write(job)
+            logger.warning("Job %s was abandoned by its owner, marked failed", job_id)
+        return job
+
+    def cancel(self, job_id):
+        """
+        Request cancellation. Queued jobs never start; running jobs are terminated.
+
+        Returns:
+            dict: The job record, or None if the job is unknown.
+        """
+        job = self.get(job_id)
+        if job is None or job['status'] in TERMINAL_STATES:
+            return job
+        # The owning worker picks the marker up on its next tick
+        with open(self._job_path(job_id) + '.cancel', 'w'):
+            pass
+        with self._lock:
+            if job_id in self._pending or job_id in self._running:
+                self._apply_cancel(job_id)
+        return self.get(job_id)
+
+    def shutdown(self):
+        with self._lock:
+            for job_id in list(self._pending) + list(self._running):
+                self._apply_cancel(job_id)
+
+    # ------------------------------------------------------------------
+    # Scheduling (callers hold self._lock unless noted)
+    # ------------------------------------------------------------------
+    def _ensure_thread(self):
+        if self._events is None:
+            self._events = self._ctx.Queue()
+        if self._thread is None or not self._thread.is_alive():
+            self._thread = threading.Thread(target=self._loop, daemon=True)
+            self._thread.start()
+
+    def _loop(self):
+        # Not holding the lock: waits on child-process events
+        while True:
+            try:
+                job_id, status, payload = self._events.get(timeout=0.2)
+            except queue.Empty:
+                job_id = None
+            with self._lock:
+                if job_id is not None:
+                    self._record_event(job_id, status, payload)
+                self._check_cancel_markers()
+                self._reap_crashed()
+                self._start_pending()
+                self._heartbeat()
+                if not self._pending and not self._running:
+                    self._thread = None
+                    break
+        self._prune()
+
+    def _record_event(self, job_id, status, payload):
+        job = self.get(job_id)
+        if job is None or job['status'] in TERMINAL_STATES:
+            return
+        job['status'] = status
+        if status == RUNNING:
+            job['started_at'] = job['started_at'] or time.time()
+        else:
+            job['finished_at'] = time.time()
+            job['result' if status == SUCCEEDED else 'error'] = payload
+            process = self._running.pop(job_id, None)
+            if process is not None:
+                process.join(timeout=1)
+        self._write(job)
+
+    def _start_pending(self):
+        while self._pending and len(self._running) < self.max_workers:
+            job_id = self._pending.pop(0)
+            job = self.get(job_id)
+            voter_data = self._payloads.pop(job_id, None)
+            if job is None or job['status'] != QUEUED:
+                continue
+            process = self._ctx.Process(
+                target=_job_main,
+                args=(job_id, job['kind'], voter_data, job['dataset_version'], job['params'], job['n_jobs'],
+                      self._events, self.training_cache),
+                daemon=True,
+            )
+            process.start()
+            self._running[job_id] = process
+            job['status'] = RUNNING
+            job['started_at'] = time.time()
+            self._write(job)
+
+    def _reap_crashed(self):
+        for job_id, process in list(self._running.items()):
+            if not process.is_alive() and process.exitcode != 0:
+                self._running.pop(job_id)
+                job = self.get(job_id)
+                if job is not None and job['status'] not in TERMINAL_STATES:
+                    job.update(status=FAILED, finished_at=time.time(),
+                               error=f"Job process exited with code {process.exitcode}")
+                    self._write(job)
+
+    def _check_cancel_markers(self):
+        for job_id in list(self._pending) + list(self._running):
+            if os.path.exists(self._job_path(job_id) + '.cancel'):
+                self._apply_cancel(job_id)
+
+    def _apply_cancel(self, job_id):
+        if job_id in self._pending:
+            self._pending.remove(job_id)
+            self._payloads.pop(job_id, None)
+        process = self._running.pop(job_id, None)
+        if process is not None:
+            process.terminate()
+            process.join(timeout=5)
+        job = self.get(job_id)
+        if job is not None and job['status'] not in TERMINAL_STATES:
+            job.update(status=CANCELLED, finished_at=time.time())
+            self._write(job)
+
+    def _heartbeat(self):
+        if time.time() - self._heartbeat_at < HEARTBEAT_SECONDS:
+            return
+        self._heartbeat_at = time.time()
+        for job_id in list(self._pending) + list(self._running):
+            try:
+                os.utime(self._job_path(job_id))
+            except OSError:
+                pass
+
+    # ------------------------------------------------------------------
+    # Shared on-disk state
+    # ------------------------------------------------------------------
+    def _abandoned(self, job, touched):
+        owner = job.get('owner') or {}
+        if owner.get('id') == self._owner['id']:
+            return False
+        if owner.get('host') == self._owner['host'] and owner.get('pid'):
+            try:
+                os.kill(owner['pid'], 0)
+            except ProcessLookupError:
+                return True
+            except OSError:
+                pass
+        # A live pid may have been reused by another process; the heartbeat decides
+        return time.time() - touched > self.orphan_after
+
+    def _prune(self):
+        # Marks abandoned jobs failed, then deletes the oldest finished records and their keys
+        finished = []
+        for name in os.listdir(self.state_dir):
+            if not name.endswith('.json'):
+                continue
+            try:
+                job = self.get(name[:-len('.json')])
+            except ValueError:
+                continue
+            if job is not None and job['status'] in TERMINAL_STATES:
+                finished.append(job)
+        finished.sort(key=lambda job: job.get('finished_at') or 0)
+        cutoff = time.time() - self.retention
+        expired = [job for position, job in enumerate(finished)
+                   if position < len(finished) - self.max_records or (job.get('finished_at') or 0) < cutoff]
+        for job in expired:
+            path = self._job_path(job['id'])
+            key_path = os.path.join(self.state_dir, f"{job['key']}.key")
+            try:
+                with open(key_path) as f:
+                    if f.read().strip() == job['id']:
+                        os.unlink(key_path)
+            except OSError:
+                pass
+            for stale in (path, path + '.cancel'):
+                try:
+                    os.unlink(stale)
+                except OSError:
+                    pass
+        if expired:
+            logger.info("Deleted %d finished job records from %s", len(expired), self.state_dir)
+
+    def _find_in_flight(self, key):
+        try:
+            with open(os.path.join(self.state_dir, f'{key}.key')) as f:
+                job = self.get(f.read().strip())
+        except OSError:
+            return None
+        if job is not None and job['status'] not in TERMINAL_STATES:
+            return job
+        return None
+
+    def _job_path(self, job_id):
+        # Job IDs come from request URLs; only accept the hex IDs we generate
+        if not all(c in '0123456789abcdef' for c in job_id):
+            raise ValueError("Invalid job id")
+        return os.path.join(self.state_dir, f'{job_id}.json')
+
+    def _write_key(self, key, job_id):
+        self._write_file(os.path.join(self.state_dir, f'{key}.key'), job_id)
+
+    def _write(self, job):
+        self._write_file(self._job_path(job['id']), json.dumps(job, default=str))
+
+    def _write_file(self, path, text):
+        tmp_path = f'{path}.{os.getpid()}.tmp'
+        with open(tmp_path, 'w') as f:
+            f.write(text)
+        os.replace(tmp_path, path)
@@ -1,4 +1,4 @@
-from sklearn.ensemble import RandomForestRegressor
+from model.forest import default_builder
 
 def train_random_forest(X_train, y_train, n_estimators=100, random_state=42):
     """
@@ -13,7 +13,7 @@ def train_random_forest(X_train, y_train, n_estimators=100, random_state=42):
     Returns:
         RandomForestRegressor: The trained Random Forest model.
     """
-    rf_model = RandomForestRegressor(n_estimators=n_estimators, random_state=random_state)
-    rf_model.fit(X_train, y_train)
+    # Grown from (or cut down from) a cached forest on the same data when possible
+    rf_model = default_builder.grow(X_train, y_train, {'random_state': random_state}, n_estimators=n_estimators)
     return rf_model
 
@@ -0,0 +1,164 @@
+from collections import OrderedDict
+import json
+import logging
+import threading
+
+from data.cache import frame_fingerprint
+from data.cleaning import (CleaningStatistics, clean_frame, convert_to_numeric, add_engineered_features)
+from data.preparation import (define_features_and_target, split_dataset)
+from instrumentation import stage
+
+logger = logging.getLogger(__name__)
+
+# Cleaning statistics kept for the latest appended versions and their parents
+MAX_STATISTICS_VERSIONS = 4
+
+
+def strip_column_names(df):
+    """Strip leading/trailing whitespace from column names."""
+    df.columns = df.columns.str.strip()
+    return df
+
+
+class CleaningPipeline:
+    """
+    Memoized cleaning and splitting pipeline.
+
+    Every stage output is cached under (dataset version, the stage's name and
+    parameters, and those of every stage before it). Changing one stage's
+    parameters therefore recomputes only that stage and the ones after it,
+    and the linear and random-forest paths share each other's work.
+
+    Cached frames are shared: each stage runs on a copy of its input, and
+    callers must not modify the frames returned by `run()`.
+
+    Args:
+        max_entries (int): Maximum number of cached stage outputs (LRU).
+    """
+
+    def __init__(self, max_entries=64):
+        self.max_entries = max_entries
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+        self._counters = {'hits': 0, 'misses': 0, 'statistics_extended': 0}
+        self._statistics = OrderedDict()
+
+    @staticmethod
+    def stages(exclude_columns=None, test_size=0.2, random_state=42, statistics=None):
+        """
+        The stage list used by clean_and_prepare_data.
+
+        Args:
+            statistics (CleaningStatistics): Precomputed medians, clipping
+                bounds and ranges of the input, e.g. maintained across appends;
+                the stages compute them from their input when omitted.
+
+        Returns:
+            list: (name, function, params) tuples, applied in order.
+        """
+        # Missing values, outliers and scaling in one fused pass (see data.cleaning.CleaningTransform)
+        clean = {'exclude_columns': list(exclude_columns or [])}
+        if statistics is not None:
+            clean.update(medians=statistics.medians(), bounds=statistics.bounds(), ranges=statistics.ranges())
+        return [
+            ('strip_column_names', strip_column_names, {}),
+            ('clean', clean_frame, clean),
+            ('convert_to_numeric', convert_to_numeric, {}),
+            ('add_engineered_features', add_engineered_features, {}),
+            ('split_dataset', _split, {'test_size': test_size, 'random_state': random_state}),
+        ]
+
+    def run(self, data, stages, version=None):
+        """
+        Run the stages over `data`, reusing cached outputs where possible.
+
+        Args:
+            data (DataFrame): The input dataset (not modified).
+            stages (list): (name, function, params) tuples.
+            version (str): Dataset version; computed from the content if omitted.
+
+        Returns:
+            The output of the last stage.
+        """
+        # One cache key per stage: the version plus every stage up to and including it
+        keys = []
+        key = (version or frame_fingerprint(data),)
+        for name, _, params in stages:
+            key = key + ((name, json.dumps(params, sort_keys=True, default=str)),)
+            keys.append(key)
+
+        # Resume after the deepest stage that is already cached
+        output, start = data, 0
+        with self._lock:
+            for position in range(len(keys) - 1, -1, -1):
+                if keys[position] in self._cache:
+                    self._cache.move_to_end(keys[position])
+                    output, start = self._cache[keys[position]], position + 1
+                    self._counters['hits'] += 1
+                    break
+
+        for position in range(start, len(stages)):
+            name, function, params = stages[position]
+            logger.debug("Running cleaning stage %s", name)
+            with stage(name):
+                output = function(output.copy(), **params)
+            with self._lock:
+                self._counters['misses'] += 1
+                self._cache[keys[position]] = output
+                while len(self._cache) > self.max_entries:
+                    self._cache.popitem(last=False)
+        return output
+
+    def statistics(self, version):
+        """The CleaningStatistics kept for a dataset version, or None (the stages compute their own)."""
+        with self._lock:
+            return self._statistics.get(version)
+
+    def extend_statistics(self, parent_version, parent_data, version, rows):
+        """
+        Derive a version's cleaning statistics from its parent's and the appended rows.
+
+        The parent's statistics are built from `parent_data` the first time
+        (one sort per column); every later append only merges its rows in.
+
+        Args:
+            parent_version (str): Version the rows were appended to.
+            parent_data (DataFrame): That version's data.
+            version (str): The new version.
+            rows (DataFrame): The appended rows.
+
+        Returns:
+            CleaningStatistics: The new version's statistics.
+        """
+        parent = self.statistics(parent_version)
+        if parent is None:
+            with stage('cleaning_statistics'):
+                parent = CleaningStatistics.from_frame(strip_column_names(parent_data.copy(deep=False)))
+        with stage('extend_cleaning_statistics'):
+            statistics = parent.extend(strip_column_names(rows.copy(deep=False)))
+        with self._lock:
+            self._counters['statistics_extended'] += 1
+            self._statistics[parent_version] = parent
+            self._statistics[version] = statistics
+            while len(self._statistics) > MAX_STATISTICS_VERSIONS:
+                self._statistics.popitem(last=False)
+        return statistics
+
+    def clear(self):
+        with self._lock:
+            self._cache.clear()
+            self._statistics.clear()
+
+    def stats(self):
+        with self._lock:
+            return dict(self._counters, entries=len(self._cache))
+
+
+def _split(cleaned_data, test_size, random_state):
+    features, target = define_features_and_target(cleaned_data)
+    splits = split_dataset(cleaned_data, features, target, test_size=test_size, random_state=random_state)
+    return splits
+
+
+# Shared by every train/tune path in this process
+default_pipeline = CleaningPipeline()
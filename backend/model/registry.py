@@ -0,0 +1,327 @@
+from collections import OrderedDict
+import importlib
+import json
+import logging
+import os
+import pickle
+import threading
+
+import numpy as np
+import pandas as pd
+
+from instrumentation import stage
+from model.forest import FlatForest, default_builder
+
+logger = logging.getLogger(__name__)
+
+# Estimator classes for the per-column year-trend models served by /predict*,
+# imported on first use so that web workers boot without loading sklearn
+MODEL_FACTORIES = {
+    'linear': 'sklearn.linear_model.LinearRegression',
+    'random_forest': 'sklearn.ensemble.RandomForestRegressor',
+}
+
+
+def model_factory(model_type):
+    """Return the estimator class for a MODEL_FACTORIES key."""
+    module_name, class_name = MODEL_FACTORIES[model_type].rsplit('.', 1)
+    return getattr(importlib.import_module(module_name), class_name)
+
+
+class FittedModel:
+    """
+    A fitted per-column year-trend model and its in-sample metrics.
+
+    Attributes:
+        estimator: The fitted sklearn estimator.
+        flat (FlatForest): Flattened copy of a random forest used for
+            prediction, or None for other estimators.
+        years (ndarray): Training years (rows where the column is not NaN).
+        values (ndarray): Training values for the column.
+        metrics (dict): In-sample MAE and R², computed once at fit time.
+        nbytes (int): Approximate pickled size, used for the memory cap.
+    """
+
+    def __init__(self, estimator, years, values):
+        from sklearn.metrics import mean_absolute_error, r2_score
+
+        self.estimator = estimator
+        self.years = years
+        self.values = values
+        self.flat = FlatForest.from_estimator(estimator) if hasattr(estimator, 'estimators_') else None
+        fitted_values = self.predict(years)
+        self.metrics = {
+            "mae": float(mean_absolute_error(values, fitted_values)),
+            "r2": float(r2_score(values, fitted_values)),
+        }
+        self.nbytes = len(pickle.dumps(estimator, protocol=pickle.HIGHEST_PROTOCOL)) + years.nbytes + values.nbytes
+        if self.flat is not None:
+            self.nbytes += self.flat.nbytes
+
+    def predict(self, years):
+        with stage('predict'):
+            # Models saved before forests were flattened have no `flat`
+            flat = getattr(self, 'flat', None)
+            if flat is not None:
+                return flat.predict(np.asarray(years).reshape(-1, 1))
+            return self.estimator.predict(np.asarray(years).reshape(-1, 1))
+
+    def predict_interval(self, years, coverage=0.9):
+        """
+        Predictions with an interval from the spread of the forest's trees.
+
+        Returns:
+            tuple: (prediction, lower, upper) arrays.
+
+        Raises:
+            ValueError: If the model is not a random forest.
+        """
+        flat = getattr(self, 'flat', None)
+        if flat is None:
+            if not hasattr(self.estimator, 'estimators_'):
+                raise ValueError("Prediction intervals need a random forest")
+            flat = self.flat = FlatForest.from_estimator(self.estimator)
+        with stage('predict'):
+            return flat.predict_interval(np.asarray(years).reshape(-1, 1), coverage)
+
+
+def fit_column_model(model_type, params, voter_data, column):
+    """
+    Fit one year-trend model for a single column.
+
+    Args:
+        model_type (str): Key into MODEL_FACTORIES.
+        params (dict): Estimator hyperparameters.
+        voter_data (DataFrame): Dataset holding 'Year' and the column.
+        column (str): The column to model.
+
+    Returns:
+        FittedModel: The fitted model with its in-sample metrics.
+    """
+    # Column views of the (memory-mapped) dataset; only the non-NaN rows are copied
+    years = voter_data['Year'].to_numpy()
+    values = voter_data[column].to_numpy()
+    present = ~(pd.isna(years) | pd.isna(values))
+    years, values = years[present], values[present]
+    if model_type == 'random_forest':
+        # Forests with other tree counts on the same column are grown or cut down, not refit
+        estimator = default_builder.grow(years.reshape(-1, 1), values, params)
+    else:
+        estimator = model_factory(model_type)(**params)
+        with stage('fit'):
+            estimator.fit(years.reshape(-1, 1), values)
+    return FittedModel(estimator, years, values)
+
+
+class ModelRegistry:
+    """
+    In-process LRU cache of fitted per-column models.
+
+    Entries are keyed by (model type, column, hyperparameters, dataset
+    version), so a new dataset version never serves a stale model. The
+    least recently used entries are evicted once either `max_entries` or
+    `max_bytes` is exceeded.
+
+    Args:
+        max_entries (int): Maximum number of cached models.
+        max_bytes (int): Approximate memory cap for cached models.
+    """
+
+    def __init__(self, max_entries=512, max_bytes=256 * 1024 * 1024):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()
+        self._nbytes = 0
+        self._lock = threading.Lock()
+        self._stale = set()
+        self._key_locks = {}
+        self._counters = {'hits': 0, 'misses': 0, 'evictions': 0, 'carried_over': 0, 'stale_refits': 0}
+
+    @staticmethod
+    def make_key(model_type, column, params, version):
+        return (model_type, column, json.dumps(params, sort_keys=True), version)
+
+    def get_or_fit(self, model_type, column, params, version, voter_data):
+        """
+        Return the cached model for the key, fitting and caching it on a miss.
+
+        Concurrent misses on the same key wait for one fit instead of each
+        fitting the model; a stale model whose refit raises stays stale.
+
+        Args:
+            model_type (str): Key into MODEL_FACTORIES.
+            column (str): The column to model.
+            params (dict): Estimator hyperparameters.
+            version (str): Version of the dataset `voter_data` belongs to.
+            voter_data (DataFrame): Dataset used when the model must be fit.
+
+        Returns:
+            FittedModel: The fitted model.
+        """
+        key = self.make_key(model_type, column, params, version)
+        with self._lock:
+            fitted = self._hit(key)
+            if fitted is not None:
+                return fitted
+            key_lock = self._key_locks.setdefault(key, threading.Lock())
+
+        # Fit outside the registry lock so other columns are not blocked meanwhile
+        with key_lock:
+            try:
+                with self._lock:
+                    fitted = self._hit(key)
+                    if fitted is not None:
+                        return fitted
+                    self._counters['misses'] += 1
+                    stale = key in self._stale
+                    self._stale.discard(key)
+                try:
+                    fitted = fit_column_model(model_type, params, voter_data, column)
+                except Exception:
+                    if stale:
+                        with self._lock:
+                            self._stale.add(key)
+                    raise
+                if stale:
+                    with self._lock:
+                        self._counters['stale_refits'] += 1
+                self._put(key, fitted)
+                return fitted
+            finally:
+                with self._lock:
+                    if self._key_locks.get(key) is key_lock:
+                        del self._key_locks[key]
+
+    def _hit(self, key):
+        # Called with the lock held
+        fitted = self._entries.get(key)
+        if fitted is not None:
+            self._entries.move_to_end(key)
+            self._counters['hits'] += 1
+        return fitted
+
+    def warm(self, voter_data, version, model_specs, columns=None):
+        """
+        Pre-fit models so the first prediction requests are cheap.
+
+        Args:
+            voter_data (DataFrame): The dataset.
+            version (str): Its dataset version.
+            model_specs (list): (model_type, params) pairs to fit.
+            columns (list): Columns to fit; defaults to every column but 'Year'.
+        """
+        columns = columns or [column for column in voter_data.columns if column != 'Year']
+        for model_type, params in model_specs:
+            for column in columns:
+                self.get_or_fit(model_type, column, params, version, voter_data)
+
+    def carry_over(self, voter_data, old_version, new_version):
+        """
+        Fit, for a new dataset version, every model currently cached for the old one.
+
+        Used before publishing a reloaded dataset, so the models requests are
+        actually using are ready when the new version goes live.
+
+        Returns:
+            int: Number of models fitted for the new version.
+        """
+        with self._lock:
+            keys = [key for key in self._entries if key[3] == old_version]
+        for model_type, column, params, _ in keys:
+            if column in voter_data.columns:
+                self.get_or_fit(model_type, column, json.loads(params), new_version, voter_data)
+        return len(keys)
+
+    def append_version(self, old_version, new_version, changed_columns):
+        """
+        Carry models over to a version made by appending rows to `old_version`.
+
+        A model's training rows are the rows where its column is present, so
+        models of columns the appended rows leave empty are unchanged and are
+        shared with the new version as they are. The others are marked stale
+        and refit on their next request instead of all at once.
+
+        Args:
+            old_version (str): Version the rows were appended to.
+            new_version (str): The resulting version.
+            changed_columns (iterable): Columns with values in the appended rows.
+
+        Returns:
+            tuple: (models carried over, models marked stale).
+        """
+        changed_columns = set(changed_columns)
+        with self._lock:
+            keys = [key for key in self._entries if key[3] == old_version]
+            # Models still waiting for their refit stay stale in the new version
+            pending = [key for key in self._stale if key[3] == old_version]
+            for key in pending:
+                self._stale.discard(key)
+                self._stale.add(key[:3] + (new_version,))
+        carried, stale = 0, len(pending)
+        for key in keys:
+            new_key = key[:3] + (new_version,)
+            if key[1] in changed_columns:
+                with self._lock:
+                    self._stale.add(new_key)
+                stale += 1
+                continue
+            with self._lock:
+                fitted = self._entries.get(key)
+            if fitted is not None:
+                self._put(new_key, fitted)
+                carried += 1
+        with self._lock:
+            self._counters['carried_over'] += carried
+        return carried, stale
+
+    def stale_models(self, version):
+        """(model type, column) of the models of a version waiting to be refit."""
+        with self._lock:
+            return sorted((key[0], key[1]) for key in self._stale if key[3] == version)
+
+    def save(self, path):
+        """Persist every cached model to disk with joblib (atomically)."""
+        import joblib
+
+        with self._lock:
+            entries = list(self._entries.items())
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        tmp_path = f'{path}.{os.getpid()}.tmp'
+        joblib.dump(entries, tmp_path)
+        os.replace(tmp_path, path)
+
+    def load(self, path):
+        """
+        Load models persisted with save(), e.g. by another gunicorn worker.
+
+        Returns:
+            int: Number of models loaded (0 if the file does not exist).
+        """
+        if not os.path.exists(path):
+            return 0
+        import joblib
+
+        try:
+            entries = joblib.load(path)
+        except Exception:
+            logger.exception("Could not load model registry from %s", path)
+            return 0
+        for key, fitted in entries:
+            self._put(tuple(key), fitted)
+        return len(entries)
+
+    def stats(self):
+        with self._lock:
+            return dict(self._counters, entries=len(self._entries), nbytes=self._nbytes, stale=len(self._stale))
+
+    def _put(self, key, fitted):
+        with self._lock:
+            previous = self._entries.pop(key, None)
+            if previous is not None:
+                self._nbytes -= previous.nbytes
+            self._entries[key] = fitted
+            self._nbytes += fitted.nbytes
+            while self._entries and (len(self._entries) > self.max_entries or self._nbytes > self.max_bytes):
+                _, evicted = self._entries.popitem(last=False)
+                self._nbytes -= evicted.nbytes
+                self._counters['evictions'] += 1
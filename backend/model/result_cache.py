@@ -0,0 +1,425 @@
+# Persistent, content-addressed cache of /train-* and tuning results, shared by every worker and kept across restarts.
+import contextlib
+import hashlib
+import inspect
+import json
+import logging
+import os
+import platform
+import threading
+
+from data.cache import frame_fingerprint
+from model.pipeline import CleaningPipeline
+from serialization import dumps, loads
+
+try:
+    import fcntl
+except ImportError:  # No fcntl (e.g. Windows): keys are computed once per process instead of once overall
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+# Bump when the stored layout or the training code changes results for the same key
+# (2: grid searches report their best CV score)
+CACHE_FORMAT = 2
+
+
+# ----------------------------------------------------------------------
+# Training runs
+# ----------------------------------------------------------------------
+def _train_random_forest(voter_data, version, param_grid, search, n_jobs):
+    from model.train_randomForest import train_random_forest_model
+    model, metrics = train_random_forest_model(voter_data, version=version)
+    return {'estimator': model, 'metrics': metrics}
+
+
+def _train_linear_regression(voter_data, version, param_grid, search, n_jobs):
+    from model.train_linearRegression import train_linear_regression_model
+    model, metrics = train_linear_regression_model(voter_data, version=version)
+    return {'estimator': model, 'metrics': metrics}
+
+
+def _tune_random_forest(voter_data, version, param_grid, search, n_jobs):
+    from model.train_randomForest import hyper_tune_random_forest
+    model, metrics, best_params, search_report = hyper_tune_random_forest(
+        voter_data, param_grid, n_jobs=n_jobs, version=version, search=search)
+    return {'estimator': model, 'metrics': metrics, 'best_params': best_params, 'search': search_report}
+
+
+def _tune_linear_regression(voter_data, version, param_grid, search, n_jobs):
+    from model.train_linearRegression import hyper_tune_linear_regression
+    model, metrics, best_params, search_report = hyper_tune_linear_regression(
+        voter_data, param_grid, n_jobs=n_jobs, version=version, search=search)
+    return {'estimator': model, 'metrics': metrics, 'best_params': best_params, 'search': search_report}
+
+
+def _random_forest_estimators():
+    from sklearn.ensemble import RandomForestRegressor
+    from model.train_randomForest import TRAIN_PARAMS
+    return [RandomForestRegressor(**TRAIN_PARAMS)]
+
+
+def _linear_regression_estimators():
+    from sklearn.linear_model import LinearRegression
+    from sklearn.preprocessing import StandardScaler
+    return [StandardScaler(), LinearRegression()]
+
+
+def _tuned_random_forest_estimators():
+    from sklearn.ensemble import RandomForestRegressor
+    from model.train_randomForest import TUNE_PARAMS
+    return [RandomForestRegressor(**TUNE_PARAMS)]
+
+
+def _tuned_lasso_estimators():
+    from sklearn.linear_model import Lasso
+    from sklearn.preprocessing import StandardScaler
+    from model.train_linearRegression import TUNE_PARAMS
+    return [StandardScaler(), Lasso(**TUNE_PARAMS)]
+
+
+def _random_forest_grid():
+    from model.train_randomForest import PARAM_GRID
+    return PARAM_GRID
+
+
+def _lasso_grid():
+    from model.train_linearRegression import PARAM_GRID
+    return PARAM_GRID
+
+
+# Training kinds, named after the endpoints (and /jobs kinds) that run them:
+# the run, the estimators it fits (for the key) and the default grid of tuning runs
+TRAINERS = {
+    'train-randomforest': (_train_random_forest, _random_forest_estimators, None),
+    'train-linear-regression': (_train_linear_regression, _linear_regression_estimators, None),
+    'hyperparameter-tuning-randomforest': (_tune_random_forest, _tuned_random_forest_estimators, _random_forest_grid),
+    'hyperparameter-tuning-linear': (_tune_linear_regression, _tuned_lasso_estimators, _lasso_grid),
+}
+
+TRAINING_MESSAGES = {
+    'train-randomforest': "Random Forest model trained successfully",
+    'train-linear-regression': "Linear Regression model trained successfully",
+    'hyperparameter-tuning-randomforest': "Random Forest model trained and tuned successfully",
+    'hyperparameter-tuning-linear': "Linear Regression (Lasso) model trained and tuned successfully",
+}
+
+
+def library_versions():
+    """Versions of the libraries a stored result depends on."""
+    import joblib
+    import numpy
+    import pandas
+    import sklearn
+
+    return {'python': platform.python_version(), 'numpy': numpy.__version__, 'pandas': pandas.__version__,
+            'sklearn': sklearn.__version__, 'joblib': joblib.__version__}
+
+
+def _search_settings(search):
+    # perform_search's defaults (CV folds, scoring, seeds...) with the request's options on top; n_jobs does not change results
+    from model.hyperparameter_tuning import perform_search
+
+    settings = {name: parameter.default for name, parameter in inspect.signature(perform_search).parameters.items()
+                if parameter.default is not inspect.Parameter.empty and name != 'n_jobs'}
+    return dict(settings, **(search or {}))
+
+
+def training_key(kind, voter_data, version=None, param_grid=None, search=None):
+    """
+    Content key of a training run.
+
+    Hashes the dataset version (a content hash; computed from the frame if
+    omitted), the cleaning stages' configuration, the estimators' classes and
+    parameters, the parameter grid, the search and CV settings, and the
+    library versions, so any change to what the run depends on gives a new key.
+
+    Args:
+        kind (str): Key into TRAINERS.
+        voter_data (DataFrame): The dataset.
+        version (str): Dataset version.
+        param_grid (dict): Grid of a tuning run.
+        search (dict): perform_search options of a tuning run.
+
+    Returns:
+        str: Hex key.
+    """
+    if kind not in TRAINERS:
+        raise ValueError(f"Unknown training kind '{kind}'")
+    _, estimators, default_grid = TRAINERS[kind]
+    tuning = default_grid is not None
+    parts = {
+        'format': CACHE_FORMAT,
+        'kind': kind,
+        'dataset': version or frame_fingerprint(voter_data),
+        'cleaning': [[name, params] for name, _, params in CleaningPipeline.stages(exclude_columns=['Year'])],
+        'estimators': [[f'{type(estimator).__module__}.{type(estimator).__qualname__}', estimator.get_params()]
+                       for estimator in estimators()],
+        'param_grid': (param_grid or default_grid()) if tuning else None,
+        'search': _search_settings(search) if tuning else None,
+        'libraries': library_versions(),
+    }
+    return hashlib.sha256(json.dumps(parts, sort_keys=True, default=str).encode()).hexdigest()[:32]
+
+
+def train_cached(cache, kind, voter_data, version=None, param_grid=None, search=None, n_jobs=-1):
+    """
+    Run a training kind through the cache.
+
+    Args:
+        cache (TrainingResultCache): Where results are stored; None runs
+            the training without storing it.
+        kind (str): Key into TRAINERS.
+        voter_data (DataFrame): The dataset.
+        version (str): Dataset version.
+        param_grid (dict): Grid of a tuning run (the kind's default grid if omitted).
+        search (dict): perform_search options of a tuning run.
+        n_jobs (int): Cores for the run (not part of the key).
+
+    Returns:
+        TrainingResult: The stored or newly computed result.
+    """
+    key = training_key(kind, voter_data, version, param_grid, search)
+    function, _, default_grid = TRAINERS[kind]
+    if default_grid is not None and not param_grid:
+        param_grid = default_grid()
+    if cache is None:
+        value = function(voter_data, version, param_grid, search, n_jobs)
+        return TrainingResult(key, value, False, None, value['estimator'])
+    return cache.get_or_compute(key, lambda: function(voter_data, version, param_grid, search, n_jobs))
+
+
+def training_response(kind, result):
+    """The response body of a training kind's endpoint (and /jobs result)."""
+    response = {"message": TRAINING_MESSAGES[kind], "metrics": result.metrics, "cached": result.cached}
+    if TRAINERS[kind][2] is not None:
+        response.update(best_params=result.best_params, search=result.search)
+    return response
+
+
+# ----------------------------------------------------------------------
+# Result store
+# ----------------------------------------------------------------------
+class TrainingResult:
+    """
+    A training result: metrics, best parameters and search report, plus the
+    fitted estimator, which is only unpickled when first accessed (hits that
+    just report metrics never pay for loading a forest).
+
+    Attributes:
+        key (str): The result's key.
+        metrics (dict): Evaluation metrics.
+        best_params (dict): Best hyperparameters of a tuning run, else None.
+        search (dict): Search report of a tuning run, else None.
+        cached (bool): Whether the result was read from the cache.
+    """
+
+    def __init__(self, key, document, cached, estimator_path, estimator=None):
+        self.key = key
+        self.metrics = document.get('metrics')
+        self.best_params = document.get('best_params')
+        self.search = document.get('search')
+        self.cached = cached
+        self._estimator_path = estimator_path
+        self._estimator = estimator
+
+    @property
+    def estimator(self):
+        if self._estimator is None:
+            import joblib
+            self._estimator = joblib.load(self._estimator_path)
+        return self._estimator
+
+
+class TrainingResultCache:
+    """
+    On-disk training results keyed by content (see training_key).
+
+    Each entry is `<key>.json` (metrics, best parameters, search report) and
+    `<key>.joblib` (the fitted estimator), written atomically, JSON last so a
+    readable JSON file means a complete entry. A miss takes an exclusive file
+    lock on `<key>.lock` before computing; concurrent requests for the same key,
+    from any gunicorn worker, wait on that lock and then read the stored
+    result instead of fitting again. Hits refresh the entry's mtime, and after
+    every write the least recently used entries are deleted until the total
+    size is back under `max_bytes` (the newest entry is always kept).
+
+    Args:
+        directory (str): Where entries are stored.
+        max_bytes (int): Size limit of all entries.
+    """
+
+    def __init__(self, directory, max_bytes=512 * 1024 * 1024):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._key_locks = {}
+        self._counters = {'hits': 0, 'misses': 0, 'waited': 0, 'evictions': 0}
+        os.makedirs(directory, exist_ok=True)
+
+    def get_or_compute(self, key, compute):
+        """
+        The stored result for `key`, computing and storing it first if needed.
+
+        Args:
+            key (str): Content key.
+            compute (callable): Returns a dict with the fitted 'estimator', its
+                'metrics' and, for tuning runs, 'best_params' and 'search'.
+
+        Returns:
+            TrainingResult: The result; `cached` tells whether it was stored already.
+        """
+        result = self._read(key)
+        if result is None:
+            with self._key_lock(key):
+                # Another worker may have computed it while this one waited for the lock
+                result = self._read(key)
+                if result is None:
+                    try:
+                        value = compute()
+                    except Exception:
+                        # Nothing will be stored under this key (e.g. an invalid grid); drop its
+                        # lock file while still holding it, so waiters move to a fresh one
+                        self._unlink_lock(key)
+                        raise
+                    self._write(key, value)
+                    result = TrainingResult(key, value, False, self._path(key, '.joblib'), value['estimator'])
+            if not result.cached:
+                with self._lock:
+                    self._counters['misses'] += 1
+                self._evict()
+                return result
+            with self._lock:
+                self._counters['waited'] += 1
+        with self._lock:
+            self._counters['hits'] += 1
+        return result
+
+    def __reduce__(self):
+        # Pickled (e.g. for /jobs child processes) as its location; counters start afresh
+        return type(self), (self.directory, self.max_bytes)
+
+    def clear(self):
+        """Delete every entry."""
+        for name in os.listdir(self.directory):
+            with contextlib.suppress(FileNotFoundError):
+                os.remove(os.path.join(self.directory, name))
+
+    def stats(self):
+        entries, nbytes = 0, 0
+        for _, _, size in self._entries():
+            entries += 1
+            nbytes += size
+        with self._lock:
+            return dict(self._counters, entries=entries, nbytes=nbytes)
+
+    def _path(self, key, suffix):
+        return os.path.join(self.directory, f'{key}{suffix}')
+
+    def _read(self, key):
+        path = self._path(key, '.json')
+        try:
+            with open(path, 'rb') as f:
+                document = loads(f.read())
+            os.utime(path)  # Most recently used
+        except (OSError, ValueError):
+            return None
+        return TrainingResult(key, document, True, self._path(key, '.joblib'))
+
+    def _write(self, key, value):
+        import joblib
+
+        tmp_suffix = f'.{os.getpid()}.{threading.get_ident()}.tmp'
+        estimator_path = self._path(key, '.joblib')
+        joblib.dump(value['estimator'], estimator_path + tmp_suffix)
+        os.replace(estimator_path + tmp_suffix, estimator_path)
+        document = {name: value.get(name) for name in ('metrics', 'best_params', 'search')}
+        path = self._path(key, '.json')
+        with open(path + tmp_suffix, 'wb') as f:
+            f.write(dumps(document))
+        os.replace(path + tmp_suffix, path)
+
+    @contextlib.contextmanager
+    def _key_lock(self, key, blocking=True):
+        """
+        Hold the key's lock; yields False instead when `blocking` is off and
+        someone else holds it.
+
+        Lock files are only unlinked by their holder (see _unlink_lock). A
+        worker that was waiting on an unlinked file notices after locking that
+        the path now names another file (or none) and locks that one instead,
+        so at most one worker computes a key at a time.
+        """
+        if fcntl is None:
+            with self._lock:
+                lock = self._key_locks.setdefault(key, threading.Lock())
+            if not lock.acquire(blocking):
+                yield False
+                return
+            try:
+                yield True
+            finally:
+                lock.release()
+            return
+
+        path = self._path(key, '.lock')
+        while True:
+            # flock locks belong to the open file, so threads of one worker exclude each other as well
+            with open(path, 'ab') as f:
+                try:
+                    fcntl.flock(f, fcntl.LOCK_EX if blocking else fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except BlockingIOError:
+                    yield False
+                    return
+                try:
+                    current = os.fstat(f.fileno()).st_ino == os.stat(path).st_ino
+                except FileNotFoundError:
+                    current = False
+                if current:
+                    try:
+                        yield True
+                    finally:
+                        fcntl.flock(f, fcntl.LOCK_UN)
+                    return
+
+    def _unlink_lock(self, key):
+        # Only called with the key's lock held
+        if fcntl is not None:
+            with contextlib.suppress(FileNotFoundError):
+                os.remove(self._path(key, '.lock'))
+
+    def _entries(self):
+        """(mtime, key, size) of every complete entry."""
+        entries = []
+        for name in os.listdir(self.directory):
+            if not name.endswith('.json'):
+                continue
+            key = name[:-len('.json')]
+            try:
+                stat = os.stat(self._path(key, '.json'))
+                size = stat.st_size + os.path.getsize(self._path(key, '.joblib'))
+            except OSError:
+                continue  # Being written or evicted by another worker
+            entries.append((stat.st_mtime, key, size))
+        return entries
+
+    def _evict(self):
+        entries = sorted(self._entries())
+        total = sum(size for _, _, size in entries)
+        evicted = 0
+        while total > self.max_bytes and len(entries) > 1:
+            _, key, size = entries.pop(0)
+            # JSON first, so nobody reads an entry whose estimator is gone
+            for suffix in ('.json', '.joblib'):
+                with contextlib.suppress(FileNotFoundError):
+                    os.remove(self._path(key, suffix))
+            # The lock file goes too unless someone holds it (they will find the entry gone)
+            with self._key_lock(key, blocking=False) as held:
+                if held:
+                    self._unlink_lock(key)
+            total -= size
+            evicted += 1
+        if evicted:
+            logger.info("Evicted %d training results from %s", evicted, self.directory)
+            with self._lock:
+                self._counters['evictions'] += evicted
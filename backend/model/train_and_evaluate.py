@@ -1,19 +1,25 @@
 from sklearn.metrics import mean_absolute_error, mean_squared_error, r2_score
 import numpy as np
 
-def train_and_evaluate_model(model, X_train, X_test, y_train, y_test):
+from instrumentation import stage
+
+def train_and_evaluate_model(model, X_train, X_test, y_train, y_test, fit=True):
     """
     Trains the given model and evaluates it on the test set.
 
     Args:
         model: The model to train.
         X_train, X_test, y_train, y_test: The train-test split of the dataset.
+        fit (bool): Set to False when the model is already fitted on X_train.
 
     Returns:
         A dictionary of evaluation metrics (MAE, MSE, RMSE, R²).
     """
-    model.fit(X_train, y_train)
-    y_pred = model.predict(X_test)
+    if fit:
+        with stage('fit'):
+            model.fit(X_train, y_train)
+    with stage('predict'):
+        y_pred = model.predict(X_test)
 
     metrics = {
         "mae": round(mean_absolute_error(y_test, y_pred), 2),
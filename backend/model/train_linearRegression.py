@@ -2,22 +2,32 @@ from model.utils import clean_and_prepare_data
 from model.train_and_evaluate import train_and_evaluate_model
 from sklearn.linear_model import LinearRegression
 from sklearn.preprocessing import StandardScaler
-from model.hyperparameter_tuning import perform_grid_search
+from model.hyperparameter_tuning import perform_search
 from sklearn.linear_model import Lasso
 
-def train_linear_regression_model(data):
+# Default hyperparameter grid for Lasso Regression tuning
+PARAM_GRID = {
+    'alpha': [0.01, 0.1, 1, 10],  # Regularization strength
+    'fit_intercept': [True, False]
+}
+
+# Lasso settings of the search (also part of the training-result cache key)
+TUNE_PARAMS = {'random_state': 42}
+
+def train_linear_regression_model(data, version=None):
     """
     Trains and evaluates a Linear Regression model.
 
     Args:
         data (DataFrame): The dataset to train and evaluate the model on.
+        version (str): Dataset version used to reuse cached cleaning results.
 
     Returns:
         model: Trained Linear Regression model.
         metrics (dict): Evaluation metrics of the model.
     """
     # Prepare the data
-    X_train, X_test, y_train, y_test = clean_and_prepare_data(data, exclude_columns=['Year'])
+    X_train, X_test, y_train, y_test = clean_and_prepare_data(data, exclude_columns=['Year'], version=version)
 
     # Scale the data for Linear Regression
     scaler = StandardScaler()
@@ -30,36 +40,43 @@ def train_linear_regression_model(data):
 
     return model, metrics
 
-def hyper_tune_linear_regression(data, param_grid):
+def hyper_tune_linear_regression(data, param_grid, n_jobs=-1, version=None, search=None):
     """
-    Tunes a Linear Regression (Lasso) model using GridSearchCV and evaluates it.
+    Tunes a Linear Regression (Lasso) model (GridSearchCV or another perform_search strategy) and evaluates it.
 
     Args:
         data (DataFrame): The dataset to train and tune the model on.
         param_grid (dict): Hyperparameter grid for tuning.
+        n_jobs (int): Number of parallel jobs for the grid search (default=-1 for all cores).
+        version (str): Dataset version used to reuse cached cleaning results.
+        search (dict): Optional perform_search options (strategy, n_iter, resource,
+            factor, max_fits, max_seconds); defaults to an exhaustive grid search.
 
     Returns:
-        best_model: The best Linear Regression (Lasso) model found by GridSearchCV.
+        best_model: The best Linear Regression (Lasso) model found by the search.
         metrics (dict): Evaluation metrics of the best model.
-        best_params (dict): The best hyperparameters found by GridSearchCV.
+        best_params (dict): The best hyperparameters found by the search.
+        search_report (dict): Strategy, fits and seconds spent by the search.
     """
     # Prepare the data
-    X_train, X_test, y_train, y_test = clean_and_prepare_data(data, exclude_columns=['Year'])
+    X_train, X_test, y_train, y_test = clean_and_prepare_data(data, exclude_columns=['Year'], version=version)
 
     # Scale the data
     scaler = StandardScaler()
     X_train_scaled = scaler.fit_transform(X_train)
     X_test_scaled = scaler.transform(X_test)
 
-    # Perform GridSearchCV
-    best_lasso_model, best_params = perform_grid_search(
-        estimator=Lasso(random_state=42),
+    # Perform the hyperparameter search (exhaustive GridSearchCV by default)
+    best_lasso_model, best_params, search_report = perform_search(
+        estimator=Lasso(**TUNE_PARAMS),
         param_grid=param_grid,
         X_train=X_train_scaled,
-        y_train=y_train
+        y_train=y_train,
+        n_jobs=n_jobs,
+        **(search or {})
     )
 
-    # Evaluate the tuned model
-    metrics = train_and_evaluate_model(best_lasso_model, X_train_scaled, X_test_scaled, y_train, y_test)
+    # Evaluate the tuned model (already refit on the training set by the search)
+    metrics = train_and_evaluate_model(best_lasso_model, X_train_scaled, X_test_scaled, y_train, y_test, fit=False)
 
-    return best_lasso_model, metrics, best_params
+    return best_lasso_model, metrics, best_params, search_report
@@ -1,20 +1,41 @@
 from model.utils import clean_and_prepare_data
-from model.hyperparameter_tuning import perform_grid_search
+from model.hyperparameter_tuning import perform_search
 from model.train_and_evaluate import train_and_evaluate_model 
+from model.forest import default_builder
+from instrumentation import stage
 from sklearn.ensemble import RandomForestRegressor
 from sklearn.metrics import mean_absolute_error, mean_squared_error, r2_score
+import logging
 import numpy as np
 
-def train_random_forest_model(data):
+logger = logging.getLogger(__name__)
+
+# Default hyperparameter grid for Random Forest tuning
+PARAM_GRID = {
+    'n_estimators': [50, 100, 200],
+    'max_depth': [None, 10, 20],
+    'min_samples_split': [2, 5],
+    'min_samples_leaf': [1, 2]
+}
+
+# Estimator settings of the plain fit and of the search (also part of the training-result cache key)
+TRAIN_PARAMS = {'random_state': 42, 'n_estimators': 100}
+TUNE_PARAMS = {'random_state': 42}
+
+def train_random_forest_model(data, version=None):
     # Prepare the data
-    X_train, X_test, y_train, y_test = clean_and_prepare_data(data, exclude_columns=['Year'])
+    X_train, X_test, y_train, y_test = clean_and_prepare_data(data, exclude_columns=['Year'], version=version)
+
+    # Train the Random Forest model (reusing a cached forest when one exists)
+    rf_params = dict(TRAIN_PARAMS)
+    rf_model = default_builder.grow(X_train, y_train, rf_params)
 
-    # Train the Random Forest model
-    rf_model = RandomForestRegressor(random_state=42)
-    rf_model.fit(X_train, y_train)
+    # Out-of-bag estimate from the same trees, no extra refit
+    oob = default_builder.oob_scores(X_train, y_train, rf_params, [rf_params['n_estimators']])[rf_params['n_estimators']]
 
     # Evaluate the model
-    y_pred = rf_model.predict(X_test)
+    with stage('predict'):
+        y_pred = rf_model.predict(X_test)
     mae = mean_absolute_error(y_test, y_pred)
     rmse = np.sqrt(mean_squared_error(y_test, y_pred))
     r2 = r2_score(y_test, y_pred)
@@ -22,37 +43,45 @@ def train_random_forest_model(data):
     metrics = {
         "mae": round(mae, 2),
         "rmse": round(rmse, 2),
-        "r2": round(r2, 2)
+        "r2": round(r2, 2),
+        "oob_r2": round(oob['r2'], 2) if oob['r2'] is not None else None
     }
 
-    print(f"Random Forest - MAE: {mae:.2f}, RMSE: {rmse:.2f}, R²: {r2:.2f}")
+    logger.info("Random Forest - MAE: %.2f, RMSE: %.2f, R²: %.2f", mae, rmse, r2)
     return rf_model, metrics
 
-def hyper_tune_random_forest(data, param_grid):
+def hyper_tune_random_forest(data, param_grid, n_jobs=-1, version=None, search=None):
     """
-    Tunes a Random Forest model using GridSearchCV and evaluates it.
+    Tunes a Random Forest model (GridSearchCV or another perform_search strategy) and evaluates it.
 
     Args:
         data (DataFrame): The dataset to train and tune the model on.
         param_grid (dict): Hyperparameter grid for tuning.
+        n_jobs (int): Number of parallel jobs for the grid search (default=-1 for all cores).
+        version (str): Dataset version used to reuse cached cleaning results.
+        search (dict): Optional perform_search options (strategy, n_iter, resource,
+            factor, max_fits, max_seconds); defaults to an exhaustive grid search.
 
     Returns:
-        best_model: The best Random Forest model found by GridSearchCV.
+        best_model: The best Random Forest model found by the search.
         metrics (dict): Evaluation metrics of the best model.
-        best_params (dict): The best hyperparameters found by GridSearchCV.
+        best_params (dict): The best hyperparameters found by the search.
+        search_report (dict): Strategy, fits and seconds spent by the search.
     """
     # Prepare the data
-    X_train, X_test, y_train, y_test = clean_and_prepare_data(data, exclude_columns=['Year'])
+    X_train, X_test, y_train, y_test = clean_and_prepare_data(data, exclude_columns=['Year'], version=version)
 
-    # Perform GridSearchCV
-    best_rf_model, best_params = perform_grid_search(
-        estimator=RandomForestRegressor(random_state=42),
+    # Perform the hyperparameter search (exhaustive GridSearchCV by default)
+    best_rf_model, best_params, search_report = perform_search(
+        estimator=RandomForestRegressor(**TUNE_PARAMS),
         param_grid=param_grid,
         X_train=X_train,
-        y_train=y_train
+        y_train=y_train,
+        n_jobs=n_jobs,
+        **(search or {})
     )
 
-    # Evaluate the tuned model
-    metrics = train_and_evaluate_model(best_rf_model, X_train, X_test, y_train, y_test)
+    # Evaluate the tuned model (already refit on the training set by the search)
+    metrics = train_and_evaluate_model(best_rf_model, X_train, X_test, y_train, y_test, fit=False)
 
-    return best_rf_model, metrics, best_params
+    return best_rf_model, metrics, best_params, search_report
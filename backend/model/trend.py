@@ -0,0 +1,221 @@
+from collections import OrderedDict
+import threading
+
+import numpy as np
+
+from instrumentation import count, stage, timed_stage
+
+
+class TrendFit:
+    """
+    Least-squares year-trend lines for many columns, fitted in one pass.
+
+    Each column gets its own `value = intercept + slope * year` fit over the
+    rows where it is not NaN, matching a per-column sklearn LinearRegression
+    on `voter_data[['Year', column]].dropna()`.
+
+    Attributes:
+        columns (list): Column names, in fit order.
+        year_labels (ndarray): Year of every row as given, shape (n_rows,).
+        years (ndarray): The same years as float64.
+        values (ndarray): Column values with NaNs, shape (n_rows, n_columns).
+        mask (ndarray): True where a value is present.
+        slopes, intercepts (ndarray): Per-column coefficients.
+        mae, r2 (ndarray): Per-column in-sample metrics.
+
+    The fit also keeps per-column sufficient statistics (count and the sums
+    of x, y, xy, x² and y², taken about a fixed origin so they stay well
+    conditioned), so `extend()` can add rows without revisiting the history.
+    """
+
+    def __init__(self, columns, years, values):
+        self.columns = list(columns)
+        self.year_labels = np.asarray(years)
+        self.years = self.year_labels.astype(np.float64)
+        self.values = np.asarray(values, dtype=np.float64).reshape(len(self.years), -1)
+        self.mask = ~np.isnan(self.values)
+        self._index = {column: i for i, column in enumerate(self.columns)}
+
+        # Masked sums; centering on the per-column means keeps year² well conditioned
+        x = self.years[:, None]
+        n = self.mask.sum(axis=0)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            mean_x = np.where(self.mask, x, 0.0).sum(axis=0) / n
+            mean_y = np.where(self.mask, self.values, 0.0).sum(axis=0) / n
+            dx = np.where(self.mask, x - mean_x, 0.0)
+            dy = np.where(self.mask, self.values - mean_y, 0.0)
+            sxx = (dx * dx).sum(axis=0)
+            sxy = (dx * dy).sum(axis=0)
+            self.slopes = np.where(sxx > 0, sxy / np.where(sxx > 0, sxx, 1.0), 0.0)
+            self.intercepts = mean_y - self.slopes * mean_x
+
+            # In-sample metrics, same definitions as sklearn's MAE and R²
+            residuals = np.where(self.mask, self.values - (self.intercepts + self.slopes * x), 0.0)
+            ss_res = (residuals * residuals).sum(axis=0)
+            ss_tot = (dy * dy).sum(axis=0)
+            self._mae = np.abs(residuals).sum(axis=0) / n
+            self.r2 = np.where(ss_tot > 0, 1.0 - ss_res / np.where(ss_tot > 0, ss_tot, 1.0),
+                               np.where(ss_res == 0, 1.0, 0.0))
+        self.n = n
+
+        # Sufficient statistics about the column means (empty columns: origin 0)
+        self.origin = np.nan_to_num(np.vstack([mean_x, mean_y]))
+        self.sums = np.vstack([dx.sum(axis=0), dy.sum(axis=0), (dx * dy).sum(axis=0), sxx, (dy * dy).sum(axis=0)])
+
+    @property
+    def mae(self):
+        # Fits derived by extend() compute their MAE (a pass over the residuals) on first use
+        if self._mae is None:
+            residuals = np.where(self.mask, self.values - self.predict(self.years), 0.0)
+            with np.errstate(invalid='ignore', divide='ignore'):
+                self._mae = np.abs(residuals).sum(axis=0) / self.n
+        return self._mae
+
+    def extend(self, years, values):
+        """
+        Return the fit of the same columns with rows appended, without a refit.
+
+        The coefficients and R² come from the updated sufficient statistics,
+        so the cost depends on the number of new rows, not on the history
+        (the row arrays are still concatenated for `actual()`). The MAE is
+        computed lazily on first use.
+
+        Args:
+            years (array-like): Years of the new rows, shape (n_new,).
+            values (array-like): Their values, shape (n_new, n_columns), NaN where missing.
+
+        Returns:
+            TrendFit: The updated fit; this one is left unchanged.
+        """
+        year_labels = np.asarray(years)
+        new_years = year_labels.astype(np.float64)
+        new_values = np.asarray(values, dtype=np.float64).reshape(len(new_years), len(self.columns))
+        new_mask = ~np.isnan(new_values)
+        dx = np.where(new_mask, new_years[:, None] - self.origin[0], 0.0)
+        dy = np.where(new_mask, new_values - self.origin[1], 0.0)
+
+        fit = object.__new__(TrendFit)
+        fit.columns = self.columns
+        fit._index = self._index
+        fit.year_labels = np.concatenate([self.year_labels, year_labels])
+        fit.years = np.concatenate([self.years, new_years])
+        fit.values = np.concatenate([self.values, new_values])
+        fit.mask = np.concatenate([self.mask, new_mask])
+        fit.origin = self.origin
+        fit.sums = self.sums + np.vstack([dx.sum(axis=0), dy.sum(axis=0), (dx * dy).sum(axis=0),
+                                          (dx * dx).sum(axis=0), (dy * dy).sum(axis=0)])
+        fit.n = self.n + new_mask.sum(axis=0)
+
+        # Centered sums from the sums about the origin
+        s_x, s_y, s_xy, s_xx, s_yy = fit.sums
+        with np.errstate(invalid='ignore', divide='ignore'):
+            mean_dx, mean_dy = s_x / fit.n, s_y / fit.n
+            sxx = np.maximum(s_xx - fit.n * mean_dx * mean_dx, 0.0)
+            sxy = s_xy - fit.n * mean_dx * mean_dy
+            ss_tot = np.maximum(s_yy - fit.n * mean_dy * mean_dy, 0.0)
+            fit.slopes = np.where(sxx > 0, sxy / np.where(sxx > 0, sxx, 1.0), 0.0)
+            fit.intercepts = (self.origin[1] + mean_dy) - fit.slopes * (self.origin[0] + mean_dx)
+            ss_res = np.maximum(ss_tot - fit.slopes * sxy, 0.0)
+            fit.r2 = np.where(ss_tot > 0, 1.0 - ss_res / np.where(ss_tot > 0, ss_tot, 1.0),
+                              np.where(ss_res == 0, 1.0, 0.0))
+        fit._mae = None
+        return fit
+
+    def index(self, columns):
+        """Return the positions of `columns`, raising KeyError for unknown names."""
+        return np.array([self._index[column] for column in columns], dtype=np.intp)
+
+    def predict(self, years, columns=None):
+        """
+        Evaluate the trend lines.
+
+        Args:
+            years (array-like): Years to predict, shape (n_years,).
+            columns (list): Columns to predict; defaults to all of them.
+
+        Returns:
+            ndarray: Predictions of shape (n_years, n_columns).
+        """
+        idx = slice(None) if columns is None else self.index(columns)
+        years = np.asarray(years, dtype=np.float64)[:, None]
+        return self.intercepts[idx] + self.slopes[idx] * years
+
+    def actual(self, column):
+        """Return the (years, values) the column's trend was fitted on."""
+        i = self._index[column]
+        present = self.mask[:, i]
+        return self.year_labels[present], self.values[present, i]
+
+
+@timed_stage('fit')
+def fit_linear_trends(voter_data, columns):
+    """
+    Fit the year-trend of every column in one vectorized pass.
+
+    Args:
+        voter_data (DataFrame): Dataset holding 'Year' and the columns.
+        columns (list): Columns to fit.
+
+    Returns:
+        TrendFit: The fitted trends.
+    """
+    values = voter_data[columns].to_numpy(dtype=np.float64, na_value=np.nan)
+    return TrendFit(columns, voter_data['Year'].to_numpy(), values)
+
+
+# Trends of the most recent dataset versions, so requests still on the previous
+# snapshot during a reload do not evict the new one
+MAX_TREND_VERSIONS = 2
+_trends = OrderedDict()
+_trends_lock = threading.Lock()
+
+
+def extend_linear_trends(parent_version, version, rows):
+    """
+    Derive a version's trends from its parent's and the rows appended to it.
+
+    Args:
+        parent_version (str): Version the rows were appended to.
+        version (str): The new version.
+        rows (DataFrame): The appended rows ('Year' and any of the columns).
+
+    Returns:
+        TrendFit: The new version's trends, or None when the parent's are not
+        cached or the rows bring new numeric columns (get_linear_trends then
+        fits the new version from scratch).
+    """
+    parent = _trends.get(parent_version)
+    numeric = [column for column in rows.select_dtypes('number').columns if column != 'Year']
+    if parent is None or any(column not in parent.columns for column in numeric):
+        return None
+    values = rows.reindex(columns=parent.columns).to_numpy(dtype=np.float64, na_value=np.nan)
+    with stage('extend_trends'):
+        trends = parent.extend(rows['Year'].to_numpy(), values)
+    with _trends_lock:
+        count('linear_trends', 'extended')
+        _trends[version] = trends
+        while len(_trends) > MAX_TREND_VERSIONS:
+            _trends.popitem(last=False)
+    return trends
+
+
+def get_linear_trends(voter_data, version):
+    """
+    Return the trends of every numeric column for a dataset version.
+
+    All columns are fitted together once per version; requests then only
+    index into the result.
+    """
+    trends = _trends.get(version)
+    if trends is not None:
+        count('linear_trends', 'hits')
+        return trends
+    with _trends_lock:
+        trends = _trends.get(version)
+        if trends is None:
+            count('linear_trends', 'misses')
+            columns = [column for column in voter_data.select_dtypes('number').columns if column != 'Year']
+            trends = _trends[version] = fit_linear_trends(voter_data, columns)
+            while len(_trends) > MAX_TREND_VERSIONS:
+                _trends.popitem(last=False)
+        return trends
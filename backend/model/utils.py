@@ -1,36 +1,29 @@
-from data.cleaning import (handle_missing_values, remove_outliers, normalize_data, convert_to_numeric, add_engineered_features)
-from data.preparation import (define_features_and_target, split_dataset)
+from model.pipeline import CleaningPipeline, default_pipeline
 
 # Define a reusable function for data cleaning and preparation
-def clean_and_prepare_data(data, exclude_columns=None):
+def clean_and_prepare_data(data, exclude_columns=None, version=None, pipeline=None):
     """
     Cleans and prepares the data for training and testing.
 
+    Stage outputs are memoized by the cleaning pipeline, so repeated calls on
+    the same dataset (e.g. linear regression then random forest) only do the
+    cleaning work once.
+
     Args:
         data (DataFrame): The input dataset.
         exclude_columns (list): Columns to exclude from normalization.
+        version (str): Dataset version; computed from the content if omitted.
+        pipeline (CleaningPipeline): Pipeline to use (defaults to the shared one).
 
     Returns:
         X_train, X_test, y_train, y_test: The split and prepared datasets.
     """
-    # Step 1: Copy data to avoid modifying the original dataset
-    cleaned_data = data.copy()
-    
-    # Step 2: Strip column names to remove extra whitespace
-    cleaned_data.columns = cleaned_data.columns.str.strip()
-
-    # Step 3: Apply data cleaning steps
-    cleaned_data = handle_missing_values(cleaned_data)
-    cleaned_data = remove_outliers(cleaned_data)
-    cleaned_data = normalize_data(cleaned_data, exclude_columns=exclude_columns)
-    cleaned_data = convert_to_numeric(cleaned_data)
-    cleaned_data = add_engineered_features(cleaned_data)
-
-    # Step 4: Define features and target
-    features, target = define_features_and_target(cleaned_data)
+    pipeline = pipeline or default_pipeline
 
-    # Step 5: Split the dataset into training and testing sets
-    splits = split_dataset(cleaned_data, features, target)
+    # Strip column names, clean, engineer features and split (see CleaningPipeline.stages);
+    # versions built by appending rows reuse their incrementally maintained statistics
+    stages = CleaningPipeline.stages(exclude_columns=exclude_columns, statistics=pipeline.statistics(version))
+    splits = pipeline.run(data, stages, version=version)
     X_train, X_test, y_train, y_test = splits['X_train'], splits['X_test'], splits['y_train'], splits['y_test']
 
     return X_train, X_test, y_train, y_test
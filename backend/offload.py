@@ -0,0 +1,40 @@
+# Worker side of the ASGI process pool (see asgi.py): runs CPU-bound Flask requests in spawned processes.
+# Kept apart from asgi.py so that unpickling these functions does not build another adapter.
+import io
+import os
+import sys
+
+_app = None
+
+
+def init_worker():
+    """Pool initializer: import the app once per worker process."""
+    global _app
+    from threadpoolctl import threadpool_limits
+
+    # One request per worker: comparisons and backtests fit inline and BLAS/OpenMP get one core
+    os.environ['COMPARE_WORKERS'] = '0'
+    os.environ['BACKTEST_WORKERS'] = '0'
+    threadpool_limits(limits=1)
+    from app import app
+    _app = app
+
+
+def ping():
+    return os.getpid()
+
+
+def handle_request(environ, body):
+    """
+    Run one request through the Flask app.
+
+    Args:
+        environ (dict): WSGI environ without its input/error streams.
+        body (bytes): The request body.
+
+    Returns:
+        tuple: (status code, list of header pairs, body bytes).
+    """
+    environ = dict(environ, **{'wsgi.input': io.BytesIO(body), 'wsgi.errors': sys.stderr})
+    response = _app.response_class.from_app(_app, environ, buffered=True)
+    return response.status_code, list(response.headers.items()), response.get_data()
@@ -0,0 +1,192 @@
+# Response serialization: NumPy-native JSON (orjson when installed), column-oriented bodies and MessagePack/Arrow negotiation.
+import json
+
+import numpy as np
+import pandas as pd
+
+from instrumentation import stage
+
+try:
+    import orjson
+except ImportError:  # orjson is optional; the json module is always available
+    orjson = None
+
+try:
+    import msgpack
+except ImportError:  # MessagePack responses are offered only when msgpack is installed
+    msgpack = None
+
+try:
+    import pyarrow
+    import pyarrow.ipc
+except ImportError:  # Arrow IPC responses are offered only when pyarrow is installed
+    pyarrow = None
+
+JSON_MIMETYPE = 'application/json'
+MSGPACK_MIMETYPE = 'application/msgpack'
+ARROW_MIMETYPE = 'application/vnd.apache.arrow.stream'
+
+
+def _json_default(obj):
+    # Objects orjson/json cannot encode natively: non-contiguous or object arrays, pandas and NumPy scalars
+    if isinstance(obj, (pd.Series, pd.Index)):
+        obj = obj.to_numpy()
+    if isinstance(obj, np.ndarray):
+        if orjson is not None and obj.dtype.kind in 'biuf':
+            return np.ascontiguousarray(obj, dtype=np.float64 if obj.dtype.kind == 'f' else None)
+        return to_list(obj)
+    if isinstance(obj, np.generic):
+        return obj.item()
+    raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
+
+
+def to_list(values):
+    """An array as a list with NaN/None/NA as None (for encoders without NumPy support)."""
+    values = np.asarray(values)
+    if values.dtype.kind == 'f':
+        return np.where(np.isnan(values), None, values).tolist()
+    if values.dtype.kind == 'O':
+        return [None if value is None or value is pd.NA or (isinstance(value, float) and np.isnan(value)) else value
+                for value in values.tolist()]
+    return values.tolist()
+
+
+def dumps(obj, sort_keys=False):
+    """
+    Encode an object as JSON bytes.
+
+    NumPy arrays, NumPy scalars and pandas Series may appear anywhere in
+    `obj` and are written without converting them to lists first (with
+    orjson); NaN is written as null.
+
+    Args:
+        obj: The object to encode.
+        sort_keys (bool): Sort object keys, like Flask's default provider.
+
+    Returns:
+        bytes: Compact UTF-8 JSON.
+    """
+    if orjson is not None:
+        option = orjson.OPT_SERIALIZE_NUMPY | (orjson.OPT_SORT_KEYS if sort_keys else 0)
+        return orjson.dumps(obj, default=_json_default, option=option)
+    return json.dumps(obj, default=_json_default, sort_keys=sort_keys, separators=(',', ':'), allow_nan=False).encode()
+
+
+def loads(data):
+    return orjson.loads(data) if orjson is not None else json.loads(data)
+
+
+def array_tokens(values):
+    """
+    The JSON encoding of every element of a 1-D array, as a list of bytes.
+
+    Numeric arrays are encoded in one call and split on commas (numbers
+    contain none); other arrays are encoded element by element.
+    """
+    values = np.asarray(values)
+    if len(values) == 0:
+        return []
+    if values.dtype.kind == 'f' and values.dtype != np.float64:
+        # Compact float32 columns are written with the float64 repr of their values, as before
+        values = values.astype(np.float64)
+    if values.dtype.kind in 'biuf':
+        return dumps(values)[1:-1].split(b',')
+    return [dumps(value) for value in to_list(values)]
+
+
+def available_mimetypes(tabular=False):
+    """Response content types this process can produce, JSON first."""
+    mimetypes = [JSON_MIMETYPE]
+    if msgpack is not None:
+        mimetypes.append(MSGPACK_MIMETYPE)
+    if tabular and pyarrow is not None:
+        mimetypes.append(ARROW_MIMETYPE)
+    return mimetypes
+
+
+def negotiate(accept_mimetypes, tabular=False):
+    """Pick the response content type for a request's Accept header (JSON by default)."""
+    return accept_mimetypes.best_match(available_mimetypes(tabular), default=JSON_MIMETYPE)
+
+
+def encode(obj, mimetype=JSON_MIMETYPE):
+    """Encode a response document as JSON or MessagePack."""
+    with stage('serialize_json' if mimetype == JSON_MIMETYPE else 'serialize_msgpack'):
+        if mimetype == MSGPACK_MIMETYPE:
+            return msgpack.packb(obj, default=_msgpack_default)
+        return dumps(obj)
+
+
+def _msgpack_default(obj):
+    if isinstance(obj, (np.ndarray, pd.Series, pd.Index)):
+        return to_list(obj)
+    if isinstance(obj, np.generic):
+        return obj.item()
+    raise TypeError(f"Object of type {type(obj).__name__} is not MessagePack serializable")
+
+
+def encode_columns(columns, n_rows, mimetype=JSON_MIMETYPE):
+    """
+    Encode a table held as column arrays.
+
+    Args:
+        columns (dict): Column name -> 1-D array, all of length `n_rows`.
+        n_rows (int): Number of rows.
+        mimetype (str): JSON and MessagePack produce `{"columns": {...},
+            "n_rows": n}`; Arrow produces an IPC stream with one record batch.
+
+    Returns:
+        bytes: The encoded table.
+    """
+    if mimetype == ARROW_MIMETYPE:
+        with stage('serialize_arrow'):
+            table = pyarrow.table({name: pyarrow.array(values, from_pandas=True) for name, values in columns.items()})
+            sink = pyarrow.BufferOutputStream()
+            with pyarrow.ipc.new_stream(sink, table.schema) as writer:
+                writer.write_table(table)
+            return sink.getvalue().to_pybytes()
+    return encode({'columns': columns, 'n_rows': n_rows}, mimetype)
+
+
+def respond(obj, status=200, tabular=False):
+    """
+    Flask response for a document in the content type the request's Accept
+    header prefers: JSON through the app's provider (like jsonify), or
+    MessagePack when it is installed and asked for.
+    """
+    from flask import current_app, request
+
+    mimetype = negotiate(request.accept_mimetypes, tabular=tabular)
+    if mimetype == JSON_MIMETYPE:
+        response = current_app.json.response(obj)
+    else:
+        response = current_app.response_class(encode(obj, mimetype), mimetype=mimetype)
+    response.status_code = status
+    response.vary.add('Accept')
+    return response
+
+
+def json_provider(app):
+    """
+    A Flask JSON provider that encodes with `dumps`, so handlers can pass
+    NumPy arrays to `jsonify` as they are.
+    """
+    from flask.json.provider import JSONProvider
+
+    class NumpyJSONProvider(JSONProvider):
+        # Same key order as Flask's default provider
+        sort_keys = True
+
+        def dumps(self, obj, **kwargs):
+            return dumps(obj, sort_keys=kwargs.get('sort_keys', self.sort_keys)).decode()
+
+        def loads(self, s, **kwargs):
+            return loads(s)
+
+        def response(self, *args, **kwargs):
+            obj = self._prepare_response_obj(args, kwargs)
+            with stage('serialize_json'):
+                body = dumps(obj, sort_keys=self.sort_keys)
+            return self._app.response_class(body, mimetype=JSON_MIMETYPE)
+
+    return NumpyJSONProvider(app)